@@ -0,0 +1,78 @@
+"""
+Memory allocated by the resolver while building the output
+
+The output of a template is built from the resolved values of every template
+object and array. The benchmark reports the memory allocated at the peak of the
+resolution (tracemalloc) on top of the memory retained by the result, i.e. the
+intermediate containers created by the resolver, and the resolution time for:
+
+- bundle: Bundle of entries produced by a for block, every entry has nested objects
+- wide: object with thousands of keys, e.g. a lookup table
+
+Usage:
+    python benchmarks/iterate_node_allocations.py [--entries 300]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from fpml import resolve_template
+
+
+def make_bundle(entries: int) -> tuple[dict, dict]:
+    template = {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [
+            {
+                "{% for index in %indexes %}": {
+                    "request": {"method": "POST", "url": "Observation"},
+                    "resource": {
+                        "resourceType": "Observation",
+                        "status": "final",
+                        "code": {"coding": [{"system": "http://loinc.org", "code": "1-8"}]},
+                        "valueQuantity": {"value": "{{ %index }}", "unit": "kg"},
+                        "note": {"text": "{{ %missing }}"},
+                    },
+                }
+            }
+        ],
+    }
+    return template, {"indexes": list(range(entries)), "missing": []}
+
+
+def make_wide(entries: int) -> tuple[dict, dict]:
+    template = {f"key{index}": {"value": index, "empty": {}} for index in range(entries * 5)}
+    return template, {}
+
+
+def measure(template: dict, context: dict) -> tuple[int, int, float]:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    result = resolve_template({}, template, context)
+    elapsed = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert result
+    return retained - before, peak - retained, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=300)
+    args = parser.parse_args()
+
+    for name, make in [("bundle", make_bundle), ("wide", make_wide)]:
+        template, context = make(args.entries)
+        retained, transient, elapsed = measure(template, context)
+        print(
+            f"{name}: result {retained / 1024:.0f} KiB, "
+            f"transient peak {transient / 1024:.0f} KiB, {elapsed * 1000:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
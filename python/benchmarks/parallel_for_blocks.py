@@ -0,0 +1,76 @@
+"""
+Duration of a for block resolved sequentially and in parallel threads
+
+Every iteration of the for block calls a user-defined function waiting for a simulated
+terminology server (`time.sleep` releases the GIL like socket I/O) and evaluates a few
+expressions. The iterations waiting for I/O overlap in the pool. With `--latency 0`
+only the expressions remain, which are bound by the GIL and run no faster in threads,
+except on free-threaded builds (python3.13t).
+
+Usage:
+    python benchmarks/parallel_for_blocks.py [--iterations 400] [--latency 2] [--threads 2 4 8]
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from fpml import compile_template, resolve_template
+from fpml.core.core_types import FPOptions, ParallelOptions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=2, help="milliseconds per lookup")
+    parser.add_argument("--threads", type=int, nargs="+", default=[2, 4, 8])
+    args = parser.parse_args()
+
+    def lookup(inputs: list[Any]) -> list[Any]:
+        time.sleep(args.latency / 1000)
+        return [f"{code}-display" for code in inputs]
+
+    fp_options: FPOptions = {"userInvocationTable": {"lookup": {"fn": lookup, "arity": {0: []}}}}
+    context = {"codes": [f"code-{index}" for index in range(args.iterations)]}
+    template = compile_template(
+        {
+            "resourceType": "Bundle",
+            "entry": [
+                {
+                    "{% for index, code in %codes %}": {
+                        "fullUrl": "urn:uuid:{{ %index }}",
+                        "resource": {
+                            "code": "{{ %code }}",
+                            "display": "{{ %code.lookup() }}",
+                            "rank": "{{ (%index * 7).mod(13) + %code.length() }}",
+                        },
+                    }
+                }
+            ],
+        }
+    )
+
+    def measure(parallel: Optional[ParallelOptions]) -> float:
+        # The best of 3 runs
+        durations = []
+        for _ in range(3):
+            started = time.perf_counter()
+            resolve_template({}, template, context, fp_options, parallel=parallel)
+            durations.append(time.perf_counter() - started)
+        return min(durations)
+
+    print(
+        f"python {sys.version.split()[0]}, iterations {args.iterations}, latency {args.latency} ms"
+    )
+    sequential = measure(None)
+    print(f"sequential: {sequential:.3f} s")
+    for threads in args.threads:
+        with ThreadPoolExecutor(threads) as executor:
+            elapsed = measure({"executor": executor, "min_iterations": 1})
+        print(f"threads {threads}: {elapsed:.3f} s, speedup {sequential / elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Memory benchmark of the templates shared by pre-forked workers
+
+The master process loads a registry of templates and forks workers,
+each worker resolves every template once and runs the garbage collector
+as a long-living worker would. The private memory of a worker (pages
+copied from the master or allocated by the worker) is reported for:
+
+- cold: raw templates are loaded in the master, every worker compiles them on first
+  use and keeps them for the next requests
+- warm: templates are compiled by `warm_up` in the master before fork
+
+Usage (Linux only):
+    python benchmarks/prefork_memory.py [--templates 200] [--workers 4]
+"""
+
+import argparse
+import copy
+import gc
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import yaml
+
+from fpml import CompiledTemplate, compile_template, resolve_template, warm_up
+
+fixtures = Path(__file__).parent.parent / "tests" / "core" / "fixtures"
+
+
+def load_fixture(filename: str):
+    with open(fixtures / filename) as file:
+        return yaml.load(file, Loader=yaml.Loader)
+
+
+def private_memory_kb() -> int:
+    with open("/proc/self/smaps_rollup") as file:
+        return sum(
+            int(line.split()[1])
+            for line in file
+            if line.startswith(("Private_Clean:", "Private_Dirty:"))
+        )
+
+
+def make_registry(count: int) -> dict:
+    template = load_fixture("complex-example.aidbox.template.yaml")
+    registry = {}
+    for index in range(count):
+        # Every template gets its own expressions like a real registry of different templates
+        registry[f"template-{index}"] = yaml.load(
+            yaml.dump(template).replace("WEIGHT", f"WEIGHT{index}"), Loader=yaml.Loader
+        )
+    return registry
+
+
+def run_worker(registry: dict, resource: dict, context: dict, write_fd: int) -> None:
+    before = private_memory_kb()
+    # Templates compiled by the worker itself are kept like the ones compiled by the master
+    compiled = {}
+    for name, template in registry.items():
+        if name not in compiled:
+            compiled[name] = (
+                template if isinstance(template, CompiledTemplate) else compile_template(template)
+            )
+        resolve_template(resource, compiled[name], context)
+    gc.collect()
+    after = private_memory_kb()
+    os.write(write_fd, f"{before} {after}".encode())
+    os._exit(0)
+
+
+def measure(mode: str, templates: int, workers: int) -> list[int]:
+    registry = make_registry(templates)
+    context = load_fixture("complex-example.aidbox.context.yaml")
+    resource = copy.deepcopy(context["QuestionnaireResponse"])
+
+    if mode == "warm":
+        registry = warm_up(registry)
+    else:
+        gc.collect()
+
+    results = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            run_worker(registry, resource, context, write_fd)
+        os.close(write_fd)
+        _before, after = map(int, os.read(read_fd, 100).decode().split())
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        results.append(after)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--templates", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--mode", choices=["cold", "warm"])
+    args = parser.parse_args()
+
+    if args.mode:
+        results = measure(args.mode, args.templates, args.workers)
+        print(sum(results) // len(results))
+        return
+
+    # Every mode is measured in a fresh interpreter, so they do not share the state
+    report = {}
+    for mode in ["cold", "warm"]:
+        command = [
+            sys.executable,
+            __file__,
+            f"--mode={mode}",
+            f"--templates={args.templates}",
+            f"--workers={args.workers}",
+        ]
+        report[mode] = int(subprocess.run(command, capture_output=True, check=True).stdout)
+
+    print(f"templates: {args.templates}, workers: {args.workers}")
+    print(f"cold: {report['cold'] / 1024:.1f} MiB private memory per worker")
+    print(f"warm: {report['warm'] / 1024:.1f} MiB private memory per worker")
+    print(f"saving: {(report['cold'] - report['warm']) / 1024:.1f} MiB per worker")
+
+
+if __name__ == "__main__":
+    main()
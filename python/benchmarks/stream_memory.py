@@ -0,0 +1,82 @@
+"""
+Peak memory of writing a huge Bundle resolved at once and streamed
+
+A transaction Bundle with an entry per item of the context is written to
+/dev/null, the peak of the allocated memory (tracemalloc) and the time are
+reported for the following ways. The time is measured by another run without
+tracemalloc, which slows down the allocations.
+
+- resolve: `resolve_template` followed by `json.dump` of the result
+- stream: `resolve_template_stream` writing the chunks as they come
+
+Usage:
+    python benchmarks/stream_memory.py [--entries 20000]
+"""
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+from typing import Callable, TextIO
+
+from fpml import resolve_template, resolve_template_stream
+
+template = {
+    "resourceType": "Bundle",
+    "type": "transaction",
+    "entry": [
+        {
+            "{% for index in %indexes %}": {
+                "request": {"method": "POST", "url": "Observation"},
+                "resource": {
+                    "resourceType": "Observation",
+                    "status": "final",
+                    "code": {"coding": [{"system": "http://loinc.org", "code": "29463-7"}]},
+                    "valueQuantity": {"value": "{{ %index }}", "unit": "kg"},
+                },
+            }
+        }
+    ],
+}
+
+
+def write_resolved(context: dict, file: TextIO) -> None:
+    json.dump(resolve_template({}, template, context), file)
+
+
+def write_streamed(context: dict, file: TextIO) -> None:
+    for chunk in resolve_template_stream({}, template, context):
+        file.write(chunk)
+
+
+def measure(write: Callable[[dict, TextIO], None], context: dict) -> tuple[int, float]:
+    with open(os.devnull, "w") as file:
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        write(context, file)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        started = time.perf_counter()
+        write(context, file)
+        elapsed = time.perf_counter() - started
+    return peak - before, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=20000)
+    args = parser.parse_args()
+
+    context = {"indexes": list(range(args.entries))}
+    for name, write in [("resolve", write_resolved), ("stream", write_streamed)]:
+        peak, elapsed = measure(write, context)
+        print(
+            f"{name}: peak {peak / 1024 / 1024:.1f} MiB, {elapsed:.2f} s, "
+            f"{args.entries / elapsed:.0f} entries/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
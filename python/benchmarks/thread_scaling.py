@@ -0,0 +1,72 @@
+"""
+Throughput of `resolve_batch` by the number of threads
+
+The complex FHIR example is resolved for a batch of QuestionnaireResponses with
+one compiled template shared by the threads. With the GIL the throughput stays
+flat (or drops because of contention), on free-threaded builds (python3.13t)
+it scales with the number of cores.
+
+Usage:
+    python benchmarks/thread_scaling.py [--resources 400] [--threads 1 2 4 8]
+    python3.13t benchmarks/thread_scaling.py
+"""
+
+import argparse
+import copy
+import os
+import sys
+import sysconfig
+import time
+from pathlib import Path
+from typing import cast
+
+import yaml
+from fhirpathpy.models import models
+
+from fpml import compile_template, resolve_batch
+from fpml.core.core_types import FPOptions
+
+fixtures = Path(__file__).parent.parent / "tests" / "core" / "fixtures"
+
+
+def load_fixture(filename: str):
+    with open(fixtures / filename) as file:
+        return yaml.load(file, Loader=yaml.Loader)
+
+
+def gil_enabled() -> bool:
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled() if is_gil_enabled else True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resources", type=int, default=400)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    context = load_fixture("complex-example.fhir.context.yaml")
+    template = compile_template(load_fixture("complex-example.fhir.template.yaml"))
+    resources = [copy.deepcopy(context["QuestionnaireResponse"]) for _ in range(args.resources)]
+    fp_options = cast(FPOptions, {"model": models["r4"]})
+
+    free_threaded = bool(sysconfig.get_config_var("Py_GIL_DISABLED"))
+    print(
+        f"python {sys.version.split()[0]}, free-threaded build: {free_threaded}, "
+        f"GIL enabled: {gil_enabled()}, cpus: {os.cpu_count()}"
+    )
+
+    baseline = None
+    for threads in args.threads:
+        started = time.perf_counter()
+        resolve_batch(resources, template, context, fp_options, max_workers=threads)
+        elapsed = time.perf_counter() - started
+        throughput = len(resources) / elapsed
+        baseline = baseline or throughput
+        print(
+            f"threads {threads}: {throughput:.0f} resources/s, speedup {throughput / baseline:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
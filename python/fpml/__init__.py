@@ -1,12 +1,54 @@
-import importlib.metadata
+from typing import Any
 
-from .core.core_exceptions import FPMLValidationError
+from .core.batch import resolve_batch
+from .core.cache import SubtreeCache
+from .core.columnar import IndexedCollection
+from .core.compiler import CompiledTemplate, compile_template
+from .core.core_exceptions import FPMLLimitExceededError, FPMLValidationError
+from .core.disk_cache import TemplateDiskCache
 from .core.extract import resolve_template
+from .core.functions import (
+    ConceptMapTranslator,
+    answers_function,
+    resolve_function,
+    translate_function,
+)
+from .core.incremental import IncrementalResolver
+from .core.prefork import warm_up
+from .core.registry import TemplateRegistry
+from .core.specialize import specialize
+from .core.stream import resolve_template_stream
+from .core.utils import package_version
 
 __title__ = "fpml"
-__version__ = importlib.metadata.version("fpml")
 __author__ = "beda.software"
 __license__ = "MIT"
 __copyright__ = "Copyright 2025 beda.software"
 
-__all__ = ["FPMLValidationError", "resolve_template"]
+__all__ = [
+    "CompiledTemplate",
+    "ConceptMapTranslator",
+    "FPMLLimitExceededError",
+    "FPMLValidationError",
+    "IncrementalResolver",
+    "IndexedCollection",
+    "SubtreeCache",
+    "TemplateDiskCache",
+    "TemplateRegistry",
+    "answers_function",
+    "compile_template",
+    "resolve_batch",
+    "resolve_function",
+    "resolve_template",
+    "resolve_template_stream",
+    "specialize",
+    "translate_function",
+    "warm_up",
+]
+
+
+def __getattr__(name: str) -> Any:
+    # The version is read from the package metadata on first access
+    if name == "__version__":
+        return package_version("fpml")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
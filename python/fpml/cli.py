@@ -0,0 +1,314 @@
+"""
+Command-line interface resolving a template against a batch of resources
+
+    fpml template.yaml patient-1.json patient-2.json --context context.yaml
+    cat resources.ndjson | fpml template.yaml --workers 8 > results.ndjson
+
+Results are written to stdout as NDJSON, one line per resource.
+"""
+
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import IO, Any, Optional, cast
+
+from .core.compiler import CompiledTemplate, compile_template
+from .core.core_exceptions import FPMLValidationError
+from .core.core_types import FPOptions
+from .core.extract import resolve_template
+
+# Resources sent to a worker at once and the number of chunks processed concurrently per worker
+chunk_size = 64
+chunks_per_worker = 4
+
+# Record name and the serialized resource
+Record = tuple[str, str]
+# Record name, serialized output and error message
+Output = tuple[str, Optional[str], Optional[str]]
+
+
+class Resolver:
+    """
+    Resolver of the records, the template is compiled once per process
+
+    Every resource is also available as the context variable named after its
+    resource type, e.g. %QuestionnaireResponse, as required by strict mode.
+    """
+
+    def __init__(
+        self,
+        template: CompiledTemplate,
+        context: Optional[dict[str, Any]],
+        model: Optional[str],
+        strict: bool,
+    ) -> None:
+        self.template = template
+        self.context = context
+        self.model = model
+        self.strict = strict
+        self.fp_options: Optional[FPOptions] = None
+        if model:
+            from fhirpathpy.models import models  # type: ignore
+
+            self.fp_options = cast(FPOptions, {"model": models[model]})
+        self.durations: list[float] = []
+
+    def resolve(self, records: list[Record]) -> list[Output]:
+        outputs: list[Output] = []
+        for name, raw in records:
+            started = time.perf_counter()
+            try:
+                resource = json.loads(raw)
+                context = {
+                    **(self.context or {}),
+                    resource.get("resourceType", "Resource"): resource,
+                }
+                result = resolve_template(
+                    resource, self.template, context, self.fp_options, self.strict
+                )
+                outputs.append((name, json.dumps(result, ensure_ascii=False), None))
+            except FPMLValidationError as exc:
+                outputs.append((name, None, f"{exc.error_message}. Path '{exc.error_path}'"))
+            except (ValueError, AttributeError) as exc:
+                outputs.append((name, None, f"Invalid resource: {exc}"))
+            self.durations.append(time.perf_counter() - started)
+        return outputs
+
+
+# Resolver of the worker process created by the pool initializer
+worker_resolver: Optional[Resolver] = None
+
+
+def init_worker(*args: Any) -> None:
+    global worker_resolver  # noqa: PLW0603
+    worker_resolver = Resolver(*args)
+
+
+def resolve_in_worker(records: list[Record]) -> tuple[list[Output], list[float]]:
+    assert worker_resolver is not None
+    worker_resolver.durations = []
+    outputs = worker_resolver.resolve(records)
+    return outputs, worker_resolver.durations
+
+
+def resolve_records(
+    resolver: Resolver,
+    records: Iterable[Record],
+    workers: int,
+    ordered: bool,
+    threads: bool = False,
+) -> Iterator[Output]:
+    """
+    Resolves the records in the worker processes (or threads)
+
+    The number of chunks in flight is bounded, so the input is read as fast as
+    it is processed and arbitrary long streams do not fill the memory.
+    Threads share the resolver, so the compiled template is not pickled.
+    """
+    chunks = iter_chunks(records, chunk_size)
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield from resolver.resolve(chunk)
+        return
+
+    executor: Executor = (
+        ThreadPoolExecutor(workers)
+        if threads
+        else ProcessPoolExecutor(
+            workers,
+            initializer=init_worker,
+            initargs=(resolver.template, resolver.context, resolver.model, resolver.strict),
+        )
+    )
+    with executor:
+        pending: deque[Future] = deque()
+        max_pending = workers * chunks_per_worker
+
+        def submit(chunk: list[Record]) -> Future:
+            if threads:
+                return executor.submit(resolver.resolve, chunk)
+            return executor.submit(resolve_in_worker, chunk)
+
+        def collect(future: Future) -> list[Output]:
+            if threads:
+                return future.result()
+            outputs, durations = future.result()
+            resolver.durations.extend(durations)
+            return outputs
+
+        for chunk in chunks:
+            pending.append(submit(chunk))
+            while len(pending) >= max_pending:
+                if ordered:
+                    yield from collect(pending.popleft())
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                        yield from collect(future)
+
+        while pending:
+            yield from collect(pending.popleft())
+
+
+def iter_chunks(records: Iterable[Record], size: int) -> Iterator[list[Record]]:
+    chunk: list[Record] = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_records(paths: list[str], stdin: IO[str]) -> Iterator[Record]:
+    """
+    Reads the resources from the files or NDJSON from stdin (path `-`)
+    """
+    for path in paths or ["-"]:
+        if path == "-" or path.endswith(".ndjson"):
+            file = stdin if path == "-" else open(path)  # noqa: SIM115
+            prefix = "" if path == "-" else f"{base_name(path)}-"
+            with file:
+                for index, line in enumerate(file, 1):
+                    if line.strip():
+                        yield f"{prefix}{index}", line
+        else:
+            yield base_name(path), json.dumps(load_file(path))
+
+
+def base_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def load_file(path: str) -> Any:
+    with open(path) as file:
+        if not path.endswith((".yaml", ".yml")):
+            return json.load(file)
+
+        try:
+            import yaml
+        except ImportError:  # pragma: no cover
+            raise SystemExit("PyYAML is required to read YAML files: pip install pyyaml") from None
+
+        return yaml.safe_load(file)
+
+
+def write_outputs(
+    outputs: Iterable[Output], output: Optional[str], output_dir: Optional[str], stdout: IO[str]
+) -> int:
+    errors = 0
+    file = open(output, "w") if output else stdout  # noqa: SIM115
+    try:
+        for name, result, error in outputs:
+            if error is not None:
+                errors += 1
+                sys.stderr.write(f"{name}: {error}\n")
+            elif output_dir:
+                with open(os.path.join(output_dir, f"{name}.json"), "w") as result_file:
+                    result_file.write(result or "")
+            else:
+                file.write(f"{result}\n")
+    finally:
+        if output:
+            file.close()
+    return errors
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="fpml", description="Resolve FHIRPath mapping language template"
+    )
+    parser.add_argument("template", help="template file (JSON or YAML)")
+    parser.add_argument(
+        "resources",
+        nargs="*",
+        help="resource files (JSON, YAML or NDJSON), NDJSON is read from stdin by default or `-`",
+    )
+    parser.add_argument("-c", "--context", help="context variables file (JSON or YAML)")
+    parser.add_argument("--strict", action="store_true", help="enforce strict mode")
+    parser.add_argument(
+        "--model", choices=["dstu2", "stu3", "r4", "r5"], help="FHIR data-model of fhirpath"
+    )
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of processes")
+    parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="use threads instead of processes with --workers, e.g. on free-threaded Python",
+    )
+    parser.add_argument(
+        "--ordered", action="store_true", help="keep the order of the input with --workers"
+    )
+    parser.add_argument("--profile", action="store_true", help="print profile to stderr")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("-o", "--output", help="NDJSON file of the results instead of stdout")
+    output.add_argument("--output-dir", help="directory of JSON files named after the resources")
+    return parser
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = make_parser().parse_intermixed_args(argv)
+
+    started = time.perf_counter()
+    try:
+        template = compile_template(load_file(args.template), args.strict)
+    except FPMLValidationError as exc:
+        sys.stderr.write(f"{args.template}: {exc.error_message}. Path '{exc.error_path}'\n")
+        return 2
+    compiled = time.perf_counter()
+
+    context = load_file(args.context) if args.context else None
+    resolver = Resolver(template, context, args.model, args.strict)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    profiler = cProfile.Profile() if args.profile and args.workers <= 1 else None
+    if profiler:
+        profiler.enable()
+    records = iter_records(args.resources, sys.stdin)
+    outputs = resolve_records(resolver, records, args.workers, args.ordered, args.threads)
+    errors = write_outputs(outputs, args.output, args.output_dir, sys.stdout)
+    if profiler:
+        profiler.disable()
+
+    if args.profile:
+        write_profile(resolver.durations, compiled - started, time.perf_counter() - compiled)
+        if profiler:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(20)
+            sys.stderr.write(stream.getvalue())
+
+    return 1 if errors else 0
+
+
+def write_profile(durations: list[float], compile_time: float, total_time: float) -> None:
+    count = len(durations)
+    ordered = sorted(durations)
+
+    def percentile(value: float) -> float:
+        return ordered[min(count - 1, int(count * value))] * 1000 if count else 0.0
+
+    sys.stderr.write(
+        f"compile: {compile_time * 1000:.1f} ms\n"
+        f"resources: {count} in {total_time:.2f} s"
+        f" ({count / total_time if total_time else 0:.0f}/s)\n"
+        f"resolve: p50 {percentile(0.5):.2f} ms, p95 {percentile(0.95):.2f} ms,"
+        f" max {percentile(1):.2f} ms\n"
+    )
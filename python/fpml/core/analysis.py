@@ -0,0 +1,354 @@
+import re
+from functools import cache, lru_cache
+from typing import Any, Optional, cast
+
+from .core_types import Path
+
+# Functions returning different results for the same input
+volatile_functions = frozenset(["now", "today", "timeOfDay"])
+
+# Functions which results depend on the whole context besides their input and arguments
+context_functions = frozenset(["resolve"])
+
+# Functions which do not use their input, but only the arguments
+input_independent_functions = frozenset(["iif", *volatile_functions])
+
+
+@cache
+def root_argument_functions() -> frozenset[str]:
+    """
+    Functions evaluating their arguments against the resource instead of the input
+    """
+    # fhirpathpy is imported on first use to keep `import fpml` fast
+    from fhirpathpy.engine.invocations import invocation_registry  # type: ignore
+
+    return frozenset(
+        name
+        for name, definition in cast(dict[str, dict], invocation_registry).items()
+        if any("AnyAtRoot" in params for params in definition.get("arity", {}).values())
+    )
+
+
+class ExpressionInfo:
+    """
+    Static facts about a FHIRPath expression gathered from its syntax tree
+
+    Attributes:
+        variables (frozenset[str]): Names of the %variables used by the expression.
+        functions (frozenset[str]): Names of the functions invoked by the expression.
+        reads_resource (bool): Whether the expression navigates the resource,
+            i.e. the result might depend on something except %variables and literals.
+    """
+
+    __slots__ = ("functions", "reads_resource", "variables")
+
+    def __init__(
+        self, variables: frozenset[str], functions: frozenset[str], reads_resource: bool
+    ) -> None:
+        self.variables = variables
+        self.functions = functions
+        self.reads_resource = reads_resource
+
+    @property
+    def volatile(self) -> bool:
+        return not (
+            self.functions.isdisjoint(volatile_functions)
+            and self.functions.isdisjoint(context_functions)
+        )
+
+
+@lru_cache(maxsize=4096)
+def parse_expression(expression: str) -> Any:
+    from fhirpathpy.parser import parse  # type: ignore
+
+    # Parsed syntax trees are not modified by evaluation, so they are shared
+    return parse(expression)
+
+
+def condition_expression(expression: str) -> str:
+    # Conditions of if blocks are evaluated as boolean
+    return f"iif({expression}, true, false)"
+
+
+@lru_cache(maxsize=4096)
+def analyze_expression(expression: str) -> ExpressionInfo:
+    variables: set[str] = set()
+    functions: set[str] = set()
+    reads_resource = False
+
+    try:
+        tree = parse_expression(expression)
+    except Exception:
+        # Invalid expressions are reported by the resolver, here they are treated as unknown
+        return ExpressionInfo(frozenset(), frozenset(), reads_resource=True)
+
+    # Every syntax node is visited together with the flag telling whether
+    # the invocations at this position are applied to the resource itself
+    stack = [(tree, True)]
+    while stack:
+        node, at_root = stack.pop()
+        node_type = node.get("type")
+        children = node.get("children", [])
+
+        if node_type == "ExternalConstant" and children:
+            variables.add(identifier_name(children[0]))
+        elif node_type == "InvocationExpression" and len(children) == 2:  # noqa: PLR2004
+            # The invocation is applied to the result of the left expression
+            stack.append((children[0], at_root))
+            stack.append((children[1], False))
+            continue
+        elif node_type == "InvocationTerm" and at_root:
+            invocation = children[0] if children else {}
+            name = function_name(invocation)
+            if name not in input_independent_functions:
+                reads_resource = True
+        elif node_type == "Functn" and children:
+            name = identifier_name(children[0])
+            functions.add(name)
+            if name in root_argument_functions():
+                stack.extend((child, True) for child in children)
+                continue
+
+        stack.extend((child, at_root) for child in children)
+
+    return ExpressionInfo(frozenset(variables), frozenset(functions), reads_resource)
+
+
+def function_name(invocation: dict) -> Optional[str]:
+    if invocation.get("type") != "FunctionInvocation":
+        return None
+    functn = invocation["children"][0]
+    return identifier_name(functn["children"][0])
+
+
+def identifier_name(node: dict) -> str:
+    # The same normalization as fhirpathpy applies to identifiers
+    return re.sub(r"(^\"|\"$)", "", node["text"]).replace("`", "")
+
+
+# The same patterns as the resolver uses to find expressions in the template
+array_template_regexp = re.compile(r"{\[\s*([\s\S]+?)\s*\]}")
+single_template_regexp = re.compile(r"{{\+?\s*([\s\S]+?)\s*\+?}}")
+context_key_regexp = re.compile(r"{{\s*(.+?)\s*}}")
+for_key_regexp = re.compile(r"{%\s*for\s+(?:(\w+?)\s*,\s*)?(\w+?)\s+in\s+(.+?)\s*%}")
+if_key_regexp = re.compile(r"{%\s*if\s+(.+?)\s*%}")
+assign_key_regexp = re.compile(r"{%\s*assign\s*%}")
+else_key_regexp = re.compile(r"{%\s*else\s*%}")
+merge_key_regexp = re.compile(r"{%\s*merge\s*%}")
+
+
+class NodeInfo:
+    """
+    Static facts about a template node and all its descendants
+
+    Attributes:
+        variables (frozenset[str]): Names of the %variables used by the subtree.
+        reads_resource (bool): Whether the output might depend on the resource.
+        volatile (bool): Whether the output might differ for the same input.
+    """
+
+    __slots__ = ("reads_resource", "variables", "volatile")
+
+    def __init__(self, variables: frozenset[str], reads_resource: bool, volatile: bool) -> None:
+        self.variables = variables
+        self.reads_resource = reads_resource
+        self.volatile = volatile
+
+
+def analyze_node(node: Any, memo: dict[int, tuple[Any, NodeInfo]]) -> NodeInfo:
+    """
+    Analyzes template node reusing the results for already analyzed nodes
+
+    The memo keeps references to the analyzed nodes, so their ids are not reused.
+    """
+    cached = memo.get(id(node))
+    if cached is not None and cached[0] is node:
+        return cached[1]
+
+    variables: set[str] = set()
+    reads_resource = False
+    volatile = False
+
+    def add_expression(expression: str) -> None:
+        nonlocal reads_resource, volatile
+        info = analyze_expression(expression)
+        variables.update(info.variables)
+        reads_resource = reads_resource or info.reads_resource
+        volatile = volatile or info.volatile
+
+    def add_child(child: Any, resource_independent: bool = False) -> None:
+        nonlocal reads_resource, volatile
+        info = analyze_node(child, memo)
+        variables.update(info.variables)
+        reads_resource = reads_resource or (info.reads_resource and not resource_independent)
+        volatile = volatile or info.volatile
+
+    if isinstance(node, dict):
+        for key, value in node.items():
+            expression, rebinds_resource = block_expression(key)
+            if expression is not None:
+                add_expression(expression)
+            add_child(value, resource_independent=rebinds_resource)
+    elif isinstance(node, list):
+        for value in node:
+            add_child(value)
+    elif isinstance(node, str):
+        for expression in string_expressions(node):
+            add_expression(expression)
+
+    info = NodeInfo(frozenset(variables), reads_resource, volatile)
+    memo[id(node)] = (node, info)
+
+    return info
+
+
+def find_resource_reads(node: Any, path: Optional[Path] = None) -> list[tuple[Path, str]]:
+    """
+    Finds expressions navigating the resource, i.e. violating strict mode
+
+    Content of context blocks is resolved against the results of the block
+    expression, so only the block expression itself is checked.
+
+    >>> find_resource_reads({"a": "{{ %Patient.id }}", "b": ["{{ id }}"]})
+    [(['b', 0], 'id')]
+    """
+    path = path or []
+    reads: list[tuple[Path, str]] = []
+
+    if isinstance(node, dict):
+        for key, value in node.items():
+            expression, rebinds_resource = block_expression(key)
+            if expression is not None and analyze_expression(expression).reads_resource:
+                reads.append((path, expression))
+            if not rebinds_resource:
+                reads.extend(find_resource_reads(value, [*path, key]))
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            reads.extend(find_resource_reads(value, [*path, index]))
+    elif isinstance(node, str):
+        reads.extend(
+            (path, expression)
+            for expression in string_expressions(node)
+            if analyze_expression(expression).reads_resource
+        )
+
+    return reads
+
+
+def block_expression(key: str) -> tuple[Optional[str], bool]:
+    """
+    Returns the expression of the block key and whether the block content is resolved against its results
+    """  # noqa: E501
+    context_match = context_key_regexp.match(key)
+    if context_match:
+        return context_match.group(1), True
+    for_match = for_key_regexp.match(key)
+    if for_match:
+        return for_match.group(3), False
+    if_match = if_key_regexp.match(key)
+    if if_match:
+        return if_match.group(1), False
+    return None, False
+
+
+def string_expressions(node: str) -> list[str]:
+    array_match = array_template_regexp.match(node)
+    if array_match:
+        return [array_match.group(1)]
+    return [match.group(1) for match in single_template_regexp.finditer(node)]
+
+
+def collect_expressions(node: Any, path: Optional[Path] = None) -> list[tuple[Path, str]]:
+    """
+    Collects the expressions evaluated by the resolver for the template with their paths
+
+    >>> collect_expressions({"{% if %a %}": {"b": "{{ %b }}"}})
+    [([], 'iif(%a, true, false)'), (['{% if %a %}', 'b'], '%b')]
+    """
+    path = path or []
+    expressions: list[tuple[Path, str]] = []
+
+    if isinstance(node, dict):
+        for key, value in node.items():
+            expression, _ = block_expression(key)
+            if expression is not None:
+                if if_key_regexp.match(key):
+                    expression = condition_expression(expression)
+                expressions.append((path, expression))
+            expressions.extend(collect_expressions(value, [*path, key]))
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            expressions.extend(collect_expressions(value, [*path, index]))
+    elif isinstance(node, str):
+        expressions.extend((path, expression) for expression in string_expressions(node))
+
+    return expressions
+
+
+def find_shared_expressions(
+    node: Any, impure_functions: frozenset[str] = frozenset()
+) -> frozenset[str]:
+    """
+    Finds expressions which results depend only on the resource and the root context
+
+    Such expressions are evaluated against the root resource wherever they occur, i.e. not
+    within context blocks, and do not use variables bound by assign and for blocks. They are
+    not volatile and do not invoke impure functions, so they can be evaluated in advance.
+
+    >>> sorted(find_shared_expressions({
+    ...     "{% assign %}": [{"a": "{{ id }}"}],
+    ...     "b": "{{ %a }}",
+    ...     "c": {"{% for x in item %}": ["{{ id }}", "{{ %x }}"]},
+    ... }))
+    ['id', 'item']
+    """
+    shared: set[str] = set()
+    excluded: set[str] = set()
+
+    def add(expression: str, bound: frozenset[str], rebound: bool) -> None:
+        info = analyze_expression(expression)
+        if (
+            rebound
+            or info.volatile
+            or not info.variables.isdisjoint(bound)
+            or not info.functions.isdisjoint(impure_functions)
+        ):
+            excluded.add(expression)
+        else:
+            shared.add(expression)
+
+    def visit(node: Any, bound: frozenset[str], rebound: bool) -> None:
+        if isinstance(node, dict):
+            bound = bound | assigned_variables(node)
+            for key, value in node.items():
+                expression, rebinds_resource = block_expression(key)
+                if expression is not None:
+                    if if_key_regexp.match(key):
+                        expression = condition_expression(expression)
+                    add(expression, bound, rebound)
+                for_match = for_key_regexp.match(key)
+                value_bound = (
+                    bound | {name for name in for_match.groups()[:2] if name}
+                    if for_match
+                    else bound
+                )
+                visit(value, value_bound, rebound or rebinds_resource)
+        elif isinstance(node, list):
+            for value in node:
+                visit(value, bound, rebound)
+        elif isinstance(node, str):
+            for expression in string_expressions(node):
+                add(expression, bound, rebound)
+
+    visit(node, frozenset(), False)
+    return frozenset(shared - excluded)
+
+
+def assigned_variables(node: dict) -> frozenset[str]:
+    names: set[str] = set()
+    for key, value in node.items():
+        if assign_key_regexp.match(key):
+            for obj in value if isinstance(value, list) else [value]:
+                if isinstance(obj, dict):
+                    names.update(obj.keys())
+    return frozenset(names)
@@ -0,0 +1,167 @@
+import threading
+from collections.abc import Iterable
+from typing import Any, Callable, Optional
+
+from .analysis import analyze_expression, find_shared_expressions
+from .budget import ExecutionBudget
+from .cache import SubtreeCache, missing
+from .compiler import CompiledTemplate, compile_template
+from .core_types import Context, FPOptions, ResolveLimits, Resource
+from .extract import resolve_with_state
+from .state import ResolveState
+from .utils import copy_json
+
+
+def resolve_batch(  # noqa: PLR0913
+    resources: Iterable[Resource],
+    template: Any,
+    context: Optional[Context] = None,
+    fp_options: Optional[FPOptions] = None,
+    strict: bool = False,
+    limits: Optional[ResolveLimits] = None,
+    cache: Optional[SubtreeCache] = None,
+    max_workers: Optional[int] = None,
+    return_exceptions: bool = False,
+) -> list[Any]:
+    """
+    Resolves the template for every resource in a pool of threads.
+
+    The template is compiled once and shared by the threads without pickling, unlike
+    process pools. Resolutions share no mutable state except the thread-safe caches,
+    so on free-threaded Python builds (3.13t) they run in parallel. With the GIL the
+    threads pay off only for user-defined functions releasing it, e.g. doing I/O.
+
+    Expressions which results depend only on the resource and the context are evaluated
+    once per resource, and the ones not reading the resource once for the whole batch,
+    see `SharedExpressions`.
+
+    Args:
+        resources (Iterable[Resource]): The input FHIR resources.
+        template (Any): The template describing the transformation, raw or compiled.
+        context (Optional[Context], optional): Context data shared by all resolutions.
+            Defaults to None.
+        fp_options (Optional[FPOptions], optional): Options for controlling FHIRPath evaluation.
+            Defaults to None.
+        strict (bool, optional): Whether to enforce strict mode. Defaults to False.
+        limits (Optional[ResolveLimits], optional): Resource limits for every resolution.
+            Defaults to None.
+        cache (Optional[SubtreeCache], optional): Store of the outputs of subtrees that do not
+            depend on the resource, shared by the threads. Defaults to None.
+        max_workers (Optional[int], optional): Number of threads.
+            Defaults to the default of ThreadPoolExecutor.
+        return_exceptions (bool, optional): Whether the errors of the resolutions are returned
+            in place of their results instead of being raised. Defaults to False.
+
+    Returns:
+        list[Any]: The results in the order of the resources.
+
+    Raises:
+        FPMLValidationError: If validation of the template or a resource fails.
+        FPMLLimitExceededError: If a resolution exceeds one of the limits.
+    """
+    compiled = (
+        template if isinstance(template, CompiledTemplate) else compile_template(template, strict)
+    )
+    resources = list(resources)
+    shared = SharedExpressions(compiled, context, fp_options)
+
+    def resolve(resource: Resource) -> Any:
+        state = ResolveState(
+            fp_options,
+            ExecutionBudget(limits),
+            cache=cache.session(compiled, fp_options) if cache is not None else None,
+            shared=shared.session(),
+        )
+        try:
+            return resolve_with_state(resource, compiled, context, strict, state)
+        except Exception as exc:
+            if return_exceptions:
+                return exc
+            raise
+
+    # The pool is imported on first use to keep `import fpml` fast
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(resolve, resources))
+
+
+class SharedExpressions:
+    """
+    Results of the expressions of the template shared by all resolutions of a batch
+
+    Expressions which results depend only on the resource and the context are evaluated
+    by a resolution on first use, within its budget, and the result is reused wherever
+    the resolution evaluates the expression again, e.g. in every iteration of a for block.
+    The results of the expressions not reading the resource are shared by all resolutions.
+    Errors are stored in place of the results, so they are raised only by the resolutions
+    evaluating the expression.
+    """
+
+    def __init__(
+        self,
+        compiled: CompiledTemplate,
+        context: Optional[Context],
+        fp_options: Optional[FPOptions],
+    ) -> None:
+        table = (fp_options or {}).get("userInvocationTable") or {}
+        impure_functions = frozenset(
+            name for name, definition in table.items() if not definition.get("pure")
+        )
+        self.expressions = find_shared_expressions(compiled.template, impure_functions)
+        # Variables not given in the context, e.g. %context, might depend on the resource
+        infos = {expression: analyze_expression(expression) for expression in self.expressions}
+        self.batch_expressions = frozenset(
+            expression
+            for expression, info in infos.items()
+            if not info.reads_resource and info.variables <= (context or {}).keys()
+        )
+        self.results: dict[str, Any] = {}
+        self.lock = threading.Lock()
+
+    def session(self) -> "SharedExpressionsSession":
+        return SharedExpressionsSession(self)
+
+
+class SharedExpressionsSession:
+    """
+    Results of the shared expressions seen by a single resolution
+    """
+
+    __slots__ = ("results", "shared")
+
+    def __init__(self, shared: SharedExpressions) -> None:
+        self.shared = shared
+        self.results: dict[str, Any] = {}
+
+    def __contains__(self, expression: str) -> bool:
+        return expression in self.shared.expressions
+
+    def evaluate(self, expression: str, evaluate: Callable[[], list[Any]]) -> list[Any]:
+        """
+        Returns a copy of the result of the expression, evaluated by `evaluate` on first use
+        """
+        if expression in self.shared.batch_expressions:
+            with self.shared.lock:
+                result = self.shared.results.get(expression, missing)
+            if result is missing:
+                # Evaluated outside the lock, a concurrent evaluation gives the same result
+                result = evaluate_result(evaluate)
+                with self.shared.lock:
+                    result = self.shared.results.setdefault(expression, result)
+        else:
+            result = self.results.get(expression, missing)
+            if result is missing:
+                result = self.results[expression] = evaluate_result(evaluate)
+
+        # Errors are raised where the expression is evaluated, results are copied for every use
+        if isinstance(result, Exception):
+            raise result
+        return copy_json(result)
+
+
+def evaluate_result(evaluate: Callable[[], list[Any]]) -> Any:
+    try:
+        return evaluate()
+    except Exception as exc:
+        return exc
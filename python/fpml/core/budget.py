@@ -0,0 +1,80 @@
+import threading
+import time
+from typing import Optional
+
+from .core_exceptions import FPMLLimitExceededError
+from .core_types import Path, ResolveLimits
+
+
+class ExecutionBudget:
+    """
+    Tracks the resources spent by a single template resolution against ResolveLimits.
+
+    All checks are counter increments and a monotonic clock read, so the budget
+    is always present even if no limits are configured. The counters are incremented
+    under a lock, as iterations of for blocks might be resolved in parallel threads.
+    """
+
+    __slots__ = (
+        "deadline",
+        "evaluations",
+        "lock",
+        "loop_iterations",
+        "max_evaluations",
+        "max_loop_iterations",
+        "max_output_nodes",
+        "output_nodes",
+    )
+
+    def __init__(self, limits: Optional[ResolveLimits] = None) -> None:
+        limits = limits or {}
+        timeout = limits.get("timeout")
+
+        self.max_evaluations = limits.get("max_evaluations")
+        self.max_output_nodes = limits.get("max_output_nodes")
+        self.max_loop_iterations = limits.get("max_loop_iterations")
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+
+        self.evaluations = 0
+        self.output_nodes = 0
+        self.loop_iterations = 0
+        self.lock = threading.Lock()
+
+    def spend_evaluation(self, path: Path) -> None:
+        with self.lock:
+            self.evaluations += 1
+            evaluations = self.evaluations
+        if self.max_evaluations is not None and evaluations > self.max_evaluations:
+            raise FPMLLimitExceededError(
+                f"Exceeded maximum number of evaluations ({self.max_evaluations})",
+                path,
+                "max_evaluations",
+            )
+        self.check_deadline(path)
+
+    def spend_output_node(self, path: Path) -> None:
+        with self.lock:
+            self.output_nodes += 1
+            output_nodes = self.output_nodes
+        if self.max_output_nodes is not None and output_nodes > self.max_output_nodes:
+            raise FPMLLimitExceededError(
+                f"Exceeded maximum number of output nodes ({self.max_output_nodes})",
+                path,
+                "max_output_nodes",
+            )
+
+    def spend_loop_iterations(self, path: Path, count: int) -> None:
+        with self.lock:
+            self.loop_iterations += count
+            loop_iterations = self.loop_iterations
+        if self.max_loop_iterations is not None and loop_iterations > self.max_loop_iterations:
+            raise FPMLLimitExceededError(
+                f"Exceeded maximum number of loop iterations ({self.max_loop_iterations})",
+                path,
+                "max_loop_iterations",
+            )
+        self.check_deadline(path)
+
+    def check_deadline(self, path: Path) -> None:
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise FPMLLimitExceededError("Exceeded resolution timeout", path, "timeout")
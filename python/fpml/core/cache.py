@@ -0,0 +1,200 @@
+import copy
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from .analysis import NodeInfo, analyze_node
+from .compiler import CompiledTemplate
+from .core_types import Context, FPOptions, Node
+from .utils import copy_json
+
+missing = object()
+
+# Markers of the template syntax, the resolver processes strings containing them once again
+template_markers = ("{{", "{[", "{%")
+
+
+class SubtreeCache:
+    """
+    LRU store of the outputs of template subtrees that do not depend on the resource.
+
+    A subtree which expressions use only %variables and literals (e.g. in strict mode)
+    produces the same output for the same values of the variables. The output is stored
+    under the key of the template node and the content hash of the variables it uses,
+    so the same subtree of the same template is reused across `resolve_template`
+    calls, e.g. when a batch of forms is mapped for the same %Patient.
+
+    Raw templates are copied and analyzed once per content, compiled templates are used
+    as they are. User-defined functions are expected to be pure.
+    The store is thread-safe, so it can be shared by resolutions running in threads.
+
+    Attributes:
+        maxsize (int): Maximum number of stored outputs.
+        maxtemplates (int): Maximum number of templates which analysis is kept.
+        hits (int): Number of outputs reused from the store.
+        misses (int): Number of outputs resolved and stored.
+    """
+
+    def __init__(self, maxsize: int = 1024, maxtemplates: int = 64) -> None:
+        self.maxsize = maxsize
+        self.maxtemplates = maxtemplates
+        self.hits = 0
+        self.misses = 0
+        self.entries: OrderedDict[tuple, tuple[tuple, Node]] = OrderedDict()
+        self.templates: OrderedDict[bytes, tuple[Any, dict[int, tuple[Any, NodeInfo]]]] = (
+            OrderedDict()
+        )
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.templates.clear()
+
+    def prepare(self, template: Any) -> tuple[Any, dict[int, tuple[Any, NodeInfo]]]:
+        """
+        Returns a copy of the raw template with the analysis of its nodes indexed by id
+
+        The copy is kept by the content hash of the template, so the caller can edit the
+        template in place between the calls, like `CompiledTemplate` copies it as well.
+        """
+        # hashlib is imported on first use to keep `import fpml` fast (it loads OpenSSL)
+        import hashlib
+
+        dump = json.dumps(template, separators=(",", ":"), default=dump_value)
+        key = hashlib.blake2b(dump.encode(), digest_size=16).digest()
+        with self.lock:
+            entry = self.templates.get(key)
+            if entry is not None:
+                self.templates.move_to_end(key)
+                return entry
+
+        # The analysis is bound to the identity of nodes
+        entry = (copy.deepcopy(template), {})
+        analyze_node(entry[0], entry[1])
+        with self.lock:
+            entry = self.templates.setdefault(key, entry)
+            self.templates.move_to_end(key)
+            while len(self.templates) > self.maxtemplates:
+                self.templates.popitem(last=False)
+
+        return entry
+
+    def get(self, key: tuple, pinned: tuple) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+            # Pinned objects are compared to make sure their ids were not reused
+            if entry is None or any(x is not y for x, y in zip(entry[0], pinned)):
+                return missing
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return copy_json(entry[1])
+
+    def put(self, key: tuple, pinned: tuple, output: Node) -> None:
+        output = copy_json(output)
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = (pinned, output)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def session(self, template: Any, fp_options: Optional[FPOptions]) -> "SubtreeCacheSession":
+        """
+        Starts a resolution of the template, which must resolve `session.template`
+        """
+        if isinstance(template, CompiledTemplate):
+            return SubtreeCacheSession(self, template, template.nodes, fp_options)
+        return SubtreeCacheSession(self, *self.prepare(template), fp_options)
+
+
+class SubtreeCacheSession:
+    """
+    Access to SubtreeCache from a single resolution
+    """
+
+    __slots__ = ("cache", "digests", "nodes", "options", "taints", "template")
+
+    def __init__(
+        self,
+        cache: SubtreeCache,
+        template: Any,
+        nodes: dict[int, tuple[Any, NodeInfo]],
+        fp_options: Optional[FPOptions],
+    ) -> None:
+        self.cache = cache
+        # The template to resolve, compiled or the copy of the raw template the nodes belong to
+        self.template = template
+        self.nodes = nodes
+        # The output depends on the model and user functions, so they are a part of the key
+        self.options = (
+            (fp_options or {}).get("model"),
+            (fp_options or {}).get("userInvocationTable"),
+        )
+        self.digests: dict[int, tuple[Any, bytes]] = {}
+        self.taints = 0
+
+    def resolve(self, node: Node, context: Context, resolve: Callable[[], Node]) -> Node:
+        analyzed = self.nodes.get(id(node))
+        # Outputs of the blocks are walked by the resolver too, but only template nodes are stored
+        if analyzed is None or analyzed[0] is not node:
+            return resolve()
+        info = analyzed[1]
+        if info.reads_resource or info.volatile:
+            return resolve()
+
+        pinned = (node, *self.options)
+        key = (
+            *(id(x) for x in pinned),
+            *(self.digest(context.get(name, missing)) for name in sorted(info.variables)),
+        )
+        output = self.cache.get(key, pinned)
+        if output is not missing:
+            return output
+
+        taints = self.taints
+        output = resolve()
+        if taints == self.taints:
+            self.cache.put(key, pinned, output)
+
+        return output
+
+    def record_evaluation(self, result: list[Any]) -> None:
+        # Results containing template syntax are resolved once again against the resource
+        if contains_template(result):
+            self.taints += 1
+
+    def digest(self, value: Any) -> bytes:
+        if value is missing:
+            return b""
+
+        cached = self.digests.get(id(value))
+        if cached is not None and cached[0] is value:
+            return cached[1]
+
+        # hashlib is imported on first use to keep `import fpml` fast (it loads OpenSSL)
+        import hashlib
+
+        dump = json.dumps(value, sort_keys=True, separators=(",", ":"), default=dump_value)
+        digest = hashlib.blake2b(dump.encode(), digest_size=16).digest()
+        self.digests[id(value)] = (value, digest)
+
+        return digest
+
+
+def dump_value(value: Any) -> str:
+    return f"{type(value).__name__}:{value}"
+
+
+def contains_template(value: Any) -> bool:
+    if isinstance(value, str):
+        return any(marker in value for marker in template_markers)
+    if isinstance(value, dict):
+        return any(contains_template(k) or contains_template(v) for k, v in value.items())
+    if isinstance(value, list):
+        return any(contains_template(x) for x in value)
+    return False
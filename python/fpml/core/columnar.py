@@ -0,0 +1,389 @@
+import re
+import threading
+from collections.abc import Iterable
+from functools import lru_cache
+from typing import Any, Optional, Union
+
+from .analysis import identifier_name, parse_expression
+from .core_types import Context, Resource
+
+# Paths which can be indexed: member names separated by dots, e.g. code.coding.code
+indexed_path_regexp = re.compile(r"^\w+(\.\w+)*$")
+
+# Prefix of the variables holding the filtered collections in the rewritten expressions
+filtered_variable_prefix = "__fpml_where_"
+
+ucum = "http://unitsofmeasure.org"
+
+
+class Column:
+    """
+    Values of a path for every item of an indexed collection
+
+    The items are stored as bitmaps of their positions in the collection.
+
+    Attributes:
+        values (dict[str, int]): Items with the single string value at the path by the value.
+        multiple (int): Items with more than one value at the path.
+    """
+
+    __slots__ = ("multiple", "values")
+
+    def __init__(self) -> None:
+        self.values: dict[str, int] = {}
+        self.multiple = 0
+
+
+class IndexedCollection(list):
+    """
+    Collection of FHIR resources passed in the context with columnar indexes of the paths.
+
+    `%var.where(...)` over the collection is evaluated with bitwise operations over the
+    indexes instead of evaluating the condition for every item if the condition consists
+    of `path = value` and `path in values` comparisons of the indexed paths combined with
+    `and` and `or`. The values are string literals, unions of them or %variables holding
+    strings. Other conditions, and the ones which would raise an error (e.g. `in` for a path
+    with multiple values), are evaluated as usual, so the results are the same.
+
+    The indexes are built on first use for every data model. The collection must not be
+    modified after creation.
+
+    Attributes:
+        paths (frozenset[str]): The indexed paths.
+    """
+
+    def __init__(self, items: Iterable[Resource], paths: Iterable[str]) -> None:
+        super().__init__(items)
+        self.paths = frozenset(paths)
+        for path in self.paths:
+            if not indexed_path_regexp.match(path):
+                raise ValueError(f"Cannot index '{path}': only member paths are supported")
+        self.columns: dict[tuple[str, int], Column] = {}
+        self.lock = threading.Lock()
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # The indexes are rebuilt on first use after copying or unpickling
+        return (IndexedCollection, (list(self), sorted(self.paths)))
+
+    def column(self, path: str, model: Optional[dict]) -> Column:
+        key = (path, id(model))
+        with self.lock:
+            column = self.columns.get(key)
+        if column is None:
+            column = build_column(self, path, model)
+            with self.lock:
+                column = self.columns.setdefault(key, column)
+        return column
+
+
+def build_column(items: list[Resource], path: str, model: Optional[dict]) -> Column:
+    # fhirpathpy is imported on first use to keep `import fpml` fast
+    from fhirpathpy.engine import do_eval  # type: ignore
+    from fhirpathpy.engine.nodes import ResourceNode  # type: ignore
+    from fhirpathpy.engine.util import parse_value  # type: ignore
+
+    tree = parse_expression(path)["children"][0]
+    column = Column()
+    for position, item in enumerate(items):
+        # The same evaluation as of the path in the condition of where() with $this = item
+        ctx = {"dataRoot": [item], "vars": {}, "model": model, "userInvocationTable": {}}
+        nodes = do_eval(ctx, [item], tree)
+        if len(nodes) > 1:
+            column.multiple |= 1 << position
+        elif nodes:
+            node = nodes[0]
+            # Quantities are compared as FP_Quantity, they never equal strings
+            if (
+                isinstance(node, ResourceNode)
+                and isinstance(node.data, str)
+                and parse_value(node) is node
+            ):
+                column.values[node.data] = column.values.get(node.data, 0) | 1 << position
+    return column
+
+
+# Conditions of where(): ("and" | "or", left, right), ("=" | "in", path, operand),
+# operands: ("literal", str), ("variable", name), ("union", left, right)
+Condition = tuple[Any, ...]
+
+
+class WhereSite:
+    """
+    `%var.where(condition)` in an expression replaced by `%__fpml_where_<index>`
+    """
+
+    __slots__ = ("condition", "name", "variable")
+
+    def __init__(self, name: str, variable: str, condition: Condition) -> None:
+        self.name = name
+        self.variable = variable
+        self.condition = condition
+
+
+def filter_indexed_collections(
+    expression: str,
+    resource: Resource,
+    context: Context,
+    model: Optional[dict],
+) -> Optional[tuple[Any, Context]]:
+    """
+    Filters the indexed collections of the context used in where() of the expression.
+
+    Returns:
+        Optional[tuple[Any, Context]]: The syntax tree of the expression with where()
+            calls replaced by variables and the context with the filtered collections,
+            or None if the expression must be evaluated as usual.
+    """
+    # Cheap check first, the expression is analyzed only if it might filter a variable
+    if "where" not in expression or "%" not in expression:
+        return None
+
+    rewritten = rewrite_where_sites(expression)
+    if rewritten is None:
+        return None
+    tree, sites = rewritten
+
+    variables = {"context": resource, "ucum": ucum, **context}
+    filtered_context = dict(context)
+    for site in sites:
+        collection = context.get(site.variable)
+        if not isinstance(collection, IndexedCollection):
+            return None
+        mask = condition_mask(site.condition, collection, variables, model)
+        if mask is None:
+            return None
+        bits = format(mask, "b")[::-1]
+        filtered_context[site.name] = [item for item, bit in zip(collection, bits) if bit == "1"]
+
+    return tree, filtered_context
+
+
+def condition_mask(
+    condition: Condition,
+    collection: IndexedCollection,
+    variables: Context,
+    model: Optional[dict],
+) -> Optional[int]:
+    """
+    Bitmap of the items for which the condition is true, None if it cannot be computed
+    """
+    operator = condition[0]
+
+    if operator in ("and", "or"):
+        left = condition_mask(condition[1], collection, variables, model)
+        right = condition_mask(condition[2], collection, variables, model)
+        if left is None or right is None:
+            return None
+        return left & right if operator == "and" else left | right
+
+    path, operand = condition[1], condition[2]
+    values = operand_values(operand, variables)
+    if path not in collection.paths or values is None:
+        return None
+    column = collection.column(path, model)
+    return equality_mask(column, values) if operator == "=" else membership_mask(column, values)
+
+
+def equality_mask(column: Column, values: list[str]) -> Optional[int]:
+    if not values:
+        return 0
+    if len(values) > 1:
+        # Collections of the same size are compared by the first items only
+        return None
+    return column.values.get(values[0], 0)
+
+
+def membership_mask(column: Column, values: list[str]) -> Optional[int]:
+    if not values:
+        return 0
+    if column.multiple:
+        # `in` raises an error for multiple values
+        return None
+    mask = 0
+    for value in set(values):
+        mask |= column.values.get(value, 0)
+    return mask
+
+
+def operand_values(operand: Condition, variables: Context) -> Optional[list[str]]:
+    kind = operand[0]
+    if kind == "literal":
+        return [operand[1]]
+    if kind == "union":
+        left = operand_values(operand[1], variables)
+        right = operand_values(operand[2], variables)
+        if left is None or right is None:
+            return None
+        # Union removes duplicates keeping the order
+        return list(dict.fromkeys(left + right))
+
+    if operand[1] not in variables:
+        # An undefined variable is reported by the evaluation
+        return None
+    value = variables[operand[1]]
+    values = [] if value is None else value if isinstance(value, list) else [value]
+    if not all(isinstance(item, str) for item in values):
+        return None
+    return values
+
+
+@lru_cache(maxsize=4096)
+def rewrite_where_sites(expression: str) -> Optional[tuple[Any, tuple[WhereSite, ...]]]:
+    """
+    Replaces `%var.where(condition)` with recognized conditions by variables
+
+    Returns:
+        Optional[tuple[Any, tuple[WhereSite, ...]]]: The rewritten syntax tree and
+            the replaced calls, None if there are no such calls.
+    """
+    try:
+        tree = parse_expression(expression)
+    except Exception:
+        return None
+
+    sites: list[WhereSite] = []
+
+    def rewrite(node: dict) -> dict:
+        site = where_site(node, f"{filtered_variable_prefix}{len(sites)}")
+        if site is not None:
+            sites.append(site)
+            return variable_term(site.name)
+
+        children = node.get("children")
+        if not children:
+            return node
+        rewritten = [rewrite(child) for child in children]
+        if all(new is old for new, old in zip(rewritten, children)):
+            return node
+        return {**node, "children": rewritten}
+
+    # Parsed syntax trees are shared, so the rewritten nodes are copies
+    rewritten_tree = rewrite(tree)
+    if not sites:
+        return None
+    return rewritten_tree, tuple(sites)
+
+
+def where_site(node: dict, name: str) -> Optional[WhereSite]:
+    if node.get("type") != "InvocationExpression" or len(node["children"]) != 2:  # noqa: PLR2004
+        return None
+    term, invocation = node["children"]
+
+    variable = variable_name(term)
+    if variable is None or invocation.get("type") != "FunctionInvocation":
+        return None
+    functn = invocation["children"][0]
+    functn_children = functn.get("children", [])
+    if identifier_name(functn_children[0]) != "where" or len(functn_children) != 2:  # noqa: PLR2004
+        return None
+    params = functn_children[1].get("children", [])
+    if len(params) != 1:
+        return None
+
+    condition = parse_condition(params[0])
+    return WhereSite(name, variable, condition) if condition is not None else None
+
+
+def parse_condition(node: dict) -> Optional[Condition]:
+    node_type = node.get("type")
+    children = node.get("children", [])
+
+    if node_type == "TermExpression" and children[0].get("type") == "ParenthesizedTerm":
+        return parse_condition(children[0]["children"][0])
+
+    operator = (node.get("terminalNodeText") or [None])[0]
+    if (node_type, operator) in (("AndExpression", "and"), ("OrExpression", "or")):
+        left, right = parse_condition(children[0]), parse_condition(children[1])
+        if left is None or right is None:
+            return None
+        return (operator, left, right)
+
+    if (node_type, operator) in (("EqualityExpression", "="), ("MembershipExpression", "in")):
+        path = member_path(children[0])
+        operand = parse_operand(children[1])
+        if path is None or operand is None:
+            return None
+        return (operator, path, operand)
+
+    return None
+
+
+def parse_operand(node: dict) -> Optional[Condition]:
+    node_type = node.get("type")
+    children = node.get("children", [])
+
+    if node_type == "UnionExpression":
+        left, right = parse_operand(children[0]), parse_operand(children[1])
+        if left is None or right is None:
+            return None
+        return ("union", left, right)
+
+    if node_type != "TermExpression":
+        return None
+    term = children[0]
+    term_type = term.get("type")
+
+    if term_type == "ParenthesizedTerm":
+        return parse_operand(term["children"][0])
+    if term_type == "LiteralTerm" and term["children"][0].get("type") == "StringLiteral":
+        from fhirpathpy.engine.evaluators import string_literal  # type: ignore
+
+        return ("literal", string_literal({}, [], term["children"][0])[0])
+
+    variable = variable_name(node)
+    return ("variable", variable) if variable is not None else None
+
+
+def variable_name(node: dict) -> Optional[str]:
+    # TermExpression > ExternalConstantTerm > ExternalConstant > Identifier
+    if node.get("type") != "TermExpression":
+        return None
+    term = node["children"][0]
+    if term.get("type") != "ExternalConstantTerm":
+        return None
+    constant = term["children"][0]
+    identifier = (constant.get("children") or [{}])[0]
+    if identifier.get("type") != "Identifier":
+        return None
+    return identifier_name(identifier)
+
+
+def member_path(node: dict) -> Optional[str]:
+    """
+    Dotted path of a chain of member invocations, e.g. code.coding.code
+    """
+    node_type = node.get("type")
+    children = node.get("children", [])
+
+    if node_type == "TermExpression" and children[0].get("type") == "InvocationTerm":
+        return member_name(children[0]["children"][0])
+    if node_type == "InvocationExpression" and len(children) == 2:  # noqa: PLR2004
+        parent = member_path(children[0])
+        name = member_name(children[1])
+        if parent is None or name is None:
+            return None
+        return f"{parent}.{name}"
+    return None
+
+
+def member_name(node: dict) -> Optional[str]:
+    if node.get("type") != "MemberInvocation":
+        return None
+    return identifier_name(node["children"][0])
+
+
+def variable_term(name: str) -> dict:
+    identifier: dict[str, Union[str, list]] = {
+        "type": "Identifier",
+        "text": name,
+        "terminalNodeText": [name],
+        "children": [],
+    }
+    constant = {"type": "ExternalConstant", "terminalNodeText": ["%"], "children": [identifier]}
+    term = {"type": "ExternalConstantTerm", "terminalNodeText": [], "children": [constant]}
+    return {
+        "type": "TermExpression",
+        "text": f"%{name}",
+        "terminalNodeText": [],
+        "children": [term],
+    }
@@ -0,0 +1,96 @@
+import copy
+from typing import Any
+
+from .analysis import (
+    NodeInfo,
+    analyze_node,
+    collect_expressions,
+    find_resource_reads,
+    parse_expression,
+)
+from .core_exceptions import FPMLValidationError
+from .core_types import Path
+
+
+class CompiledTemplate:
+    """
+    Template prepared for repeated resolution.
+
+    Compiled templates can be passed to `resolve_template` instead of the raw templates.
+    The template is analyzed once: expressions are parsed and the subtrees that
+    do not depend on the resource are found.
+
+    Attributes:
+        template (Any): Copy of the original template.
+        expressions (dict[str, Any]): Parsed syntax trees of the template expressions.
+        strict_violations (list[tuple[Path, str]]): Template paths and expressions
+            navigating the resource, i.e. not allowed in strict mode.
+    """
+
+    __slots__ = ("expressions", "nodes", "strict_violations", "template")
+
+    def __init__(self, template: Any) -> None:
+        # The template is copied because the analysis is bound to the identity of nodes
+        self.template = copy.deepcopy(template)
+        self.expressions: dict[str, Any] = {}
+        for path, expression in collect_expressions(self.template):
+            try:
+                self.expressions[expression] = parse_expression(expression)
+            except Exception as exc:
+                raise FPMLValidationError(f"Cannot parse '{expression}': {exc}", path) from exc
+
+        self.nodes: dict[int, tuple[Any, NodeInfo]] = {}
+        analyze_node(self.template, self.nodes)
+        self.strict_violations: list[tuple[Path, str]] = find_resource_reads(self.template)
+
+    @property
+    def strict_verified(self) -> bool:
+        """
+        Whether the template uses only %variables and literals, i.e. can be resolved in
+        strict mode. The resource is still guarded, since evaluated strings containing
+        expressions are resolved as templates.
+        """
+        return not self.strict_violations
+
+    def __getstate__(self) -> dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        for name, value in state.items():
+            setattr(self, name, value)
+        # The analysis is indexed by the identity of nodes, which changes on unpickling
+        self.nodes = {id(node): (node, info) for node, info in self.nodes.values()}
+
+
+def compile_template(template: Any, strict: bool = False) -> CompiledTemplate:
+    """
+    Compiles the template for repeated resolution.
+
+    Args:
+        template (Any): The template describing the transformation.
+        strict (bool, optional): Whether to verify that the template can be resolved
+            in strict mode. Defaults to False.
+
+    Returns:
+        CompiledTemplate: The compiled template.
+
+    Raises:
+        FPMLValidationError: If an expression cannot be parsed, or strict mode is enforced
+            and an expression navigates the resource. The error path points to the template
+            node containing the expression.
+    """
+    compiled = CompiledTemplate(template)
+
+    if strict:
+        verify_strict_mode(compiled)
+
+    return compiled
+
+
+def verify_strict_mode(compiled: CompiledTemplate) -> None:
+    if compiled.strict_violations:
+        path, expression = compiled.strict_violations[0]
+        raise FPMLValidationError(
+            f"Expression '{expression}' accesses the resource in strict mode. Use context instead",
+            path,
+        )
@@ -27,3 +27,19 @@ class FPMLValidationError(Exception):
 
         self.error_message = message
         self.error_path = path_str
+
+
+class FPMLLimitExceededError(FPMLValidationError):
+    """
+    Exception raised when template resolving exceeds one of the configured limits.
+
+    Attributes:
+        limit (str): Name of the exceeded limit, e.g. `max_evaluations`.
+    """
+
+    limit: str
+
+    def __init__(self, message: str, path: Path, limit: str) -> None:
+        super().__init__(message, path)
+
+        self.limit = limit
@@ -1,6 +1,15 @@
-from typing import Any, Callable, Optional, TypedDict, Union
+import sys
+from typing import TYPE_CHECKING, Any, Callable, Optional, TypedDict, Union
 
-from typing_extensions import NotRequired
+if sys.version_info >= (3, 11):
+    from typing import NotRequired
+else:
+    from typing_extensions import NotRequired
+
+if TYPE_CHECKING:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .state import ResolveState
 
 Resource = dict[str, Any]
 Node = Any
@@ -10,6 +19,8 @@ Context = dict[str, Any]
 
 Path = list[Union[str, int]]
 
+JSONPatchOperation = dict[str, Any]
+
 
 class Model(TypedDict):
     choiceTypePaths: dict[str, list[str]]
@@ -19,9 +30,24 @@ class Model(TypedDict):
 
 
 class UserFnDefinition(TypedDict):
+    """
+    User-defined FHIRPath function, see `FPOptions.userInvocationTable`.
+
+    Attributes:
+        fn (Callable): The function accepting the input collection and the arguments.
+        arity (dict[int, list[str]]): Types of the arguments by the number of arguments.
+        nullable (Optional[bool]): Whether empty arguments produce an empty result.
+        pure (Optional[bool]): Whether the result depends only on the input collection
+            and the arguments, so it is memoized across resolutions.
+        maxsize (Optional[int]): Maximum number of memoized results of the pure function.
+            Defaults to 1024.
+    """
+
     fn: Callable
     arity: dict[int, list[str]]
     nullable: NotRequired[bool]
+    pure: NotRequired[bool]
+    maxsize: NotRequired[int]
 
 
 UserInvocationTable = dict[str, UserFnDefinition]
@@ -49,6 +75,44 @@ class FPOptions(TypedDict):
     userInvocationTable: NotRequired[UserInvocationTable]
 
 
+class ResolveLimits(TypedDict):
+    """
+    Optional resource limits for a single template resolution.
+
+    Attributes:
+        max_evaluations (Optional[int]):
+            Maximum number of FHIRPath expressions evaluated.
+        max_output_nodes (Optional[int]):
+            Maximum number of nodes (objects, arrays and values) produced.
+        max_loop_iterations (Optional[int]):
+            Maximum total number of iterations of for and context blocks.
+        timeout (Optional[float]):
+            Wall-clock time in seconds the resolution is allowed to take.
+    """
+
+    max_evaluations: NotRequired[int]
+    max_output_nodes: NotRequired[int]
+    max_loop_iterations: NotRequired[int]
+    timeout: NotRequired[float]
+
+
+class ParallelOptions(TypedDict):
+    """
+    Optional parallel resolution of the iterations of for blocks.
+
+    Attributes:
+        executor (ThreadPoolExecutor):
+            Pool of threads resolving the iterations. It must not be the pool running the
+            resolution itself, otherwise the iterations might wait for each other. Pools of
+            processes are not supported, since the iterations share the state of the resolution.
+        min_iterations (Optional[int]):
+            Minimal number of iterations of a for block resolved in parallel. Defaults to 64.
+    """
+
+    executor: "ThreadPoolExecutor"
+    min_iterations: NotRequired[int]
+
+
 class MatcherResult(TypedDict):
     node: Optional[Node]
 
@@ -59,9 +123,7 @@ Matcher = Callable[
         Resource,
         DictNode,
         Context,
-        Optional[FPOptions],
+        "ResolveState",
     ],
     Optional[MatcherResult],
 ]
-
-Transformer = Callable[[Path, Node, Context], tuple[Node, Context]]
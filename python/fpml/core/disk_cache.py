@@ -0,0 +1,134 @@
+import contextlib
+import json
+import os
+import threading
+from functools import cache
+from typing import Any, Optional, Union
+
+from .cache import dump_value
+from .compiler import CompiledTemplate, compile_template, verify_strict_mode
+from .utils import package_version
+
+# Version of the file layout, bumped when CompiledTemplate changes
+cache_format = 1
+
+
+class TemplateDiskCache:
+    """
+    On-disk store of compiled templates for fast cold start.
+
+    Compiled templates (the analysis of the template nodes and the parsed syntax
+    trees of the expressions) are pickled into files named by the content hash of
+    the template. Every file starts with a header containing the versions of `fpml`
+    and `fhirpathpy`, entries written by other versions are stale: the template is
+    compiled again and the entry is replaced.
+
+    Entries are loaded with pickle, so the directory must be writable only by trusted
+    users. Failed writes are ignored, so a read-only directory populated at build time
+    can be used too. The cache is thread-safe.
+
+    Attributes:
+        directory (str): Directory of the cache files.
+        hits (int): Number of templates loaded from the disk.
+        misses (int): Number of templates compiled, including stale entries.
+    """
+
+    def __init__(self, directory: Union[str, os.PathLike]) -> None:
+        self.directory = os.fspath(directory)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def compile(self, template: Any, strict: bool = False) -> CompiledTemplate:
+        """
+        Loads the compiled template from the disk or compiles and stores it.
+
+        Args:
+            template (Any): The template describing the transformation.
+            strict (bool, optional): Whether to verify that the template can be resolved
+                in strict mode. Defaults to False.
+
+        Returns:
+            CompiledTemplate: The compiled template.
+
+        Raises:
+            FPMLValidationError: The same as `compile_template`.
+        """
+        digest = template_hash(template)
+        path = os.path.join(self.directory, f"{digest}.pickle")
+
+        compiled = self.load(path, digest)
+        if compiled is None:
+            with self.lock:
+                self.misses += 1
+            compiled = compile_template(template)
+            self.store(path, digest, compiled)
+        else:
+            with self.lock:
+                self.hits += 1
+
+        if strict:
+            # Violations are stored, so strict mode is verified without compilation
+            verify_strict_mode(compiled)
+
+        return compiled
+
+    def load(self, path: str, digest: str) -> Optional[CompiledTemplate]:
+        import pickle
+
+        try:
+            with open(path, "rb") as file:
+                if pickle.load(file) != cache_header(digest):
+                    return None
+                compiled = pickle.load(file)
+        except Exception:
+            # Missing, partially written or incompatible entries are compiled again
+            return None
+
+        return compiled if isinstance(compiled, CompiledTemplate) else None
+
+    def store(self, path: str, digest: str, compiled: CompiledTemplate) -> None:
+        import pickle
+        import tempfile
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            file = tempfile.NamedTemporaryFile(dir=self.directory, delete=False)  # noqa: SIM115
+        except OSError:
+            # Read-only directories are used as they are
+            return
+
+        try:
+            with file:
+                pickle.dump(cache_header(digest), file, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(compiled, file, pickle.HIGHEST_PROTOCOL)
+            # The entry is replaced atomically, so concurrent readers never see partial files
+            os.replace(file.name, path)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.unlink(file.name)
+
+
+def template_hash(template: Any) -> str:
+    """
+    Content hash of the template, the order of keys is significant
+
+    >>> template_hash({"a": "{{ b }}"}) == template_hash({"a": "{{ b }}"})
+    True
+    >>> template_hash({"a": 1, "b": 2}) == template_hash({"b": 2, "a": 1})
+    False
+    """
+    # hashlib is imported on first use to keep `import fpml` fast (it loads OpenSSL)
+    import hashlib
+
+    dump = json.dumps(template, separators=(",", ":"), default=dump_value)
+    return hashlib.blake2b(dump.encode(), digest_size=20).hexdigest()
+
+
+@cache
+def cache_versions() -> tuple[int, str, str]:
+    return (cache_format, package_version("fpml"), package_version("fhirpathpy"))
+
+
+def cache_header(digest: str) -> tuple[Any, ...]:
+    return (*cache_versions(), digest)
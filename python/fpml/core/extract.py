@@ -1,10 +1,15 @@
 import re
-from typing import Any, Optional, cast
-
-from fhirpathpy import evaluate  # type: ignore
+from collections.abc import Iterator
+from contextvars import ContextVar, copy_context
+from typing import Any, Callable, Optional, cast
 
 from fpml.core.guarded_resource import guarded_resource
 
+from .analysis import condition_expression
+from .budget import ExecutionBudget
+from .cache import SubtreeCache
+from .columnar import filter_indexed_collections
+from .compiler import CompiledTemplate
 from .constants import root_node_key, undefined
 from .core_exceptions import FPMLValidationError
 from .core_types import (
@@ -14,20 +19,32 @@ from .core_types import (
     Matcher,
     MatcherResult,
     Node,
+    ParallelOptions,
     Path,
+    ResolveLimits,
     Resource,
     StrNode,
-    Transformer,
 )
-from .utils import flatten, omit_key
+from .functions import ReferenceIndex, current_references
+from .state import ResolveState
+from .utils import omit_key
+
+# Minimal number of iterations of a for block resolved in parallel by default
+default_min_parallel_iterations = 64
+
+# Whether the current thread resolves an iteration of a parallel for block
+in_parallel_iteration: ContextVar[bool] = ContextVar("in_parallel_iteration", default=False)
 
 
-def resolve_template(
+def resolve_template(  # noqa: PLR0913
     resource: Resource,
     template: Any,
     context: Optional[Context] = None,
     fp_options: Optional[FPOptions] = None,
     strict: bool = False,
+    limits: Optional[ResolveLimits] = None,
+    cache: Optional[SubtreeCache] = None,
+    parallel: Optional[ParallelOptions] = None,
 ) -> Any:
     """
     Processes a given template with the specified resource and optional context.
@@ -38,33 +55,73 @@ def resolve_template(
 
     Args:
         resource (Resource): The input FHIR resource to process.
-        template (Any): The template describing the transformation.
+        template (Any): The template describing the transformation, raw or compiled by `compile_template`.
         context (Optional[Context], optional): Additional context data. Defaults to None.
         fp_options (Optional[FPOptions], optional): Options for controlling FHIRPath evaluation. Defaults to None.
         strict (bool, optional): Whether to enforce strict mode. Defaults to False.
             See more details on
             [strict mode](https://github.com/beda-software/FHIRPathMappingLanguage/tree/main?tab=readme-ov-file#strict-mode).
+        limits (Optional[ResolveLimits], optional): Resource limits for the resolution. Defaults to None.
+        cache (Optional[SubtreeCache], optional): Store of the outputs of subtrees that do not depend
+            on the resource, shared between calls. Defaults to None.
+        parallel (Optional[ParallelOptions], optional): Pool of threads resolving the iterations
+            of large for blocks in parallel. Defaults to None.
 
     Returns:
         Any: The processed output based on the template.
 
     Raises:
         FPMLValidationError: If validation of the template or resource fails.
+        FPMLLimitExceededError: If the resolution exceeds one of the limits.
 
     See Also:
         FHIRPathMappingLanguage Specification:
         https://github.com/beda-software/FHIRPathMappingLanguage/tree/main?tab=readme-ov-file#specification
     """  # noqa: E501
-    result = resolve_template_recur(
-        [],
-        guarded_resource if strict else resource,
-        template,
-        # Pass resource as context because original is overriden by strict mode
-        {"context": resource, **(context or {})},
-        fp_options=fp_options,
-    )
+    if parallel is not None:
+        validate_parallel_options(parallel)
+
+    session = cache.session(template, fp_options) if cache is not None else None
+    state = ResolveState(fp_options, ExecutionBudget(limits), cache=session, parallel=parallel)
 
-    return None if result == undefined else result
+    # The cache is bound to the nodes of its copy of raw templates
+    resolved = session.template if session is not None else template
+    return resolve_with_state(resource, resolved, context, strict, state)
+
+
+def resolve_with_state(
+    resource: Resource,
+    template: Any,
+    context: Optional[Context],
+    strict: bool,
+    state: ResolveState,
+) -> Any:
+    if isinstance(template, CompiledTemplate):
+        state.expressions = template.expressions
+        # Evaluated strings are resolved as templates, so verified templates are guarded too
+        template = template.template
+
+    return resolve_root(resource, template, context, strict, state)
+
+
+def resolve_root(
+    resource: Resource,
+    template: Any,
+    context: Optional[Context],
+    strict: bool,
+    state: ResolveState,
+) -> Any:
+    # Pass resource as context because original is overriden by strict mode
+    root_context = {"context": resource, **(context or {})}
+    token = current_references.set(ReferenceIndex(root_context))
+    try:
+        result = resolve_template_recur(
+            [], guarded_resource if strict else resource, template, root_context, state
+        )
+    finally:
+        current_references.reset(token)
+
+    return None if result is undefined else result
 
 
 def resolve_template_recur(
@@ -72,14 +129,9 @@ def resolve_template_recur(
     resource: Resource,
     template: Any,
     context: Context,
-    fp_options: Optional[FPOptions] = None,
+    state: ResolveState,
 ) -> Any:
-    result = iterate_node(
-        start_path,
-        {root_node_key: template},
-        context or {},
-        lambda path, node, context: process_node(path, resource, node, context, fp_options),
-    )
+    result = iterate_node(start_path, resource, {root_node_key: template}, context or {}, state)
     if isinstance(result, dict):
         return result.get(root_node_key, undefined)
 
@@ -91,10 +143,10 @@ def process_node(
     resource: Resource,
     node: Node,
     context: Context,
-    fp_options: Optional[FPOptions],
+    state: ResolveState,
 ) -> tuple[Node, Context]:
     if isinstance(node, dict):
-        new_node, new_context = process_assign_block(path, resource, node, context, fp_options)
+        new_node, new_context = process_assign_block(path, resource, node, context, state)
 
         matchers: list[Matcher] = [
             process_context_block,
@@ -104,55 +156,72 @@ def process_node(
         ]
 
         for matcher in matchers:
-            result = matcher(path, resource, new_node, new_context, fp_options)
+            result = matcher(path, resource, new_node, new_context, state)
             if result:
                 return result["node"], new_context
 
         return new_node, new_context
 
     if isinstance(node, str):
-        return process_template_string(path, resource, node, context, fp_options), context
+        return process_template_string(path, resource, node, context, state), context
 
     return node, context
 
 
-def iterate_node(start_path: Path, node: Node, context: Context, transform: Transformer) -> Node:
-    if isinstance(node, list):
-        # Arrays are flattened and undefined values are removed here
-        cleaned_array = flatten(
-            [
-                value
-                for value in [
-                    iterate_node(
-                        [*start_path, index],
-                        *transform([*start_path, index], value, context),
-                        transform,
-                    )
-                    for index, value in enumerate(node)
-                ]
-                if value is not undefined
-            ]
+def resolve_node(
+    path: Path,
+    resource: Resource,
+    node: Node,
+    context: Context,
+    state: ResolveState,
+) -> Node:
+    def resolve() -> Node:
+        return iterate_node(
+            path, resource, *process_node(path, resource, node, context, state), state
         )
 
+    if state.tracker:
+        return state.tracker.track(path, resource, node, context, resolve)
+    if state.cache and isinstance(node, (dict, list)):
+        return state.cache.resolve(node, context, resolve)
+
+    return resolve()
+
+
+def iterate_node(
+    start_path: Path,
+    resource: Resource,
+    node: Node,
+    context: Context,
+    state: ResolveState,
+) -> Node:
+    state.budget.spend_output_node(start_path)
+
+    if isinstance(node, list):
+        # Arrays are flattened and undefined values are removed here.
+        # Nested arrays are resolved by this branch as well, so they are already flat
+        # and are extended in one pass instead of being flattened at every level
+        cleaned_array: list[Any] = []
+        for index, value in enumerate(node):
+            resolved = resolve_node([*start_path, index], resource, value, context, state)
+            if isinstance(resolved, list):
+                cleaned_array.extend(resolved)
+            elif resolved is not undefined:
+                cleaned_array.append(resolved)
+
         return cleaned_array or undefined
-    if isinstance(node, dict):
-        # undefined values are removed from dicts, but nulls are preserved
-        cleaned_object = {
-            key: value
-            for key, value in {
-                key: iterate_node(
-                    [*start_path, key],
-                    *transform([*start_path, key], value, context),
-                    transform,
-                )
-                for key, value in node.items()
-            }.items()
-            if value is not undefined
-        }
+    if isinstance(node, (dict, MergedNode)):
+        # undefined values are removed from dicts, but nulls are preserved.
+        # Every key is written once, so no intermediate dict is built
+        cleaned_object: dict[str, Any] = {}
+        for key, value in node.items():
+            resolved = resolve_node([*start_path, key], resource, value, context, state)
+            if resolved is not undefined:
+                cleaned_object[key] = resolved
 
         return cleaned_object or undefined
 
-    return transform(start_path, node, context)[0]
+    return process_node(start_path, resource, node, context, state)[0]
 
 
 def process_template_string(
@@ -160,14 +229,14 @@ def process_template_string(
     resource: Resource,
     node: StrNode,
     context: Context,
-    fp_options: Optional[FPOptions],
+    state: ResolveState,
 ) -> Any:
     array_template_regexp = re.compile(r"{\[\s*([\s\S]+?)\s*\]}")
 
     match = array_template_regexp.match(node)
     if match:
         expr = match.group(1)
-        return evaluate_expression(path, resource, expr, context, fp_options)
+        return evaluate_expression(path, resource, expr, context, state)
 
     single_template_regexp = re.compile(r"{{\+?\s*([\s\S]+?)\s*\+?}}")
     result = node
@@ -175,7 +244,7 @@ def process_template_string(
     for match in single_template_regexp.finditer(node):
         expr = match.group(1)
         try:
-            replacement = evaluate_expression(path, resource, expr, context, fp_options)[0]
+            replacement = evaluate_expression(path, resource, expr, context, state)[0]
         except IndexError:
             return None if match.group(0).startswith("{{+") else undefined
         if match.group(0) == node:
@@ -190,7 +259,7 @@ def process_context_block(
     resource: Resource,
     node: DictNode,
     context: Context,
-    fp_options: Optional[FPOptions],
+    state: ResolveState,
 ) -> Optional[MatcherResult]:
     keys = list(node.keys())
     context_regexp = re.compile(r"{{\s*(.+?)\s*}}")
@@ -203,10 +272,12 @@ def process_context_block(
         if len(keys) > 1:
             raise FPMLValidationError("Context block must be presented as single key", path)
 
-        answers = evaluate_expression(path, resource, expr, context, fp_options)
+        answers = evaluate_expression(path, resource, expr, context, state)
+        state.budget.spend_loop_iterations(path, len(answers))
+
         return {
             "node": [
-                resolve_template_recur(path, answer, node[context_key], context, fp_options)
+                resolve_template_recur(path, answer, node[context_key], context, state)
                 for answer in answers
             ]
         }
@@ -219,8 +290,34 @@ def process_for_block(
     resource: Resource,
     node: DictNode,
     context: Context,
-    fp_options: Optional[FPOptions],
+    state: ResolveState,
 ) -> Optional[MatcherResult]:
+    loop = for_block_loop(path, resource, node, context, state)
+    if loop is None:
+        return None
+
+    answers, resolve_iteration = loop
+    parallel = state.parallel
+    if (
+        parallel is not None
+        and len(answers) >= parallel.get("min_iterations", default_min_parallel_iterations)
+        and not in_parallel_iteration.get()
+    ):
+        return {"node": resolve_in_parallel(parallel, resolve_iteration, answers)}
+
+    return {"node": [resolve_iteration(index, answer) for index, answer in enumerate(answers)]}
+
+
+def for_block_loop(
+    path: Path,
+    resource: Resource,
+    node: DictNode,
+    context: Context,
+    state: ResolveState,
+) -> Optional[tuple[list[Any], Callable[[int, Any], Any]]]:
+    """
+    Evaluates the collection of the for block and returns it with the resolver of an iteration
+    """
     keys = list(node.keys())
 
     for_regexp = re.compile(r"{%\s*for\s+(?:(\w+?)\s*,\s*)?(\w+?)\s+in\s+(.+?)\s*%}")
@@ -239,34 +336,73 @@ def process_for_block(
         if len(keys) > 1:
             raise FPMLValidationError("For block must be presented as single key", path)
 
-        answers = evaluate_expression(path, resource, expr, context, fp_options)
+        answers = evaluate_expression(path, resource, expr, context, state)
+        state.budget.spend_loop_iterations(path, len(answers))
 
-        return {
-            "node": [
-                resolve_template_recur(
-                    path,
-                    resource,
-                    node[for_key],
-                    {
-                        **context,
-                        item_key: answer,
-                        **({index_key: index} if index_key else {}),
-                    },
-                    fp_options,
-                )
-                for index, answer in enumerate(answers)
-            ]
-        }
+        def resolve_iteration(index: int, answer: Any) -> Any:
+            return resolve_template_recur(
+                path,
+                resource,
+                node[for_key],
+                {
+                    **context,
+                    item_key: answer,
+                    **({index_key: index} if index_key else {}),
+                },
+                state,
+            )
+
+        return answers, resolve_iteration
 
     return None
 
 
+def validate_parallel_options(parallel: ParallelOptions) -> None:
+    # The pool is imported only when given to keep `import fpml` fast
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Iterations share the state of the resolution, e.g. the budget and the context
+    # variables, which cannot be passed to other processes
+    if not isinstance(parallel["executor"], ThreadPoolExecutor):
+        raise FPMLValidationError(
+            "Parallel for blocks require a ThreadPoolExecutor, "
+            f"got {type(parallel['executor']).__name__}",
+            [],
+        )
+
+
+def resolve_in_parallel(
+    parallel: ParallelOptions, resolve_iteration: Callable[[int, Any], Any], answers: list[Any]
+) -> list[Any]:
+    """
+    Resolves the iterations of a for block in the pool, the results are in the original order
+
+    Errors are raised in the order of the iterations, so the same error is raised as
+    by the sequential resolution. Nested for blocks are resolved sequentially.
+    """
+
+    def run(index: int, answer: Any) -> Any:
+        in_parallel_iteration.set(True)
+        return resolve_iteration(index, answer)
+
+    # Every iteration runs in a copy of the context, e.g. to see the references of the resolution
+    futures = [
+        parallel["executor"].submit(copy_context().run, run, index, answer)
+        for index, answer in enumerate(answers)
+    ]
+    try:
+        return [future.result() for future in futures]
+    finally:
+        for future in futures:
+            future.cancel()
+
+
 def process_if_block(
     path: Path,
     resource: Resource,
     node: dict[str, Any],
     context: Context,
-    fp_options: Optional[FPOptions],
+    state: ResolveState,
 ) -> Optional[MatcherResult]:
     keys = list(node.keys())
 
@@ -294,15 +430,13 @@ def process_if_block(
     matches = if_regexp.match(if_key)
     expr = matches.group(1) if matches else ""
 
-    answer = evaluate_expression(path, resource, f"iif({expr}, true, false)", context, fp_options)[
-        0
-    ]
+    answer = evaluate_expression(path, resource, condition_expression(expr), context, state)[0]
 
     new_node = (
-        resolve_template_recur(path, resource, node[if_key], context, fp_options)
+        resolve_template_recur(path, resource, node[if_key], context, state)
         if answer
         else (
-            resolve_template_recur(path, resource, node[else_key], context, fp_options)
+            resolve_template_recur(path, resource, node[else_key], context, state)
             if else_key
             else undefined
         )
@@ -316,12 +450,9 @@ def process_if_block(
                 path,
             )
 
-        return {
-            "node": {
-                **omit_key(omit_key(node, if_key), else_key),
-                **(new_node if isinstance(new_node, dict) else {}),
-            }
-        }
+        directives = (if_key, else_key) if else_key else (if_key,)
+        fragments = [new_node] if isinstance(new_node, dict) else []
+        return {"node": MergedNode(node, directives, fragments)}
 
     return {"node": new_node}
 
@@ -331,28 +462,70 @@ def process_merge_block(
     resource: Resource,
     node: DictNode,
     context: Context,
-    fp_options: Optional[FPOptions],
+    state: ResolveState,
 ) -> Optional[MatcherResult]:
     merge_key = next((k for k in node if re.match(r"{%\s*merge\s*%}", k)), None)
     if merge_key:
-        merged_node = omit_key(node, merge_key)
+        fragments: list[DictNode] = []
         values = node[merge_key] if isinstance(node[merge_key], list) else [node[merge_key]]
         for value in values:
-            result = resolve_template_recur(path, resource, value, context, fp_options)
+            result = resolve_template_recur(path, resource, value, context, state)
             if not isinstance(result, dict) and result is not None and result is not undefined:
                 raise FPMLValidationError("Merge block must contain object", path)
-            if result is not undefined and result is not None:
-                merged_node.update(result)
-        return {"node": merged_node}
+            if isinstance(result, dict):
+                fragments.append(result)
+        return {"node": MergedNode(node, (merge_key,), fragments)}
     return None
 
 
+class MergedNode:
+    """
+    Object node extended by the resolved fragments of merge and if blocks
+
+    It is a view of the template node without the directive keys, updated by the
+    fragments in order, i.e. `{**omit_key(node, directive), **fragment, ...}`.
+    The items are resolved into the output object at once, so neither the node
+    nor the fragments are copied.
+    """
+
+    __slots__ = ("directives", "fragments", "node")
+
+    def __init__(
+        self, node: DictNode, directives: tuple[str, ...], fragments: list[DictNode]
+    ) -> None:
+        self.node = node
+        self.directives = directives
+        self.fragments = fragments
+
+    def items(self) -> Iterator[tuple[str, Any]]:
+        fragments = self.fragments
+        for key, value in self.node.items():
+            if key not in self.directives:
+                yield key, self.lookup(key, value)
+
+        # Keys added by the fragments follow in the order of the first appearance
+        for index, fragment in enumerate(fragments):
+            for key, value in fragment.items():
+                if (key in self.node and key not in self.directives) or any(
+                    key in previous for previous in fragments[:index]
+                ):
+                    continue
+                yield key, self.lookup(key, value)
+
+    def lookup(self, key: str, default: Any) -> Any:
+        # The last fragment containing the key wins
+        for fragment in reversed(self.fragments):
+            if key in fragment:
+                return fragment[key]
+        return default
+
+
 def process_assign_block(
     path: Path,
     resource: Resource,
     node: DictNode,
     context: Context,
-    fp_options: Optional[FPOptions],
+    state: ResolveState,
 ) -> tuple[DictNode, Context]:
     extended_context = context.copy()
     assign_key = next((k for k in node if re.match(r"{%\s*assign\s*%}", k)), None)
@@ -366,7 +539,7 @@ def process_assign_block(
                     )
                 result = {
                     key: resolve_template_recur(
-                        [*path, key], resource, obj_value, extended_context, fp_options
+                        [*path, key], resource, obj_value, extended_context, state
                     )
                     for key, obj_value in obj.items()
                 }
@@ -376,7 +549,7 @@ def process_assign_block(
             obj = node[assign_key]
             result = {
                 key: resolve_template_recur(
-                    [*path, key], resource, obj_value, extended_context, fp_options
+                    [*path, key], resource, obj_value, extended_context, state
                 )
                 for key, obj_value in obj.items()
             }
@@ -393,12 +566,118 @@ def evaluate_expression(
     resource: Resource,
     expression: str,
     context: Context,
-    fp_options: Optional[FPOptions] = None,
+    state: ResolveState,
 ) -> list[Any]:
-    fp_options_copy = cast(dict, fp_options or {}).copy()
-    model = fp_options_copy.pop("model", None)
+    state.budget.spend_evaluation(path)
 
     try:
-        return evaluate(resource, expression, context, model, options=fp_options_copy)
+        parsed = state.expressions.get(expression) if state.expressions else None
+        if state.shared is not None and expression in state.shared:
+            result = state.shared.evaluate(
+                expression,
+                lambda: run_expression(resource, expression, parsed, context, state.fp_options),
+            )
+        else:
+            result = run_expression(resource, expression, parsed, context, state.fp_options)
     except Exception as exc:
         raise FPMLValidationError(f"Cannot evaluate '{expression}': {exc}", path) from exc
+
+    if state.tracker:
+        state.tracker.record_evaluation(expression)
+    if state.cache:
+        state.cache.record_evaluation(result)
+
+    return result
+
+
+def run_expression(
+    resource: Resource,
+    expression: str,
+    parsed: Optional[Any],
+    context: Context,
+    fp_options: Optional[FPOptions],
+) -> list[Any]:
+    """
+    Evaluates the expression with fhirpathpy, parsed if the syntax tree is not given
+    """
+    # fhirpathpy is imported on first evaluation to keep `import fpml` fast
+    from fhirpathpy.parser import parse  # type: ignore
+
+    fp_options_copy = cast(dict, fp_options or {}).copy()
+    model = fp_options_copy.pop("model", None)
+
+    filtered = filter_indexed_collections(expression, resource, context, model)
+    if filtered is not None:
+        parsed, context = filtered
+    if parsed is None:
+        parsed = parse(expression)
+    return apply_parsed_path(resource, parsed, context, model, fp_options_copy)
+
+
+def apply_parsed_path(
+    resource: Resource,
+    parsed: Any,
+    context: Context,
+    model: Optional[Any],
+    options: dict[str, Any],
+) -> list[Any]:
+    """
+    Evaluates the syntax tree as `fhirpathpy.apply_parsed_path` does, with the hash-based
+    exclude() and intersect() used by this evaluation only
+
+    User-defined functions receive the data of the inputs, so the hash-based functions
+    are added to the functions of the evaluation after the user-defined ones are wrapped.
+    The copy follows fhirpathpy 2.2.3+, `test_run_expression_equals_fhirpathpy` compares them.
+    """
+    from fhirpathpy.engine import do_eval  # type: ignore
+    from fhirpathpy.engine.invocations.constants import constants  # type: ignore
+    from fhirpathpy.engine.nodes import FP_Type, ResourceNode  # type: ignore
+    from fhirpathpy.engine.util import (  # type: ignore
+        arraify,
+        get_data,
+        process_user_invocation_table,
+    )
+
+    from .hashing import hashed_collection_functions
+
+    constants.reset()
+    data_root = arraify(resource)
+    ctx = {
+        "dataRoot": data_root,
+        "vars": {"context": resource, "ucum": "http://unitsofmeasure.org", **context},
+        "model": model,
+        "userInvocationTable": {
+            **hashed_collection_functions(),
+            **process_user_invocation_table(options.get("userInvocationTable") or {}),
+        },
+    }
+    if "traceFn" in options:
+        ctx["traceFn"] = options["traceFn"]
+
+    result = do_eval(ctx, data_root, parsed["children"][0])
+    if options.get("returnRawData", False):
+        # Internal representation of primitive extensions is not a part of the output
+        return [
+            item
+            for item in result
+            if not (
+                isinstance(item, ResourceNode)
+                and isinstance(item.data, dict)
+                and list(item.data) == ["extension"]
+            )
+        ]
+
+    def visit(node: Any) -> Any:
+        data = get_data(node)
+        if isinstance(node, list):
+            items = [visit(item) for item in data]
+            return [
+                item
+                for item in items
+                if not (isinstance(item, dict) and list(item) == ["extension"])
+            ]
+        if isinstance(data, dict) and not isinstance(data, FP_Type):
+            return {key: visit(value) for key, value in data.items()}
+        return data
+
+    return cast(list[Any], visit(result))
@@ -0,0 +1,400 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from contextvars import ContextVar
+from typing import Any, Optional, Union
+
+from .core_types import Context, Resource, UserFnDefinition
+
+# Number of QuestionnaireResponse objects which indexes are kept
+default_maxsize = 64
+
+AnswersByLinkId = dict[str, list[Any]]
+
+
+class AnswersIndex:
+    """
+    Implementation of `answers(linkId)` backed by an index of the answers by linkId.
+
+    The index of the input collection (usually a QuestionnaireResponse) is built once per
+    resolution and kept in an LRU store by the identity of the input objects, so the following
+    calls of the resolution are O(1). The objects can be changed between resolutions, e.g. by
+    autosave, they are indexed again. For data tracked by `IncrementalResolver` the stored index
+    records a read of the whole input for the calling node. The store is thread-safe.
+
+    Attributes:
+        aidbox (bool): Whether the answers are in Aidbox format.
+        maxsize (int): Maximum number of indexed input collections.
+    """
+
+    def __init__(self, aidbox: bool = False, maxsize: int = default_maxsize) -> None:
+        self.aidbox = aidbox
+        self.maxsize = maxsize
+        self.indexes: OrderedDict[tuple[int, ...], tuple[tuple, AnswersByLinkId]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __call__(self, inputs: list[Any], link_id: Optional[str] = None) -> list[Any]:
+        if link_id is None:
+            return []
+        # The index is shared, so the caller gets a copy of the answers
+        return list(self.index(inputs).get(link_id, ()))
+
+    def index(self, inputs: list[Any]) -> AnswersByLinkId:
+        # The resolution is pinned as well, so the objects are indexed again by the next one
+        pinned = (current_references.get(), *inputs)
+        key = tuple(id(x) for x in pinned)
+        with self.lock:
+            entry = self.indexes.get(key)
+            # Pinned objects are compared to make sure their ids were not reused
+            if entry is not None and all(x is y for x, y in zip(entry[0], pinned)):
+                self.indexes.move_to_end(key)
+                record_deep_reads(inputs)
+                return entry[1]
+
+        index = index_answers(tuple(inputs), self.aidbox)
+        with self.lock:
+            self.indexes[key] = (pinned, index)
+            while len(self.indexes) > self.maxsize:
+                self.indexes.popitem(last=False)
+
+        return index
+
+
+def record_deep_reads(inputs: list[Any]) -> None:
+    """
+    Records reads of the whole data tracked by `IncrementalResolver`, which the stored
+    index skips, so the calling node is resolved again when the data changes
+    """
+    from .tracking import DEEP_READ, TrackedDict, TrackedList
+
+    for x in inputs:
+        if isinstance(x, (TrackedDict, TrackedList)):
+            x._recorder.record(x._pointer, DEEP_READ)
+
+
+def answers_function(aidbox: bool = False, maxsize: int = default_maxsize) -> UserFnDefinition:
+    """
+    Returns the definition of the `answers(linkId)` function for `userInvocationTable`.
+
+    The function is the indexed equivalent of `repeat(item).where(linkId=%linkId).answer.value`
+    for FHIR data-model and of `repeat(item).where(linkId=%linkId).answer.value.children()`
+    for Aidbox format.
+
+    Args:
+        aidbox (bool, optional): Whether the answers are in Aidbox format. Defaults to False.
+        maxsize (int, optional): Maximum number of indexed QuestionnaireResponse objects.
+            Defaults to 64.
+
+    Returns:
+        UserFnDefinition: The definition of the function.
+    """
+    return {"fn": AnswersIndex(aidbox, maxsize), "arity": {0: [], 1: ["String"]}}
+
+
+def index_answers(inputs: tuple, aidbox: bool) -> AnswersByLinkId:
+    index: AnswersByLinkId = {}
+    # Items are visited breadth-first like repeat(item)
+    queue = [item for x in inputs for item in children(x, "item")]
+    for item in queue:
+        queue.extend(children(item, "item"))
+        link_id = item.get("linkId") if isinstance(item, dict) else None
+        if not isinstance(link_id, str):
+            continue
+
+        values = index.setdefault(link_id, [])
+        for answer in children(item, "answer"):
+            if not isinstance(answer, dict):
+                continue
+            if aidbox:
+                values.extend(children(answer.get("value"), None))
+            else:
+                values.extend(
+                    value
+                    for key, value in answer.items()
+                    if key.startswith("value") and key[5:6].isupper() and value is not None
+                )
+
+    return index
+
+
+def children(value: Any, key: Optional[str]) -> list[Any]:
+    """
+    Returns the children of the object with the key (or all of them if key is None)
+    """
+    if not isinstance(value, dict):
+        return []
+
+    result: list[Any] = []
+    for name, child in value.items():
+        if (key is None and not name.startswith("_")) or name == key:
+            if isinstance(child, list):
+                result.extend(x for x in child if x is not None)
+            elif child is not None:
+                result.append(child)
+    return result
+
+
+# Relationships of the targets which are not translations of the source code
+unmatched_relationships = frozenset(["unmatched", "disjoint", "not-related-to"])
+
+# Target codings by the system and the code of the source coding, by the code only for None system
+TranslationIndex = dict[tuple[Optional[str], str], list[dict[str, Any]]]
+
+
+class ConceptMapTranslator:
+    """
+    Implementation of `translate(conceptMap)` backed by an index of the ConceptMaps.
+
+    The ConceptMaps are either registered by canonical URL (`url` or `url|version`)
+    or passed as the argument, e.g. from the context. Every ConceptMap is indexed by
+    the (system, code) of the source codings once per `url|version` (once per object for
+    the ones without url or version passed as the argument), so every lookup is O(1).
+    The translator is thread-safe.
+
+    Attributes:
+        maxsize (int): Maximum number of indexed ConceptMaps.
+    """
+
+    def __init__(self, concept_maps: Iterable[Resource] = (), maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self.concept_maps: dict[str, Resource] = {}
+        self.indexes: OrderedDict[tuple[Any, Any], tuple[Resource, TranslationIndex]] = (
+            OrderedDict()
+        )
+        self.lock = threading.Lock()
+        for concept_map in concept_maps:
+            self.register(concept_map)
+
+    def register(self, concept_map: Resource) -> None:
+        """
+        Registers the ConceptMap by its `url` and `url|version`
+        """
+        url = concept_map.get("url")
+        if not isinstance(url, str):
+            raise ValueError("ConceptMap must have url to be registered")
+
+        version = concept_map.get("version")
+        with self.lock:
+            self.concept_maps[url] = concept_map
+            if version is not None:
+                self.concept_maps[f"{url}|{version}"] = concept_map
+        self.index(concept_map)
+
+    def __call__(self, inputs: list[Any], concept_map: Any = None) -> list[Any]:
+        resolved = self.resolve(concept_map)
+        if resolved is None:
+            return []
+
+        index = self.index(resolved)
+        result: list[Any] = []
+        for value in inputs:
+            for system, code in source_codes(value):
+                # Targets are shared by the index, so the caller gets copies
+                result.extend(dict(target) for target in index.get((system, code), ()))
+        return result
+
+    def resolve(self, concept_map: Any) -> Optional[Resource]:
+        # Arguments of type Any are passed as collections of fhirpath nodes
+        if isinstance(concept_map, list):
+            if not concept_map:
+                return None
+            concept_map = getattr(concept_map[0], "data", concept_map[0])
+
+        if isinstance(concept_map, dict):
+            return concept_map
+        if isinstance(concept_map, str):
+            with self.lock:
+                resolved = self.concept_maps.get(concept_map)
+            if resolved is None:
+                raise ValueError(f"ConceptMap '{concept_map}' is not registered")
+            return resolved
+        return None
+
+    def index(self, concept_map: Resource) -> TranslationIndex:
+        url, version = concept_map.get("url"), concept_map.get("version")
+        # The version identifies the content only together with the url, ConceptMaps
+        # without url are indexed by their objects
+        versioned = url is not None and version is not None
+        key = (url, version) if url is not None else (None, id(concept_map))
+        with self.lock:
+            entry = self.indexes.get(key)
+            if entry is not None and (versioned or entry[0] is concept_map):
+                self.indexes.move_to_end(key)
+                return entry[1]
+
+        index = index_concept_map(concept_map)
+        with self.lock:
+            self.indexes[key] = (concept_map, index)
+            self.indexes.move_to_end(key)
+            while len(self.indexes) > self.maxsize:
+                self.indexes.popitem(last=False)
+
+        return index
+
+
+def translate_function(
+    concept_maps: Union[ConceptMapTranslator, Iterable[Resource]] = (),
+) -> UserFnDefinition:
+    """
+    Returns the definition of the `translate(conceptMap)` function for `userInvocationTable`.
+
+    The function translates the input codings, CodeableConcepts or codes to the target
+    codings of the ConceptMap. The argument is either the canonical URL of a registered
+    ConceptMap or the ConceptMap itself, e.g. `%coding.translate(%ConceptMap)`.
+
+    Args:
+        concept_maps (Union[ConceptMapTranslator, Iterable[Resource]], optional): The translator
+            or the ConceptMaps to register. Defaults to no ConceptMaps.
+
+    Returns:
+        UserFnDefinition: The definition of the function.
+    """
+    translator = (
+        concept_maps
+        if isinstance(concept_maps, ConceptMapTranslator)
+        else ConceptMapTranslator(concept_maps)
+    )
+    return {"fn": translator, "arity": {1: ["Any"]}}
+
+
+def index_concept_map(concept_map: Resource) -> TranslationIndex:
+    index: TranslationIndex = {}
+    for group in objects(concept_map, "group"):
+        source = group.get("source")
+        for element in objects(group, "element"):
+            code = element.get("code")
+            if not isinstance(code, str):
+                continue
+
+            targets = [
+                translated_coding(group, target)
+                for target in objects(element, "target")
+                if target.get("code") is not None
+                and target.get("relationship", target.get("equivalence"))
+                not in unmatched_relationships
+            ]
+            index.setdefault((source, code), []).extend(targets)
+            if source is not None:
+                index.setdefault((None, code), []).extend(targets)
+
+    return index
+
+
+def translated_coding(group: dict[str, Any], target: dict[str, Any]) -> dict[str, Any]:
+    coding = {
+        "system": group.get("target"),
+        "version": group.get("targetVersion"),
+        "code": target.get("code"),
+        "display": target.get("display"),
+    }
+    return {key: value for key, value in coding.items() if value is not None}
+
+
+def source_codes(value: Any) -> Iterator[tuple[Optional[str], str]]:
+    """
+    Yields (system, code) of the coding, the codings of CodeableConcept or the code
+    """
+    if isinstance(value, str):
+        yield None, value
+    elif isinstance(value, dict):
+        if "coding" in value:
+            for coding in children(value, "coding"):
+                yield from source_codes(coding)
+        elif isinstance(value.get("code"), str):
+            yield value.get("system"), value["code"]
+
+
+def objects(value: Any, key: str) -> list[dict[str, Any]]:
+    return [x for x in children(value, key) if isinstance(x, dict)]
+
+
+class ReferenceIndex:
+    """
+    Resources of the resolution context by the references to them.
+
+    The index covers the resources and the lists of resources passed in context
+    (including %context, the resource itself) and the entries of the Bundles passed in context.
+    Resources are indexed by `type/id`, entries of Bundles by `fullUrl` as well. The index is
+    built on the first lookup, so resolutions not resolving references do not pay for it.
+    """
+
+    __slots__ = ("context", "resources")
+
+    def __init__(self, context: Context) -> None:
+        self.context = context
+        self.resources: Optional[dict[str, Resource]] = None
+
+    def get(self, reference: str) -> Optional[Resource]:
+        if self.resources is None:
+            self.resources = index_resources(self.context)
+
+        resource = self.resources.get(reference)
+        if resource is None and "/_history/" in reference:
+            reference = reference.split("/_history/")[0]
+            resource = self.resources.get(reference)
+        if resource is None and "://" in reference:
+            # Absolute references to the resources indexed by type/id only
+            parts = reference.rstrip("/").rsplit("/", 2)
+            if len(parts) == 3:  # noqa: PLR2004
+                resource = self.resources.get(f"{parts[1]}/{parts[2]}")
+        return resource
+
+
+# Index of the references of the current resolution, set by resolve_root
+current_references: ContextVar[Optional[ReferenceIndex]] = ContextVar(
+    "current_references", default=None
+)
+
+
+def resolve_references(inputs: list[Any]) -> list[Any]:
+    references = current_references.get()
+    if references is None:
+        return []
+
+    result = []
+    for value in inputs:
+        reference = value.get("reference") if isinstance(value, dict) else value
+        if isinstance(reference, str):
+            resource = references.get(reference)
+            if resource is not None:
+                result.append(resource)
+    return result
+
+
+def resolve_function() -> UserFnDefinition:
+    """
+    Returns the definition of the `resolve()` function for `userInvocationTable`.
+
+    The function resolves the input references (Reference objects or strings) to the
+    resources passed in context, e.g. `%Condition`, or in the Bundles passed in context.
+    Relative (`Condition/123`), absolute (`http://example.com/fhir/Condition/123`) and
+    `urn:uuid` references are supported. Missing resources are skipped.
+    The references are indexed once per `resolve_template` call.
+
+    Returns:
+        UserFnDefinition: The definition of the function.
+    """
+    return {"fn": resolve_references, "arity": {0: []}}
+
+
+def index_resources(context: Context) -> dict[str, Resource]:
+    resources: dict[str, Resource] = {}
+
+    def add(resource: Any, full_url: Any = None) -> None:
+        if not isinstance(resource, dict):
+            return
+        if isinstance(full_url, str):
+            resources.setdefault(full_url, resource)
+        resource_type = resource.get("resourceType")
+        resource_id = resource.get("id")
+        if isinstance(resource_type, str) and isinstance(resource_id, str):
+            resources.setdefault(f"{resource_type}/{resource_id}", resource)
+
+    for value in context.values():
+        for resource in value if isinstance(value, list) else [value]:
+            add(resource)
+            if isinstance(resource, dict) and resource.get("resourceType") == "Bundle":
+                for entry in objects(resource, "entry"):
+                    add(entry.get("resource"), entry.get("fullUrl"))
+
+    return resources
@@ -0,0 +1,123 @@
+from collections.abc import Iterable
+from decimal import Decimal
+from functools import cache
+from typing import Any, Optional, cast
+
+# Values hashed as they are, their hashes are consistent with the equality between them
+primitive_types = (str, int, float, Decimal, type(None))
+
+
+def structural_hash(value: Any) -> int:
+    """
+    Hash of a FHIR JSON value consistent with its equality.
+
+    Objects equal regardless of the order of their keys, and numbers equal across types
+    (1 == 1.0) have the same hash, as FHIRPath collection functions compare them with
+    `==`. Nodes of fhirpathpy are hashed by their data.
+
+    Raises:
+        TypeError: If the value is not JSON, e.g. a FHIRPath quantity or date.
+    """
+    # fhirpathpy is imported on first use to keep `import fpml` fast
+    from fhirpathpy.engine.nodes import ResourceNode  # type: ignore
+
+    if isinstance(value, ResourceNode):
+        value = value.data
+    return json_hash(value)
+
+
+def json_hash(value: Any) -> int:
+    if isinstance(value, dict):
+        return hash(frozenset([(key, json_hash(item)) for key, item in value.items()]))
+    if isinstance(value, list):
+        return hash(tuple([json_hash(item) for item in value]))
+    if isinstance(value, primitive_types):
+        return hash(value)
+    raise TypeError(f"Cannot hash {type(value).__name__}")
+
+
+class HashedCollection:
+    """
+    FHIRPath collection bucketed by the structural hashes of its items
+
+    Items are compared only with the items of the same bucket, so `contains` gives the
+    same result as `in` on the collection in O(1) expected time.
+    """
+
+    __slots__ = ("buckets",)
+
+    def __init__(self, items: Iterable[Any] = ()) -> None:
+        self.buckets: dict[int, list[Any]] = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item: Any, item_hash: Optional[int] = None) -> None:
+        key = structural_hash(item) if item_hash is None else item_hash
+        self.buckets.setdefault(key, []).append(item)
+
+    def candidates(self, item: Any, item_hash: Optional[int] = None) -> list[Any]:
+        """
+        Items which might be equal to the item
+        """
+        key = structural_hash(item) if item_hash is None else item_hash
+        return self.buckets.get(key, [])
+
+    def contains(self, item: Any, item_hash: Optional[int] = None) -> bool:
+        return item in self.candidates(item, item_hash)
+
+
+def exclude_fn(ctx: Any, coll1: list[Any], coll2: list[Any]) -> list[Any]:
+    from fhirpathpy.engine.invocations import combining  # type: ignore
+
+    try:
+        excluded = HashedCollection(coll2)
+        hashes = [structural_hash(element) for element in coll1]
+    except TypeError:
+        return combining.exclude_fn(ctx, coll1, coll2)
+
+    return [
+        element
+        for element, element_hash in zip(coll1, hashes)
+        if not excluded.contains(element, element_hash)
+    ]
+
+
+def intersect_fn(ctx: Any, list_1: list[Any], list_2: list[Any]) -> list[Any]:
+    from fhirpathpy.engine.invocations import subsetting  # type: ignore
+
+    try:
+        other = HashedCollection(list_2)
+        hashes = [structural_hash(obj) for obj in list_1]
+    except TypeError:
+        return subsetting.intersect_fn(ctx, list_1, list_2)
+
+    intersection = HashedCollection()
+    unique_intersection = []
+    for obj, obj_hash in zip(list_1, hashes):
+        # Matched with `==` and deduplicated with `in` like the original
+        matched = any(obj == candidate for candidate in other.candidates(obj, obj_hash))
+        if matched and not intersection.contains(obj, obj_hash):
+            intersection.add(obj, obj_hash)
+            unique_intersection.append(obj)
+
+    return unique_intersection
+
+
+@cache
+def hashed_collection_functions() -> dict[str, dict[str, Any]]:
+    """
+    Entries of exclude() and intersect() using the hash-based functions
+
+    The entries are added to the functions of every evaluation of fpml instead of the
+    built-in ones, the registry of fhirpathpy is not changed. The originals compare every
+    pair of items, the replacements return the same items in the same order and fall
+    back to the originals for non-JSON items. union() and distinct() of fhirpathpy are
+    already hash-based.
+    """
+    from fhirpathpy.engine.invocations import invocation_registry  # type: ignore
+
+    registry = cast(dict[str, dict[str, Any]], invocation_registry)
+    return {
+        "exclude": {**registry["exclude"], "fn": exclude_fn},
+        "intersect": {**registry["intersect"], "fn": intersect_fn},
+    }
@@ -0,0 +1,193 @@
+import copy
+from typing import Any, Optional
+
+from .budget import ExecutionBudget
+from .compiler import CompiledTemplate
+from .core_exceptions import FPMLValidationError
+from .core_types import Context, FPOptions, JSONPatchOperation, ResolveLimits, Resource
+from .extract import resolve_root
+from .json_patch import apply_patch, make_patch
+from .state import ResolveState
+from .tracking import (
+    DependencyTracker,
+    NodeKey,
+    NodeRecord,
+    Pointer,
+    diff_data,
+    find_dirty_nodes,
+    missing,
+    track,
+    untrack,
+)
+
+resource_pointer: Pointer = ("$resource",)
+
+
+class IncrementalResolver:
+    """
+    Resolves the same template repeatedly, recomputing only the parts of the
+    output that depend on the changed data.
+
+    During resolution every template node records which parts of the resource
+    and which variables it reads. On the next resolution the new data is compared
+    with the previous one (or the changes are taken from JSON patch) and only the
+    nodes reading the changed parts are resolved again, the outputs of other nodes
+    are reused from the previous result.
+
+    Notes:
+        - Reused parts of the output are shared between results, treat results as read-only.
+        - User-defined functions are expected to be pure, i.e. to depend only on their input.
+        - Expressions using `now()`, `today()` and `timeOfDay()` are always re-evaluated.
+        - Limits are applied to the work done by each resolution, reused nodes are not counted.
+
+    Attributes:
+        evaluations (int): Number of expressions evaluated during the last resolution.
+        delta (list[JSONPatchOperation]): RFC 6902 JSON patch transforming the previous
+            result into the result of the last resolution. It is built from the nodes
+            that were resolved again, the reused parts of the output are skipped.
+    """
+
+    def __init__(
+        self,
+        template: Any,
+        fp_options: Optional[FPOptions] = None,
+        strict: bool = False,
+        limits: Optional[ResolveLimits] = None,
+    ) -> None:
+        self.expressions: Optional[dict[str, Any]] = None
+        if isinstance(template, CompiledTemplate):
+            self.expressions = template.expressions
+            # Evaluated strings are resolved as templates, so verified templates are guarded too
+            self.template = template.template
+        else:
+            # The template is copied because the identity of nodes is used to reuse outputs
+            self.template = copy.deepcopy(template)
+        self.template_nodes = collect_template_nodes(self.template)
+        self.fp_options = fp_options
+        self.strict = strict
+        self.limits = limits
+
+        self.evaluations = 0
+        self.delta: list[JSONPatchOperation] = []
+        self.result: Any = None
+        self.records: dict[NodeKey, NodeRecord] = {}
+        self.resource: Any = missing
+        self.context: Context = {}
+
+    def resolve(self, resource: Resource, context: Optional[Context] = None) -> Any:
+        """
+        Resolves the template with the specified resource and optional context.
+
+        Args:
+            resource (Resource): The input FHIR resource to process.
+            context (Optional[Context], optional): Additional context data. Defaults to None.
+
+        Returns:
+            Any: The processed output based on the template.
+
+        Raises:
+            FPMLValidationError: If validation of the template or resource fails.
+            FPMLLimitExceededError: If the resolution exceeds one of the limits.
+        """
+        context = context or {}
+        changes: list[Pointer] = []
+
+        if self.records:
+            diff_data(self.resource, resource, resource_pointer, changes)
+            for name in self.context.keys() | context.keys():
+                old = self.context.get(name, missing)
+                new = context.get(name, missing)
+                old_aliased = old is self.resource
+                new_aliased = new is resource
+                if old is missing or new is missing or old_aliased or new_aliased:
+                    if not (old_aliased and new_aliased):
+                        changes.append((f"%{name}",))
+                else:
+                    diff_data(old, new, (f"%{name}",), changes)
+
+        return self.resolve_changes(resource, context, changes)
+
+    def apply_patch(self, patch: list[JSONPatchOperation]) -> Any:
+        """
+        Applies RFC 6902 JSON patch to the previously resolved resource and resolves the template again.
+
+        Context variables referencing the resource are updated as well.
+
+        Args:
+            patch (list[JSONPatchOperation]): Operations to apply to the resource.
+
+        Returns:
+            Any: The processed output based on the template.
+
+        Raises:
+            FPMLValidationError: If the patch cannot be applied or validation fails.
+            FPMLLimitExceededError: If the resolution exceeds one of the limits.
+        """  # noqa: E501
+        if self.resource is missing:
+            raise FPMLValidationError("Resource must be resolved before applying patch", [])
+
+        resource, paths = apply_patch(untrack(self.resource), patch)
+        context = {
+            name: resource if value is self.resource else untrack(value)
+            for name, value in self.context.items()
+        }
+        changes = [(*resource_pointer, *path) for path in paths]
+
+        return self.resolve_changes(resource, context, changes)
+
+    def resolve_changes(self, resource: Resource, context: Context, changes: list[Pointer]) -> Any:
+        dirty = find_dirty_nodes(self.records, changes)
+        tracker = DependencyTracker(self.template_nodes, self.records, dirty)
+        tracked_resource = track(resource, resource_pointer, tracker.recorder)
+        tracked_context = {
+            name: tracked_resource
+            if value is resource
+            else track(value, (f"%{name}",), tracker.recorder)
+            for name, value in context.items()
+        }
+        budget = ExecutionBudget(self.limits)
+
+        try:
+            result = resolve_root(
+                tracked_resource,
+                self.template,
+                tracked_context,
+                self.strict,
+                ResolveState(self.fp_options, budget, tracker, expressions=self.expressions),
+            )
+        except Exception:
+            # Partially recorded dependencies are not reliable, start from scratch next time
+            self.records = {}
+            self.resource = missing
+            self.context = {}
+            raise
+        finally:
+            tracker.recorder.reads = None
+            self.evaluations = budget.evaluations
+
+        self.records = tracker.records
+        self.resource = tracked_resource
+        self.context = tracked_context
+        self.delta = make_patch(self.result, result)
+        self.result = result
+
+        return result
+
+
+def collect_template_nodes(template: Any) -> set[int]:
+    """
+    Collects ids of the template nodes which outputs can be reused
+    """
+    nodes: set[int] = set()
+    stack = [template]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            nodes.add(id(node))
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            nodes.add(id(node))
+            stack.extend(node)
+        elif isinstance(node, str) and ("{{" in node or "{[" in node):
+            nodes.add(id(node))
+    return nodes
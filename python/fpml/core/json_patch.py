@@ -0,0 +1,230 @@
+import copy
+from typing import Any
+
+from .core_exceptions import FPMLValidationError
+from .core_types import JSONPatchOperation, Path
+
+
+def parse_pointer(pointer: str) -> list[str]:
+    """
+    Splits RFC 6901 JSON pointer into unescaped reference tokens
+
+    >>> parse_pointer("/item/0/a~1b")
+    ['item', '0', 'a/b']
+    """
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise FPMLValidationError(f"Invalid JSON pointer '{pointer}'", [])
+
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def format_pointer(path: Path) -> str:
+    """
+    Builds RFC 6901 JSON pointer from path
+
+    >>> format_pointer(["item", 0, "a/b"])
+    '/item/0/a~1b'
+    """
+    return "".join("/" + str(x).replace("~", "~0").replace("/", "~1") for x in path)
+
+
+def apply_patch(document: Any, patch: list[JSONPatchOperation]) -> tuple[Any, list[Path]]:
+    """
+    Applies RFC 6902 JSON patch to a copy of the document
+
+    Returns the patched document and the paths of the changed locations.
+    Insertion into or removal from an array changes all the following
+    elements of the array, so all of them are reported.
+    """
+    document = copy.deepcopy(document)
+    changes: list[Path] = []
+
+    for operation in patch:
+        op = operation.get("op")
+        tokens = parse_pointer(operation.get("path", ""))
+
+        if op == "add":
+            document = add_value(document, tokens, copy.deepcopy(operation["value"]), changes)
+        elif op == "remove":
+            document, _ = remove_value(document, tokens, changes)
+        elif op == "replace":
+            document = replace_value(document, tokens, copy.deepcopy(operation["value"]), changes)
+        elif op == "move":
+            document, value = remove_value(document, parse_pointer(operation["from"]), changes)
+            document = add_value(document, tokens, value, changes)
+        elif op == "copy":
+            value = copy.deepcopy(get_value(document, parse_pointer(operation["from"])))
+            document = add_value(document, tokens, value, changes)
+        elif op == "test":
+            if get_value(document, tokens) != operation.get("value"):
+                raise FPMLValidationError("JSON patch test operation failed", [*tokens])
+        else:
+            raise FPMLValidationError(f"Unknown JSON patch operation '{op}'", [*tokens])
+
+    return document, changes
+
+
+def make_patch(source: Any, target: Any) -> list[JSONPatchOperation]:
+    """
+    Builds RFC 6902 JSON patch transforming source into target
+
+    Subtrees shared by both documents (the same objects) are skipped without
+    comparison, so when target reuses the unchanged parts of source the cost
+    is proportional to the size of the changed parts only.
+
+    >>> make_patch({"a": 1, "b": [1, 2]}, {"a": 2, "b": [1, 2, 3]})
+    [{'op': 'replace', 'path': '/a', 'value': 2}, {'op': 'add', 'path': '/b/2', 'value': 3}]
+    """
+    operations: list[JSONPatchOperation] = []
+    diff_values(source, target, [], operations)
+    return operations
+
+
+def diff_values(source: Any, target: Any, path: Path, operations: list[JSONPatchOperation]) -> None:
+    if source is target:
+        return
+
+    if isinstance(source, dict) and isinstance(target, dict):
+        for key in source:
+            if key not in target:
+                operations.append({"op": "remove", "path": format_pointer([*path, key])})
+        for key, value in target.items():
+            if key in source:
+                diff_values(source[key], value, [*path, key], operations)
+            else:
+                operations.append(
+                    {"op": "add", "path": format_pointer([*path, key]), "value": value}
+                )
+    elif isinstance(source, list) and isinstance(target, list):
+        diff_lists(source, target, path, operations)
+    elif not is_same_value(source, target):
+        operations.append({"op": "replace", "path": format_pointer(path), "value": target})
+
+
+def diff_lists(
+    source: list[Any], target: list[Any], path: Path, operations: list[JSONPatchOperation]
+) -> None:
+    # Elements inserted or removed in the middle do not produce changes of the following ones
+    start = 0
+    source_end = len(source)
+    target_end = len(target)
+    while start < min(source_end, target_end) and is_same_value(source[start], target[start]):
+        start += 1
+    while (
+        source_end > start
+        and target_end > start
+        and is_same_value(source[source_end - 1], target[target_end - 1])
+    ):
+        source_end -= 1
+        target_end -= 1
+
+    common_end = start + min(source_end - start, target_end - start)
+    for index in range(start, common_end):
+        diff_values(source[index], target[index], [*path, index], operations)
+    for index in reversed(range(common_end, source_end)):
+        operations.append({"op": "remove", "path": format_pointer([*path, index])})
+    for index in range(common_end, target_end):
+        operations.append(
+            {"op": "add", "path": format_pointer([*path, index]), "value": target[index]}
+        )
+
+
+def is_same_value(source: Any, target: Any) -> bool:
+    # Shared subtrees are not compared, JSON distinguishes 1, 1.0 and true
+    if source is target:
+        return True
+    if type(source) is not type(target):
+        return False
+    if isinstance(source, dict):
+        return source.keys() == target.keys() and all(
+            is_same_value(value, target[key]) for key, value in source.items()
+        )
+    if isinstance(source, list):
+        return len(source) == len(target) and all(
+            is_same_value(x, y) for x, y in zip(source, target)
+        )
+    return bool(source == target)
+
+
+def get_value(document: Any, tokens: list[str]) -> Any:
+    value = document
+    for index, token in enumerate(tokens):
+        value = value[resolve_token(value, token, tokens[: index + 1])]
+    return value
+
+
+def resolve_token(container: Any, token: str, tokens: list[str], insert: bool = False) -> Any:
+    if isinstance(container, dict):
+        if not insert and token not in container:
+            raise FPMLValidationError("JSON patch path does not exist", [*tokens])
+        return token
+
+    if isinstance(container, list):
+        size = len(container) + 1 if insert else len(container)
+        if token == "-" and insert:
+            return len(container)
+        if not token.isdigit() or int(token) >= size:
+            raise FPMLValidationError("JSON patch array index is out of range", [*tokens])
+        return int(token)
+
+    raise FPMLValidationError("JSON patch path does not exist", [*tokens])
+
+
+def resolve_path(document: Any, tokens: list[str]) -> Path:
+    path: Path = []
+    value = document
+    for index, token in enumerate(tokens):
+        key = resolve_token(value, token, tokens[: index + 1])
+        path.append(key)
+        value = value[key]
+    return path
+
+
+def add_value(document: Any, tokens: list[str], value: Any, changes: list[Path]) -> Any:
+    if not tokens:
+        changes.append([])
+        return value
+
+    parent_path = resolve_path(document, tokens[:-1])
+    parent = get_value(document, tokens[:-1])
+    key = resolve_token(parent, tokens[-1], tokens, insert=True)
+
+    if isinstance(parent, list):
+        parent.insert(key, value)
+        changes.extend([*parent_path, index] for index in range(key, len(parent)))
+    else:
+        parent[key] = value
+        changes.append([*parent_path, key])
+
+    return document
+
+
+def replace_value(document: Any, tokens: list[str], value: Any, changes: list[Path]) -> Any:
+    if not tokens:
+        changes.append([])
+        return value
+
+    path = resolve_path(document, tokens)
+    get_value(document, tokens[:-1])[path[-1]] = value
+    changes.append(path)
+
+    return document
+
+
+def remove_value(document: Any, tokens: list[str], changes: list[Path]) -> tuple[Any, Any]:
+    if not tokens:
+        changes.append([])
+        return None, document
+
+    parent_path = resolve_path(document, tokens[:-1])
+    parent = get_value(document, tokens[:-1])
+    key = resolve_token(parent, tokens[-1], tokens)
+
+    if isinstance(parent, list):
+        changes.extend([*parent_path, index] for index in range(key, len(parent)))
+    else:
+        changes.append([*parent_path, key])
+
+    return document, parent.pop(key)
@@ -0,0 +1,130 @@
+import json
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Optional, cast
+
+from .cache import missing
+from .core_types import FPOptions, UserFnDefinition
+from .utils import copy_json
+
+# Default number of results stored per pure user-defined function
+default_maxsize = 1024
+
+
+class MemoizedFunction:
+    """
+    LRU store of the results of a pure user-defined function.
+
+    The results are keyed by the content hash of the input collection and the arguments,
+    so FHIR resources (unhashable dicts) can be passed as well. Results are copied, so
+    neither the caller nor the function can change the stored ones. The store is
+    thread-safe.
+
+    Attributes:
+        fn (Callable): The user-defined function.
+        maxsize (int): Maximum number of stored results.
+        hits (int): Number of results reused from the store.
+        misses (int): Number of calls of the function.
+    """
+
+    def __init__(self, fn: Callable, maxsize: int = default_maxsize) -> None:
+        self.fn = fn
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.results: OrderedDict[bytes, Any] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __call__(self, inputs: list[Any], *args: Any) -> Any:
+        try:
+            key = call_digest(inputs, args)
+        except (TypeError, ValueError):
+            # Values that cannot be serialized, e.g. circular structures, are not cached
+            return self.fn(inputs, *args)
+
+        with self.lock:
+            result = self.results.get(key, missing)
+            if result is not missing:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return copy_json(result)
+
+        result = self.fn(inputs, *args)
+        with self.lock:
+            self.misses += 1
+            self.results[key] = copy_json(result)
+            while len(self.results) > self.maxsize:
+                self.results.popitem(last=False)
+
+        return result
+
+    def clear(self) -> None:
+        with self.lock:
+            self.results.clear()
+
+
+# Stores of the pure functions, they live as long as the functions do
+memoized_functions: "weakref.WeakKeyDictionary[Callable, MemoizedFunction]" = (
+    weakref.WeakKeyDictionary()
+)
+memoized_functions_lock = threading.Lock()
+
+
+def memoized_function(definition: UserFnDefinition) -> MemoizedFunction:
+    """
+    Returns the store of the pure function shared by all resolutions
+    """
+    fn = definition["fn"]
+    maxsize = definition.get("maxsize", default_maxsize)
+    with memoized_functions_lock:
+        memoized = memoized_functions.get(fn)
+        if memoized is None:
+            memoized = memoized_functions[fn] = MemoizedFunction(fn, maxsize)
+        memoized.maxsize = maxsize
+    return memoized
+
+
+def memoize_user_functions(fp_options: Optional[FPOptions]) -> Optional[FPOptions]:
+    """
+    Replaces the pure user-defined functions by the memoized ones
+    """
+    table = (fp_options or {}).get("userInvocationTable")
+    if not table or not any(definition.get("pure") for definition in table.values()):
+        return fp_options
+
+    memoized_table = {
+        name: {**definition, "fn": memoized_function(definition)}
+        if definition.get("pure")
+        else definition
+        for name, definition in table.items()
+    }
+    return cast(FPOptions, {**cast(dict, fp_options), "userInvocationTable": memoized_table})
+
+
+def call_digest(inputs: list[Any], args: tuple[Any, ...]) -> bytes:
+    # hashlib is imported on first use to keep `import fpml` fast (it loads OpenSSL)
+    import hashlib
+
+    dump = json.dumps([inputs, args], sort_keys=True, separators=(",", ":"), default=dump_argument)
+    return hashlib.blake2b(dump.encode(), digest_size=16).digest()
+
+
+def dump_argument(value: Any) -> Any:
+    """
+    Serializes the non-JSON values passed by fhirpathpy by their contents
+
+    Raises:
+        TypeError: If the value cannot be serialized by its contents, the call is not memoized.
+    """
+    # fhirpathpy is imported on first use to keep `import fpml` fast
+    from decimal import Decimal
+
+    from fhirpathpy.engine.nodes import FP_Quantity, FP_TimeBase, ResourceNode  # type: ignore
+
+    if isinstance(value, ResourceNode):
+        # Nodes of data models are passed instead of the data, their types depend on the path
+        return {"ResourceNode": value.path, "data": value.data}
+    if isinstance(value, (Decimal, FP_Quantity, FP_TimeBase)):
+        return f"{type(value).__name__}:{value}"
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
@@ -0,0 +1,39 @@
+import gc
+from collections.abc import Mapping
+from typing import Any
+
+from .compiler import CompiledTemplate, compile_template
+
+
+def warm_up(
+    templates: Mapping[str, Any], strict: bool = False, freeze: bool = True
+) -> dict[str, CompiledTemplate]:
+    """
+    Compiles a registry of templates in the master process of a pre-fork server.
+
+    Forked workers inherit the compiled templates, so they do not parse them again.
+    The objects created so far are moved by `gc.freeze()` to the permanent generation,
+    the garbage collector of the workers does not touch them, so their memory pages
+    stay shared between the processes (copy-on-write) instead of being copied into each worker.
+
+    Args:
+        templates (Mapping[str, Any]): Templates by their names.
+        strict (bool, optional): Whether to verify that the templates can be resolved
+            in strict mode. Defaults to False.
+        freeze (bool, optional): Whether to freeze all the objects tracked by
+            the garbage collector. Defaults to True.
+
+    Returns:
+        dict[str, CompiledTemplate]: The compiled templates by their names.
+
+    Raises:
+        FPMLValidationError: If a template cannot be compiled.
+    """
+    compiled = {name: compile_template(template, strict) for name, template in templates.items()}
+
+    if freeze:
+        # Garbage is collected first, otherwise it would be kept forever
+        gc.collect()
+        gc.freeze()
+
+    return compiled
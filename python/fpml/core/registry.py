@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from .compiler import CompiledTemplate, compile_template, verify_strict_mode
+from .core_exceptions import FPMLValidationError
+from .core_types import Context, FPOptions, ResolveLimits, Resource
+from .disk_cache import template_hash
+from .extract import resolve_template
+
+
+class TemplateStats:
+    """
+    Usage statistics of a registered template
+
+    Attributes:
+        resolutions (int): Number of resolutions, including the failed ones.
+        errors (int): Number of failed resolutions.
+        total_time (float): Total time of the resolutions in seconds.
+    """
+
+    __slots__ = ("errors", "resolutions", "total_time")
+
+    def __init__(self) -> None:
+        self.resolutions = 0
+        self.errors = 0
+        self.total_time = 0.0
+
+    @property
+    def mean_time(self) -> float:
+        return self.total_time / self.resolutions if self.resolutions else 0.0
+
+
+class TemplateRegistry:
+    """
+    Registry of compiled templates referenced by their content hash.
+
+    Templates are registered once and resolved by id afterwards, so they are neither
+    sent nor parsed again. The id is the content hash of the template, i.e. the same
+    template always gets the same id and it can be used as ETag. The least recently
+    used templates are evicted when the registry is full, so clients must be ready
+    to register the template again. The registry is thread-safe.
+
+    Attributes:
+        maxsize (int): Maximum number of registered templates.
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self.templates: OrderedDict[str, tuple[CompiledTemplate, TemplateStats]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.templates)
+
+    def __contains__(self, template_id: object) -> bool:
+        return template_id in self.templates
+
+    def register(self, template: Any, strict: bool = False) -> str:
+        """
+        Compiles and registers the template.
+
+        Args:
+            template (Any): The template describing the transformation.
+            strict (bool, optional): Whether to verify that the template can be resolved
+                in strict mode. Defaults to False.
+
+        Returns:
+            str: The id of the template.
+
+        Raises:
+            FPMLValidationError: The same as `compile_template`.
+        """
+        template_id = template_hash(template)
+        with self.lock:
+            entry = self.templates.get(template_id)
+            if entry is not None:
+                self.templates.move_to_end(template_id)
+
+        if entry is None:
+            compiled = compile_template(template, strict)
+            with self.lock:
+                entry = self.templates.setdefault(template_id, (compiled, TemplateStats()))
+                while len(self.templates) > self.maxsize:
+                    self.templates.popitem(last=False)
+        elif strict:
+            verify_strict_mode(entry[0])
+
+        return template_id
+
+    def get(self, template_id: str) -> CompiledTemplate:
+        """
+        Returns the compiled template
+
+        Raises:
+            KeyError: If the template is not registered or has been evicted.
+        """
+        with self.lock:
+            compiled, _ = self.templates[template_id]
+            self.templates.move_to_end(template_id)
+        return compiled
+
+    def stats(self, template_id: str) -> TemplateStats:
+        """
+        Returns the usage statistics of the template
+
+        Raises:
+            KeyError: If the template is not registered or has been evicted.
+        """
+        return self.templates[template_id][1]
+
+    def record(self, template_id: str, duration: float, failed: bool) -> None:
+        """
+        Records the resolution of the template done outside the registry, e.g. in a worker
+        """
+        with self.lock:
+            entry = self.templates.get(template_id)
+            if entry is not None:
+                stats = entry[1]
+                stats.resolutions += 1
+                stats.total_time += duration
+                if failed:
+                    stats.errors += 1
+
+    def resolve(  # noqa: PLR0913
+        self,
+        template_id: str,
+        resource: Resource,
+        context: Optional[Context] = None,
+        fp_options: Optional[FPOptions] = None,
+        strict: bool = False,
+        limits: Optional[ResolveLimits] = None,
+    ) -> Any:
+        """
+        Resolves the registered template, see `resolve_template` for the arguments
+
+        Raises:
+            KeyError: If the template is not registered or has been evicted.
+            FPMLValidationError: If validation of the template or resource fails.
+        """
+        compiled = self.get(template_id)
+        started = time.perf_counter()
+        try:
+            result = resolve_template(resource, compiled, context, fp_options, strict, limits)
+        except FPMLValidationError:
+            self.record(template_id, time.perf_counter() - started, failed=True)
+            raise
+        self.record(template_id, time.perf_counter() - started, failed=False)
+        return result
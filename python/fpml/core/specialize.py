@@ -0,0 +1,377 @@
+import re
+from typing import Any, Optional
+
+from .analysis import (
+    analyze_expression,
+    analyze_node,
+    array_template_regexp,
+    assign_key_regexp,
+    condition_expression,
+    context_key_regexp,
+    else_key_regexp,
+    for_key_regexp,
+    if_key_regexp,
+    merge_key_regexp,
+    parse_expression,
+    single_template_regexp,
+)
+from .compiler import CompiledTemplate
+from .core_types import Context, FPOptions
+from .extract import resolve_template, run_expression
+from .utils import copy_json, omit_key
+
+# Substrings starting expressions and directives, values containing them are not folded
+template_markers = ("{{", "{[", "{%")
+
+directive_key_regexps = (
+    context_key_regexp,
+    for_key_regexp,
+    if_key_regexp,
+    else_key_regexp,
+    merge_key_regexp,
+    assign_key_regexp,
+)
+
+
+def specialize(
+    template: Any, static_context: Context, fp_options: Optional[FPOptions] = None
+) -> Any:
+    """
+    Partially evaluates the template against the context variables that do not change
+    between resolutions, e.g. organization data, ConceptMaps and code system constants.
+
+    Expressions that use only the static variables and literals are evaluated and their
+    results are folded into the template as literal values. Assign blocks with static
+    values are removed, if blocks with static conditions are replaced by the chosen branch
+    and for blocks over static collections are unrolled when their bodies do not depend
+    on the resource. Expressions reading the resource, volatile functions and user-defined
+    functions not declared pure are left for the resolution, as well as the expressions
+    which evaluation fails, so the errors are raised by the resolution.
+
+    Resolving the residual template with the context extended by the static variables
+    gives the same result as resolving the original template, with fewer evaluations.
+    The static variables must not be redefined by the context of the resolution.
+
+    Args:
+        template (Any): The template describing the transformation, raw or compiled.
+        static_context (Context): Variables that do not change between resolutions.
+        fp_options (Optional[FPOptions], optional): Options for controlling FHIRPath evaluation,
+            the same as passed to the resolution. Defaults to None.
+
+    Returns:
+        Any: The residual template.
+    """
+    if isinstance(template, CompiledTemplate):
+        template = template.template
+
+    residual = TemplateSpecializer(fp_options).specialize_node(template, dict(static_context))
+
+    # Unchanged nodes are shared with the original template
+    return copy_json(residual)
+
+
+class TemplateSpecializer:
+    """
+    Partial evaluator of template nodes against static variables
+
+    Every method receives the scope, i.e. the static variables visible at the node, and
+    returns the residual node. Nodes resolved to nothing are returned as empty arrays,
+    they are removed from objects and arrays of the residual template.
+    """
+
+    __slots__ = ("fp_options", "impure_functions")
+
+    def __init__(self, fp_options: Optional[FPOptions]) -> None:
+        self.fp_options = fp_options
+        table = (fp_options or {}).get("userInvocationTable") or {}
+        self.impure_functions = frozenset(
+            name for name, definition in table.items() if not definition.get("pure")
+        )
+
+    def evaluate(self, expression: str, scope: Context) -> Optional[list[Any]]:
+        """
+        Evaluates the expression if it depends only on the scope, None otherwise
+        """
+        info = analyze_expression(expression)
+        if (
+            info.reads_resource
+            or info.volatile
+            or not info.variables <= scope.keys()
+            or not info.functions.isdisjoint(self.impure_functions)
+        ):
+            return None
+
+        try:
+            parsed = parse_expression(expression)
+            result = run_expression({}, expression, parsed, scope, self.fp_options)
+        except Exception:
+            # The error is raised by the resolution of the residual template
+            return None
+
+        return copy_json(result)
+
+    def specialize_node(self, node: Any, scope: Context) -> Any:
+        if isinstance(node, dict):
+            assign_key = next((key for key in node if assign_key_regexp.match(key)), None)
+            if assign_key is not None:
+                return self.specialize_assign_block(node, assign_key, scope)
+            return self.specialize_object(node, scope)
+        if isinstance(node, list):
+            return self.specialize_array(node, scope)
+        if isinstance(node, str):
+            return self.specialize_string(node, scope)
+        return node
+
+    def specialize_array(self, node: list[Any], scope: Context) -> list[Any]:
+        residual: list[Any] = []
+        for value in node:
+            specialized = self.specialize_node(value, scope)
+            # Arrays are flattened by the resolution, so nested arrays are spliced
+            if isinstance(specialized, list):
+                residual.extend(specialized)
+            else:
+                residual.append(specialized)
+        return residual
+
+    def specialize_properties(self, node: dict[str, Any], scope: Context) -> dict[str, Any]:
+        residual = {}
+        for key, value in node.items():
+            specialized = self.specialize_node(value, scope)
+            if not is_undefined(specialized):
+                residual[key] = specialized
+        return residual
+
+    def specialize_string(self, node: str, scope: Context) -> Any:
+        array_match = array_template_regexp.match(node)
+        if array_match:
+            result = self.evaluate(array_match.group(1), scope)
+            return result if result is not None and is_literal(result) else node
+
+        matches = list(single_template_regexp.finditer(node))
+        if len(matches) == 1 and matches[0].group(0) == node:
+            result = self.evaluate(matches[0].group(1), scope)
+            if not result:
+                return node if result is None else None if node.startswith("{{+") else []
+            return result[0] if is_literal(result[0]) else node
+
+        return self.specialize_interpolation(node, matches, scope)
+
+    def specialize_interpolation(self, node: str, matches: list[re.Match], scope: Context) -> Any:
+        residual = node
+        dynamic: list[str] = []
+        for match in matches:
+            result = self.evaluate(match.group(1), scope)
+            if result is not None and not result and not dynamic:
+                # The previous expressions are folded, so nothing else is evaluated
+                return None if match.group(0).startswith("{{+") else []
+            if not result or not is_literal(str(result[0])):
+                dynamic.append(match.group(1))
+                continue
+            residual = residual.replace(match.group(0), str(result[0]))
+
+        # The folded values must not change the expressions left in the string
+        if array_template_regexp.match(residual) or dynamic != [
+            match.group(1) for match in single_template_regexp.finditer(residual)
+        ]:
+            return node
+        return residual
+
+    def specialize_assign_block(self, node: dict[str, Any], assign_key: str, scope: Context) -> Any:
+        value = node[assign_key]
+        objs = value if isinstance(value, list) else [value]
+        if not all(isinstance(obj, dict) and len(obj) == 1 for obj in objs):
+            # Invalid blocks are reported by the resolution
+            return node
+
+        inner_scope = dict(scope)
+        entries: list[tuple[str, Any, bool]] = []
+        for obj in objs:
+            ((name, obj_value),) = obj.items()
+            specialized = self.specialize_node(obj_value, inner_scope)
+            static = is_literal(specialized)
+            if static:
+                inner_scope[name] = resolve_template({}, specialized)
+            else:
+                inner_scope.pop(name, None)
+            entries.append((name, specialized, static))
+
+        rest = omit_key(node, assign_key)
+        residual = self.specialize_object(rest, inner_scope)
+        kept = kept_assign_entries(entries, residual)
+        if kept and not (isinstance(residual, dict) and assign_key not in residual):
+            # The rest must stay an object with the same directives to hold the assign block
+            residual = self.specialize_object(rest, inner_scope, fold=False)
+            kept = kept_assign_entries(entries, residual)
+
+        return {assign_key: kept, **residual} if kept else residual
+
+    def specialize_object(self, node: dict[str, Any], scope: Context, fold: bool = True) -> Any:
+        # Directives are matched in the same order as by the resolution
+        keys = list(node)
+        context_key = next((key for key in keys if context_key_regexp.match(key)), None)
+        if context_key is not None:
+            return self.specialize_context_block(node, context_key, scope, fold)
+
+        merge_key = next((key for key in keys if merge_key_regexp.match(key)), None)
+        if merge_key is not None:
+            return self.specialize_merge_block(node, merge_key, scope)
+
+        for_key = next((key for key in keys if for_key_regexp.match(key)), None)
+        if for_key is not None:
+            return self.specialize_for_block(node, for_key, scope, fold)
+
+        if any(if_key_regexp.match(key) or else_key_regexp.match(key) for key in keys):
+            return self.specialize_if_block(node, scope, fold)
+
+        return self.specialize_properties(node, scope)
+
+    def specialize_context_block(
+        self, node: dict[str, Any], context_key: str, scope: Context, fold: bool
+    ) -> Any:
+        if len(node) > 1:
+            # Invalid blocks are reported by the resolution
+            return node
+        match = context_key_regexp.match(context_key)
+        expression = match.group(1) if match else ""
+        if fold and self.evaluate(expression, scope) == []:
+            return []
+        # The content is resolved against the results, so only the variables are static
+        return {context_key: self.specialize_node(node[context_key], scope)}
+
+    def specialize_merge_block(
+        self, node: dict[str, Any], merge_key: str, scope: Context
+    ) -> dict[str, Any]:
+        value = node[merge_key]
+        fragments = []
+        for fragment in value if isinstance(value, list) else [value]:
+            specialized = self.specialize_node(fragment, scope)
+            if is_undefined(specialized):
+                continue
+            # Every fragment must be resolved to an object, so unrolled blocks are kept
+            fragments.append(fragment if isinstance(specialized, list) else specialized)
+
+        residual = self.specialize_properties(omit_key(node, merge_key), scope)
+        return {merge_key: fragments, **residual}
+
+    def specialize_for_block(
+        self, node: dict[str, Any], for_key: str, scope: Context, fold: bool
+    ) -> Any:
+        match = for_key_regexp.match(for_key)
+        if not match or len(node) > 1:
+            return node
+        index_key, item_key, expression = match.groups()
+        body = node[for_key]
+
+        answers = self.evaluate(expression, scope) if fold else None
+        if answers is not None:
+            unrolled = self.unroll_for_block(body, answers, item_key, index_key, scope)
+            if unrolled is not None:
+                return unrolled
+
+        body_scope = omit_key(omit_key(scope, item_key), index_key)
+        return {for_key: self.specialize_node(body, body_scope)}
+
+    def unroll_for_block(
+        self,
+        body: Any,
+        answers: list[Any],
+        item_key: str,
+        index_key: Optional[str],
+        scope: Context,
+    ) -> Optional[list[Any]]:
+        """
+        Specializes the body for every item, None if the items are used by the resolution
+        """
+        loop_variables = {item_key, index_key} - {None}
+        residual: list[Any] = []
+        for index, answer in enumerate(answers):
+            iteration_scope = {
+                **scope,
+                item_key: answer,
+                **({index_key: index} if index_key else {}),
+            }
+            specialized = self.specialize_node(body, iteration_scope)
+            if not analyze_node(specialized, {}).variables.isdisjoint(loop_variables):
+                return None
+            if isinstance(specialized, list):
+                residual.extend(specialized)
+            else:
+                residual.append(specialized)
+        return residual
+
+    def specialize_if_block(self, node: dict[str, Any], scope: Context, fold: bool) -> Any:
+        if_keys = [key for key in node if if_key_regexp.match(key)]
+        else_keys = [key for key in node if else_key_regexp.match(key)]
+        if len(if_keys) != 1 or len(else_keys) > 1:
+            return node
+        if_key = if_keys[0]
+        else_key = else_keys[0] if else_keys else None
+        properties = {key: value for key, value in node.items() if key not in (if_key, else_key)}
+
+        match = if_key_regexp.match(if_key)
+        expression = match.group(1) if match else ""
+        answer = self.evaluate(condition_expression(expression), scope) if fold else None
+        if answer:
+            branch_key = if_key if answer[0] else else_key
+            branch = self.specialize_node(node[branch_key], scope) if branch_key else []
+            if not properties:
+                return branch
+            if branch is None or is_undefined(branch):
+                return self.specialize_properties(properties, scope)
+            # Keys missing in the resolved branch keep the values of the node, so only
+            # branches adding new keys are merged into the node
+            if (
+                isinstance(branch, dict)
+                and is_plain_object(branch)
+                and branch.keys().isdisjoint(properties)
+            ):
+                return {**self.specialize_properties(properties, scope), **branch}
+
+        # Undefined properties are kept, since the number of keys tells whether the branch
+        # is merged into the node
+        return {key: self.specialize_node(value, scope) for key, value in node.items()}
+
+
+def kept_assign_entries(
+    entries: list[tuple[str, Any, bool]], residual: Any
+) -> list[dict[str, Any]]:
+    """
+    Entries of the assign block used by the residual node, static ones are removed otherwise
+    """
+    used = set(analyze_node(residual, {}).variables)
+    kept = []
+    for name, value, static in reversed(entries):
+        if not static or name in used:
+            kept.append({name: value})
+            used.update(analyze_node(value, {}).variables)
+    kept.reverse()
+    return kept
+
+
+def is_undefined(node: Any) -> bool:
+    # Empty arrays are removed by the resolution like undefined values
+    return isinstance(node, list) and not node
+
+
+def is_plain_object(node: Any) -> bool:
+    return isinstance(node, dict) and not any(
+        regexp.match(key) for key in node for regexp in directive_key_regexps
+    )
+
+
+def is_literal(node: Any) -> bool:
+    """
+    Whether the node contains no expressions and directives, i.e. is JSON data
+    """
+    from decimal import Decimal
+
+    if isinstance(node, str):
+        return not any(marker in node for marker in template_markers)
+    if isinstance(node, dict):
+        return all(
+            isinstance(key, str) and is_literal(key) and is_literal(value)
+            for key, value in node.items()
+        )
+    if isinstance(node, list):
+        return all(is_literal(value) for value in node)
+    return node is None or isinstance(node, (bool, int, float, Decimal))
@@ -0,0 +1,46 @@
+from typing import TYPE_CHECKING, Any, Optional
+
+from .budget import ExecutionBudget
+from .core_types import FPOptions, ParallelOptions
+from .memoize import memoize_user_functions
+
+if TYPE_CHECKING:
+    from .batch import SharedExpressionsSession
+    from .cache import SubtreeCacheSession
+    from .tracking import DependencyTracker
+
+
+class ResolveState:
+    """
+    Per-resolution data shared by all nodes of the template being resolved
+    """
+
+    __slots__ = (
+        "budget",
+        "cache",
+        "expressions",
+        "fp_options",
+        "parallel",
+        "shared",
+        "tracker",
+    )
+
+    def __init__(  # noqa: PLR0913
+        self,
+        fp_options: Optional[FPOptions],
+        budget: ExecutionBudget,
+        tracker: Optional["DependencyTracker"] = None,
+        cache: Optional["SubtreeCacheSession"] = None,
+        expressions: Optional[dict[str, Any]] = None,
+        parallel: Optional[ParallelOptions] = None,
+        shared: Optional["SharedExpressionsSession"] = None,
+    ) -> None:
+        self.fp_options = memoize_user_functions(fp_options)
+        self.budget = budget
+        self.tracker = tracker
+        self.cache = cache
+        # Parsed expressions of the compiled template
+        self.expressions = expressions
+        self.parallel = parallel
+        # Results (or errors) of the expressions shared by the resolutions of a batch
+        self.shared = shared
@@ -0,0 +1,233 @@
+import json
+from collections.abc import Iterator
+from contextvars import copy_context
+from typing import Any, Optional
+
+from .budget import ExecutionBudget
+from .compiler import CompiledTemplate
+from .constants import root_node_key, undefined
+from .core_types import Context, FPOptions, Matcher, Node, Path, ResolveLimits, Resource
+from .extract import (
+    MergedNode,
+    for_block_loop,
+    process_assign_block,
+    process_context_block,
+    process_if_block,
+    process_merge_block,
+    process_node,
+)
+from .functions import ReferenceIndex, current_references
+from .guarded_resource import guarded_resource
+from .state import ResolveState
+
+# Separators of json.dumps, so the streamed text is the same as json.dumps of the result
+item_separator = ", "
+key_separator = ": "
+
+
+def resolve_template_stream(  # noqa: PLR0913
+    resource: Resource,
+    template: Any,
+    context: Optional[Context] = None,
+    fp_options: Optional[FPOptions] = None,
+    strict: bool = False,
+    limits: Optional[ResolveLimits] = None,
+    chunk_size: int = 65536,
+) -> Iterator[str]:
+    """
+    Resolves the template yielding the output as chunks of JSON text.
+
+    The output is serialized while the template is walked, so it is never built in
+    memory as a whole: the iterations of for blocks are resolved one by one, e.g.
+    entries of a huge Bundle, and only the output of a single iteration is kept at once.
+    The text is the same as `json.dumps` of the result of `resolve_template` with the
+    same arguments: undefined values and empty objects and arrays are removed and
+    nested arrays are flattened. Keys and array brackets are written only when the
+    first defined value follows them.
+
+    Args:
+        resource (Resource): The input FHIR resource to process.
+        template (Any): The template describing the transformation, raw or compiled.
+        context (Optional[Context], optional): Additional context data. Defaults to None.
+        fp_options (Optional[FPOptions], optional): Options for controlling FHIRPath evaluation.
+            Defaults to None.
+        strict (bool, optional): Whether to enforce strict mode. Defaults to False.
+        limits (Optional[ResolveLimits], optional): Resource limits for the resolution.
+            Defaults to None.
+        chunk_size (int, optional): Minimal length of the yielded chunks, except the last one.
+            Defaults to 65536.
+
+    Yields:
+        str: Chunks of the JSON text of the output.
+
+    Raises:
+        FPMLValidationError: If validation of the template or resource fails. Chunks
+            yielded before the error are a prefix of incomplete JSON text.
+        FPMLLimitExceededError: If the resolution exceeds one of the limits.
+    """
+    state = ResolveState(fp_options, ExecutionBudget(limits))
+
+    if isinstance(template, CompiledTemplate):
+        state.expressions = template.expressions
+        template = template.template
+
+    # The generator runs in its own context, so the references of the resolution
+    # are not visible to the consumer between the chunks
+    run = copy_context().run
+    pieces = run(stream_root, resource, template, context, strict, state)
+
+    buffer: list[str] = []
+    length = 0
+    while True:
+        piece = run(next, pieces, None)
+        if piece is None:
+            break
+        buffer.append(piece)
+        length += len(piece)
+        if length >= chunk_size:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+
+    if buffer:
+        yield "".join(buffer)
+
+
+def stream_root(
+    resource: Resource,
+    template: Any,
+    context: Optional[Context],
+    strict: bool,
+    state: ResolveState,
+) -> Iterator[str]:
+    # The same as resolve_root, except the reference index is not reset in the private context
+    root_context = {"context": resource, **(context or {})}
+    current_references.set(ReferenceIndex(root_context))
+
+    state.budget.spend_output_node([])
+    empty = True
+    for piece in stream_node(
+        [root_node_key],
+        guarded_resource if strict else resource,
+        template,
+        root_context,
+        state,
+        in_array=False,
+    ):
+        empty = False
+        yield piece
+
+    if empty:
+        yield "null"
+
+
+def stream_node(  # noqa: PLR0913
+    path: Path,
+    resource: Resource,
+    node: Node,
+    context: Context,
+    state: ResolveState,
+    in_array: bool,
+) -> Iterator[str]:
+    """
+    Streams the output of resolve_node, nothing is yielded for undefined
+
+    Arrays resolved within arrays are flattened, i.e. only their items are yielded.
+    """
+    processed, context = process_node_lazily(path, resource, node, context, state)
+
+    # The same branches as iterate_node has
+    state.budget.spend_output_node(path)
+    if isinstance(processed, (list, Iterator)):
+        yield from stream_array(path, resource, processed, context, state, in_array)
+    elif isinstance(processed, (dict, MergedNode)):
+        yield from stream_object(path, resource, processed, context, state)
+    else:
+        value = process_node(path, resource, processed, context, state)[0]
+        yield from stream_value(value, in_array)
+
+
+def process_node_lazily(
+    path: Path,
+    resource: Resource,
+    node: Node,
+    context: Context,
+    state: ResolveState,
+) -> tuple[Any, Context]:
+    """
+    The same as process_node, except the iterations of for blocks are resolved on demand
+    """
+    if not isinstance(node, dict):
+        return process_node(path, resource, node, context, state)
+
+    new_node, new_context = process_assign_block(path, resource, node, context, state)
+
+    matchers: list[Matcher] = [process_context_block, process_merge_block]
+    for matcher in matchers:
+        result = matcher(path, resource, new_node, new_context, state)
+        if result:
+            return result["node"], new_context
+
+    loop = for_block_loop(path, resource, new_node, new_context, state)
+    if loop is not None:
+        answers, resolve_iteration = loop
+        iterations = (resolve_iteration(index, answer) for index, answer in enumerate(answers))
+        return iterations, new_context
+
+    result = process_if_block(path, resource, new_node, new_context, state)
+    if result:
+        return result["node"], new_context
+
+    return new_node, new_context
+
+
+def stream_array(  # noqa: PLR0913
+    path: Path,
+    resource: Resource,
+    node: Any,
+    context: Context,
+    state: ResolveState,
+    in_array: bool,
+) -> Iterator[str]:
+    # The opening bracket is written with the first item, so empty arrays are removed
+    empty = True
+    for index, value in enumerate(node):
+        prefix = ("" if in_array else "[") if empty else item_separator
+        for piece in stream_node([*path, index], resource, value, context, state, in_array=True):
+            yield f"{prefix}{piece}"
+            prefix = ""
+            empty = False
+
+    if not empty and not in_array:
+        yield "]"
+
+
+def stream_object(
+    path: Path,
+    resource: Resource,
+    node: Any,
+    context: Context,
+    state: ResolveState,
+) -> Iterator[str]:
+    # Keys are written with the first piece of their values, so undefined values are removed
+    empty = True
+    for key, value in node.items():
+        prefix = f"{'{' if empty else item_separator}{json.dumps(key)}{key_separator}"
+        for piece in stream_node([*path, key], resource, value, context, state, in_array=False):
+            yield f"{prefix}{piece}"
+            prefix = ""
+            empty = False
+
+    if not empty:
+        yield "}"
+
+
+def stream_value(value: Any, in_array: bool) -> Iterator[str]:
+    if value is undefined:
+        return
+    if in_array and isinstance(value, list):
+        # Arrays returned by expressions are flattened into the outer array as well
+        if value:
+            yield item_separator.join(json.dumps(item) for item in value)
+        return
+    yield json.dumps(value)
@@ -0,0 +1,458 @@
+from collections.abc import Iterator
+from typing import Any, Callable, Optional, Union
+
+from .analysis import analyze_expression
+from .core_types import Context, Node, Path, Resource
+
+# Kinds of reads recorded by tracked data:
+# a value read at the pointer (including a missing key),
+# a read of the container's keys or length,
+# and a read of the whole subtree, e.g. comparison or serialization
+POINT_READ = 0
+SHAPE_READ = 1
+DEEP_READ = 2
+
+Pointer = tuple[Union[str, int], ...]
+Read = tuple[Pointer, int]
+NodeKey = tuple[Any, ...]
+
+missing = object()
+
+
+class ReadRecorder:
+    """
+    Collects reads of tracked data into the set of the currently resolved node
+    """
+
+    __slots__ = ("reads",)
+
+    def __init__(self) -> None:
+        self.reads: Optional[set[Read]] = None
+
+    def record(self, pointer: Pointer, kind: int) -> None:
+        if self.reads is not None:
+            self.reads.add((pointer, kind))
+
+
+class TrackedDict(dict[str, Any]):
+    """
+    Copy of a JSON object that records which of its parts are accessed
+    """
+
+    __slots__ = ("_pointer", "_recorder")
+
+    _pointer: Pointer
+    _recorder: ReadRecorder
+
+    def __getitem__(self, key: str) -> Any:
+        self._recorder.record((*self._pointer, key), POINT_READ)
+        return dict.__getitem__(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self._recorder.record((*self._pointer, key), POINT_READ)
+        return dict.get(self, key, default)
+
+    def __contains__(self, key: object) -> bool:
+        if isinstance(key, (str, int)):
+            self._recorder.record((*self._pointer, key), POINT_READ)
+        return dict.__contains__(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        self._recorder.record(self._pointer, SHAPE_READ)
+        return dict.__iter__(self)
+
+    def __len__(self) -> int:
+        self._recorder.record(self._pointer, SHAPE_READ)
+        return dict.__len__(self)
+
+    def keys(self):  # type: ignore
+        self._recorder.record(self._pointer, SHAPE_READ)
+        return dict.keys(self)
+
+    def values(self):  # type: ignore
+        self._recorder.record(self._pointer, DEEP_READ)
+        return dict.values(self)
+
+    def items(self):  # type: ignore
+        self._recorder.record(self._pointer, DEEP_READ)
+        return dict.items(self)
+
+    def copy(self) -> dict[str, Any]:
+        self._recorder.record(self._pointer, DEEP_READ)
+        return dict(dict.items(self))
+
+    def __eq__(self, other: object) -> bool:
+        record_deep_read(self, other)
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other: object) -> bool:
+        record_deep_read(self, other)
+        return dict.__ne__(self, other)
+
+    def __repr__(self) -> str:
+        self._recorder.record(self._pointer, DEEP_READ)
+        return dict.__repr__(self)
+
+    __hash__ = None  # type: ignore
+
+
+class TrackedList(list[Any]):
+    """
+    Copy of a JSON array that records which of its parts are accessed
+    """
+
+    __slots__ = ("_pointer", "_recorder")
+
+    _pointer: Pointer
+    _recorder: ReadRecorder
+
+    def __getitem__(self, index: Any) -> Any:
+        size = list.__len__(self)
+        if isinstance(index, slice):
+            self._recorder.record(self._pointer, SHAPE_READ)
+            for position in range(*index.indices(size)):
+                self._recorder.record((*self._pointer, position), POINT_READ)
+        else:
+            self._recorder.record(
+                (*self._pointer, index + size if index < 0 else index), POINT_READ
+            )
+        return list.__getitem__(self, index)
+
+    def __iter__(self) -> Iterator[Any]:
+        self._recorder.record(self._pointer, SHAPE_READ)
+        for index, value in enumerate(list.__iter__(self)):
+            self._recorder.record((*self._pointer, index), POINT_READ)
+            yield value
+
+    def __len__(self) -> int:
+        self._recorder.record(self._pointer, SHAPE_READ)
+        return list.__len__(self)
+
+    def __contains__(self, value: object) -> bool:
+        self._recorder.record(self._pointer, DEEP_READ)
+        return list.__contains__(self, value)
+
+    def __eq__(self, other: object) -> bool:
+        record_deep_read(self, other)
+        return list.__eq__(self, other)
+
+    def __ne__(self, other: object) -> bool:
+        record_deep_read(self, other)
+        return list.__ne__(self, other)
+
+    def __add__(self, other: Any) -> list[Any]:  # type: ignore
+        record_deep_read(self, other)
+        return list.__add__(self, other)
+
+    def __radd__(self, other: Any) -> list[Any]:
+        record_deep_read(self, other)
+        return list.__add__(list(other), list(list.__iter__(self)))
+
+    def __repr__(self) -> str:
+        self._recorder.record(self._pointer, DEEP_READ)
+        return list.__repr__(self)
+
+    def copy(self) -> list[Any]:
+        self._recorder.record(self._pointer, DEEP_READ)
+        return list(list.__iter__(self))
+
+    def index(self, *args: Any) -> int:
+        self._recorder.record(self._pointer, DEEP_READ)
+        return list.index(self, *args)
+
+    def count(self, value: Any) -> int:
+        self._recorder.record(self._pointer, DEEP_READ)
+        return list.count(self, value)
+
+    def __reversed__(self) -> Iterator[Any]:
+        self._recorder.record(self._pointer, DEEP_READ)
+        return list.__reversed__(self)
+
+    __hash__ = None  # type: ignore
+
+
+Tracked = (TrackedDict, TrackedList)
+
+
+def record_deep_read(value: Any, other: Any) -> None:
+    value._recorder.record(value._pointer, DEEP_READ)
+    if isinstance(other, Tracked):
+        other._recorder.record(other._pointer, DEEP_READ)
+
+
+def track(value: Any, pointer: Pointer, recorder: ReadRecorder) -> Any:
+    """
+    Makes a tracked copy of JSON value located at pointer
+    """
+    if isinstance(value, dict):
+        tracked_dict = TrackedDict(
+            (key, track(child, (*pointer, key), recorder)) for key, child in value.items()
+        )
+        tracked_dict._pointer = pointer
+        tracked_dict._recorder = recorder
+        return tracked_dict
+
+    if isinstance(value, list):
+        tracked_list = TrackedList(
+            track(child, (*pointer, index), recorder) for index, child in enumerate(value)
+        )
+        tracked_list._pointer = pointer
+        tracked_list._recorder = recorder
+        return tracked_list
+
+    return value
+
+
+def untrack(value: Any) -> Any:
+    """
+    Makes a plain copy of tracked value without recording reads
+    """
+    if isinstance(value, dict):
+        return {key: untrack(child) for key, child in dict.items(value)}
+    if isinstance(value, list):
+        return [untrack(child) for child in list.__iter__(value)]
+    return value
+
+
+def diff_data(old: Any, new: Any, pointer: Pointer, changes: list[Pointer]) -> None:
+    """
+    Collects pointers to the locations where new value differs from the old one
+    """
+    if type(untracked_type(old)) is not type(untracked_type(new)):
+        changes.append(pointer)
+    elif isinstance(old, dict):
+        for key in dict.keys(old) | dict.keys(new):
+            if dict.__contains__(old, key) and dict.__contains__(new, key):
+                diff_data(
+                    dict.__getitem__(old, key), dict.__getitem__(new, key), (*pointer, key), changes
+                )
+            else:
+                changes.append((*pointer, key))
+    elif isinstance(old, list):
+        old_size = list.__len__(old)
+        new_size = list.__len__(new)
+        for index in range(min(old_size, new_size)):
+            diff_data(
+                list.__getitem__(old, index),
+                list.__getitem__(new, index),
+                (*pointer, index),
+                changes,
+            )
+        changes.extend(
+            (*pointer, index) for index in range(min(old_size, new_size), max(old_size, new_size))
+        )
+    elif old != new:
+        changes.append(pointer)
+
+
+def untracked_type(value: Any) -> Any:
+    if isinstance(value, TrackedDict):
+        return {}
+    if isinstance(value, TrackedList):
+        return []
+    return value
+
+
+def same_value(old: Any, new: Any) -> bool:
+    """
+    Strict equality of values bound to a node
+
+    Tracked values are the same if they are located at the same pointer,
+    their content is compared using the recorded reads.
+    """
+    if old is new:
+        return True
+    if isinstance(old, Tracked) or isinstance(new, Tracked):
+        return (
+            isinstance(old, Tracked) and isinstance(new, Tracked) and old._pointer == new._pointer
+        )
+    if type(old) is not type(new):
+        return False
+    if isinstance(old, dict):
+        return old.keys() == new.keys() and all(same_value(old[key], new[key]) for key in old)
+    if isinstance(old, list):
+        return len(old) == len(new) and all(same_value(x, y) for x, y in zip(old, new))
+    return bool(old == new)
+
+
+class ReadIndex:
+    """
+    Prefix tree of the recorded reads that finds nodes affected by a change
+    """
+
+    def __init__(self) -> None:
+        # None key stores reads recorded at the pointer, other keys are pointer components
+        self.root: dict[Any, Any] = {}
+
+    def add(self, pointer: Pointer, kind: int, key: NodeKey) -> None:
+        tree = self.root
+        for component in pointer:
+            tree = tree.setdefault(component, {})
+        tree.setdefault(None, []).append((kind, key))
+
+    def affected(self, change: Pointer) -> Iterator[NodeKey]:
+        tree: Optional[dict[Any, Any]] = self.root
+        last = len(change) - 1
+        for depth, component in enumerate(change):
+            if tree is None:
+                return
+            for kind, key in tree.get(None, ()):
+                if kind == DEEP_READ or (kind == SHAPE_READ and depth == last):
+                    yield key
+            tree = tree.get(component)
+        if tree is None:
+            return
+
+        stack = [tree]
+        while stack:
+            tree = stack.pop()
+            for component, subtree in tree.items():
+                if component is None:
+                    for _kind, key in subtree:
+                        yield key
+                else:
+                    stack.append(subtree)
+
+
+class NodeRecord:
+    """
+    Dependencies and output of a template node resolved with given inputs
+    """
+
+    __slots__ = (
+        "children",
+        "context",
+        "counters",
+        "key",
+        "node",
+        "output",
+        "reads",
+        "resource",
+        "variables",
+        "volatile",
+    )
+
+    def __init__(self, key: NodeKey, node: Node, resource: Resource, context: Context) -> None:
+        self.key = key
+        self.node = node
+        self.resource = resource
+        self.context = context
+        self.reads: set[Read] = set()
+        self.variables: set[str] = set()
+        self.volatile = False
+        self.children: list[NodeKey] = []
+        self.counters: dict[Any, int] = {}
+        self.output: Node = None
+
+
+class DependencyTracker:
+    """
+    Records dependencies of the template nodes during resolution and reuses
+    outputs of the previous resolution for the nodes that are not affected
+
+    A node output is reused only if the node is the same template node,
+    it is resolved against the same resource and the same values of the
+    variables its subtree uses, and none of the reads recorded for its
+    subtree is affected by the changes.
+    """
+
+    def __init__(
+        self,
+        template_nodes: set[int],
+        previous: dict[NodeKey, NodeRecord],
+        dirty: set[NodeKey],
+    ) -> None:
+        self.recorder = ReadRecorder()
+        self.template_nodes = template_nodes
+        self.previous = previous
+        self.dirty = dirty
+        self.records: dict[NodeKey, NodeRecord] = {}
+        self.stack = [NodeRecord((), None, {}, {})]
+        self.recorder.reads = self.stack[0].reads
+
+    def track(
+        self,
+        path: Path,
+        resource: Resource,
+        node: Node,
+        context: Context,
+        resolve: Callable[[], Node],
+    ) -> Node:
+        if id(node) not in self.template_nodes:
+            return resolve()
+
+        parent = self.stack[-1]
+        component = path[-1] if path else None
+        count = parent.counters.get(component, 0)
+        parent.counters[component] = count + 1
+        key = (parent.key, component, count)
+        parent.children.append(key)
+
+        previous = self.previous.get(key)
+        if (
+            previous is not None
+            and key not in self.dirty
+            and previous.node is node
+            and same_value(previous.resource, resource)
+            and all(
+                same_value(previous.context.get(name, missing), context.get(name, missing))
+                for name in previous.variables
+            )
+        ):
+            self.adopt(previous)
+            parent.variables.update(previous.variables)
+            return previous.output
+
+        record = NodeRecord(key, node, resource, context)
+        self.stack.append(record)
+        self.recorder.reads = record.reads
+        try:
+            record.output = resolve()
+        finally:
+            self.stack.pop()
+            self.recorder.reads = parent.reads
+
+        record.counters = {}
+        parent.variables.update(record.variables)
+        self.records[key] = record
+
+        return record.output
+
+    def record_evaluation(self, expression: str) -> None:
+        info = analyze_expression(expression)
+        record = self.stack[-1]
+        record.variables.update(info.variables)
+        if info.volatile:
+            record.volatile = True
+
+    def adopt(self, record: NodeRecord) -> None:
+        stack = [record]
+        while stack:
+            record = stack.pop()
+            self.records[record.key] = record
+            stack.extend(self.previous[key] for key in record.children)
+
+
+def find_dirty_nodes(records: dict[NodeKey, NodeRecord], changes: list[Pointer]) -> set[NodeKey]:
+    """
+    Finds nodes that read changed data or use volatile functions and all their ancestors
+    """
+    index = ReadIndex()
+    affected: list[NodeKey] = []
+    for key, record in records.items():
+        if record.volatile:
+            affected.append(key)
+        for pointer, kind in record.reads:
+            index.add(pointer, kind, key)
+
+    for change in changes:
+        affected.extend(index.affected(change))
+
+    dirty: set[NodeKey] = set()
+    for affected_key in affected:
+        key = affected_key
+        while key and key not in dirty:
+            dirty.add(key)
+            key = key[0]
+
+    return dirty
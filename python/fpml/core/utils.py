@@ -1,17 +1,25 @@
+from functools import cache
 from typing import Any, Optional
 
 
-def flatten(lst: list):
-    result = []
-    for item in lst:
-        if isinstance(item, list):
-            result.extend(flatten(item))
-        else:
-            result.append(item)
-    return result
-
-
 def omit_key(obj: dict[str, Any], key: Optional[str]) -> dict[str, Any]:
     if key is None:
         return obj
     return {k: v for k, v in obj.items() if k != key}
+
+
+def copy_json(value: Any) -> Any:
+    # Scalars are immutable, so only containers are copied
+    if isinstance(value, dict):
+        return {k: copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_json(x) for x in value]
+    return value
+
+
+@cache
+def package_version(name: str) -> str:
+    # importlib.metadata is slow to import, so it is imported only when a version is needed
+    import importlib.metadata
+
+    return importlib.metadata.version(name)
@@ -0,0 +1,503 @@
+"""
+HTTP server compatible with the TypeScript server of FHIRPath mapping language
+
+Endpoints:
+- POST /parse-template, /r4/parse-template: resolve the template using FHIR R4 model
+- POST /aidbox/parse-template: resolve the template using Aidbox format of resources
+- POST /templates: register the template `{"template": ...}`, returns its id
+- GET /templates/{id}: usage statistics of the registered template
+- GET /health: health check
+- GET /metrics: latency, throughput and template cache statistics
+
+The request body is `{"template": ..., "context": ...}` or `{"templateId": ..., "context": ...}`
+for the registered templates, strict mode is enabled by `?strict=true` (or the deprecated
+`strict` field of the body). The resource is `context.QuestionnaireResponse` if it is
+present, otherwise the context itself.
+
+Both WSGI (`wsgi_app`) and ASGI (`asgi_app`) applications are provided without
+third-party dependencies, `python -m fpml.server` runs the WSGI app with wsgiref.
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from typing import Any, Callable, NamedTuple, Optional, cast
+from urllib.parse import parse_qs
+
+from .core.compiler import CompiledTemplate, compile_template
+from .core.core_exceptions import FPMLValidationError
+from .core.core_types import FPOptions
+from .core.disk_cache import template_hash
+from .core.extract import resolve_template
+from .core.functions import answers_function
+from .core.registry import TemplateRegistry
+
+# Flavour of the resources by endpoint, `r4` uses the FHIR model
+endpoints = {
+    "/parse-template": "r4",
+    "/r4/parse-template": "r4",
+    "/aidbox/parse-template": "aidbox",
+}
+
+# Compiled templates kept by every process
+max_compiled_templates = 256
+
+# Number of the last requests used for the latency percentiles
+latency_window = 1000
+
+
+class Response(NamedTuple):
+    status: int
+    body: Any
+    headers: tuple[tuple[str, str], ...] = ()
+
+
+class ResolveArgs(NamedTuple):
+    flavour: str
+    # Content hash of the template, i.e. the id of the registered template
+    digest: str
+    # Raw or compiled template, None if the worker is expected to have it compiled
+    template: Any
+    context: dict[str, Any]
+    strict: bool
+    registered: bool
+
+
+def make_fp_options(flavour: str) -> FPOptions:
+    """
+    Options of the endpoint including the `answers(linkId)` function of the TypeScript server
+    """
+    options: dict[str, Any] = {
+        "userInvocationTable": {"answers": answers_function(aidbox=flavour != "r4")}
+    }
+    if flavour == "r4":
+        from fhirpathpy.models import models  # type: ignore
+
+        options["model"] = models["r4"]
+    return cast(FPOptions, options)
+
+
+class TemplateResolver:
+    """
+    Resolver of the requests keeping the compiled templates by their content hash
+    """
+
+    def __init__(self, maxsize: int = max_compiled_templates) -> None:
+        self.maxsize = maxsize
+        self.templates: OrderedDict[str, CompiledTemplate] = OrderedDict()
+        self.fp_options: dict[str, FPOptions] = {}
+        self.lock = threading.Lock()
+
+    def compile(self, digest: str, template: Any) -> tuple[Optional[CompiledTemplate], bool]:
+        with self.lock:
+            compiled = self.templates.get(digest)
+            if compiled is not None:
+                self.templates.move_to_end(digest)
+                return compiled, True
+
+        if template is None:
+            return None, False
+        compiled = compile_template(template)
+        with self.lock:
+            self.templates[digest] = compiled
+            if len(self.templates) > self.maxsize:
+                self.templates.popitem(last=False)
+        return compiled, False
+
+    def resolve(self, args: ResolveArgs) -> Optional[tuple[Response, bool]]:
+        """
+        Returns the response and whether the compiled template was reused,
+        or None if the template is not passed and is not compiled yet
+        """
+        if args.flavour not in self.fp_options:
+            self.fp_options[args.flavour] = make_fp_options(args.flavour)
+
+        cache_hit = True
+        try:
+            if isinstance(args.template, CompiledTemplate):
+                compiled: Optional[CompiledTemplate] = args.template
+            else:
+                compiled, cache_hit = self.compile(args.digest, args.template)
+                if compiled is None:
+                    return None
+            resource = args.context.get("QuestionnaireResponse", args.context)
+            result = resolve_template(
+                resource,
+                compiled,
+                {"root": resource, **args.context},
+                self.fp_options[args.flavour],
+                args.strict,
+            )
+        except FPMLValidationError as exc:
+            outcome = operation_outcome(str(exc), exc.error_message, exc.error_path)
+            return Response(400, outcome), cache_hit
+
+        return Response(200, result), cache_hit
+
+
+# Resolver of the worker process
+worker_resolver = TemplateResolver()
+
+
+def resolve_in_worker(args: ResolveArgs) -> Optional[tuple[Response, bool]]:
+    return worker_resolver.resolve(args)
+
+
+class Metrics:
+    """
+    Thread-safe counters of the requests
+    """
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.requests: dict[str, int] = {}
+        self.errors = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.latencies: deque[float] = deque(maxlen=latency_window)
+
+    def record(self, path: str, status: int, latency: float, cache_hit: Optional[bool]) -> None:
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            if status >= HTTPStatus.BAD_REQUEST:
+                self.errors += 1
+            if cache_hit is not None:
+                self.latencies.append(latency)
+                if cache_hit:
+                    self.cache_hits += 1
+                else:
+                    self.cache_misses += 1
+
+    def report(self) -> dict[str, Any]:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            uptime = time.monotonic() - self.started
+            resolved = self.cache_hits + self.cache_misses
+
+            def percentile(value: float) -> Optional[float]:
+                if not latencies:
+                    return None
+                return round(latencies[min(len(latencies) - 1, int(len(latencies) * value))], 6)
+
+            return {
+                "uptime": round(uptime, 3),
+                "requests": dict(self.requests),
+                "errors": self.errors,
+                "throughput": round(resolved / uptime, 3) if uptime else 0,
+                "latency": {
+                    "p50": percentile(0.5),
+                    "p95": percentile(0.95),
+                    "p99": percentile(0.99),
+                    "max": percentile(1),
+                },
+                "templateCache": {"hits": self.cache_hits, "misses": self.cache_misses},
+            }
+
+
+class TemplateServer:
+    """
+    Request handler shared by the WSGI and ASGI applications.
+
+    Resolution is CPU-bound, so it is offloaded to the process pool if `workers` is
+    set, every worker keeps its own compiled templates. Otherwise the templates are
+    resolved in the calling thread. Registered templates are sent to a worker only
+    if it has not compiled them yet.
+
+    Attributes:
+        executor (Optional[Executor]): Pool resolving the templates.
+        registry (TemplateRegistry): Templates registered by the clients.
+        metrics (Metrics): Counters of the requests.
+    """
+
+    def __init__(
+        self,
+        workers: int = 0,
+        executor: Optional[Executor] = None,
+        registry: Optional[TemplateRegistry] = None,
+    ) -> None:
+        self.executor = executor or (ProcessPoolExecutor(workers) if workers else None)
+        self.registry = registry if registry is not None else TemplateRegistry()
+        self.resolver = TemplateResolver()
+        self.metrics = Metrics()
+
+    def close(self) -> None:
+        if self.executor:
+            self.executor.shutdown()
+
+    def prepare(
+        self, method: str, path: str, query: str, body: bytes
+    ) -> tuple[Optional[Response], Optional[ResolveArgs]]:
+        """
+        Returns either the immediate response or the arguments of the resolution
+        """
+        if path in endpoints:
+            if method != "POST":
+                return Response(405, {"error": "Method Not Allowed"}), None
+            return self.parse_request(endpoints[path], query, body)
+
+        return self.route(method, path, query, body), None
+
+    def route(self, method: str, path: str, query: str, body: bytes) -> Response:
+        handler: Callable[[], Response]
+        if path.startswith("/templates/"):
+            allowed, handler = "GET", partial(self.template_stats, path[len("/templates/") :])
+        elif path == "/templates":
+            allowed, handler = "POST", partial(self.register_template, query, body)
+        elif path == "/health":
+            allowed, handler = "GET", lambda: Response(200, {"status": "ok"})
+        elif path == "/metrics":
+            allowed, handler = "GET", lambda: Response(200, self.metrics.report())
+        else:
+            return Response(404, {"error": "Not Found"})
+
+        if method != allowed:
+            return Response(405, {"error": "Method Not Allowed"})
+        return handler()
+
+    def parse_request(
+        self, flavour: str, query: str, body: bytes
+    ) -> tuple[Optional[Response], Optional[ResolveArgs]]:
+        try:
+            payload = json.loads(body or b"{}")
+            context = payload.get("context") or {}
+            template_id = payload.get("templateId")
+            template = payload["template"] if template_id is None else None
+        except (ValueError, AttributeError, KeyError):
+            return error_response(400, "Invalid request body"), None
+        if not isinstance(context, dict):
+            return error_response(400, "Context must be an object"), None
+
+        strict = strict_mode(query, payload)
+
+        if template_id is None:
+            digest = template_hash(template)
+            return None, ResolveArgs(flavour, digest, template, context, strict, False)
+
+        try:
+            compiled = self.registry.get(template_id)
+        except (KeyError, TypeError):
+            return error_response(404, f"Template '{template_id}' is not registered"), None
+        return None, ResolveArgs(flavour, template_id, compiled, context, strict, True)
+
+    def register_template(self, query: str, body: bytes) -> Response:
+        try:
+            payload = json.loads(body or b"{}")
+            template = payload["template"]
+        except (ValueError, TypeError, KeyError):
+            return error_response(400, "Invalid request body")
+
+        registered = template_hash(template) in self.registry
+        try:
+            template_id = self.registry.register(template, strict_mode(query, payload))
+        except FPMLValidationError as exc:
+            return Response(400, operation_outcome(str(exc), exc.error_message, exc.error_path))
+        headers = (("ETag", f'"{template_id}"'), ("Location", f"/templates/{template_id}"))
+        return Response(200 if registered else 201, {"id": template_id}, headers)
+
+    def template_stats(self, template_id: str) -> Response:
+        try:
+            stats = self.registry.stats(template_id)
+        except KeyError:
+            return error_response(404, f"Template '{template_id}' is not registered")
+        data = {
+            "id": template_id,
+            "resolutions": stats.resolutions,
+            "errors": stats.errors,
+            "meanTime": round(stats.mean_time, 6),
+        }
+        return Response(200, data, (("ETag", f'"{template_id}"'),))
+
+    def handle(self, method: str, path: str, query: str, body: bytes) -> Response:
+        started = time.perf_counter()
+        response, args = self.prepare(method, path, query, body)
+        cache_hit = None
+        if args is not None:
+            if self.executor:
+                result = self.executor.submit(resolve_in_worker, worker_args(args)).result()
+                if result is None:
+                    result = self.executor.submit(resolve_in_worker, raw_args(args)).result()
+            else:
+                result = self.resolver.resolve(args)
+            assert result is not None
+            response, cache_hit = result
+        assert response is not None
+        self.record(path, args, response, time.perf_counter() - started, cache_hit)
+        return response
+
+    async def handle_async(self, method: str, path: str, query: str, body: bytes) -> Response:
+        started = time.perf_counter()
+        response, args = self.prepare(method, path, query, body)
+        cache_hit = None
+        if args is not None:
+            loop = asyncio.get_running_loop()
+            if self.executor:
+                call = loop.run_in_executor(self.executor, resolve_in_worker, worker_args(args))
+                result = await call
+                if result is None:
+                    call = loop.run_in_executor(self.executor, resolve_in_worker, raw_args(args))
+                    result = await call
+            else:
+                result = await loop.run_in_executor(None, self.resolver.resolve, args)
+            assert result is not None
+            response, cache_hit = result
+        assert response is not None
+        self.record(path, args, response, time.perf_counter() - started, cache_hit)
+        return response
+
+    def record(
+        self,
+        path: str,
+        args: Optional[ResolveArgs],
+        response: Response,
+        duration: float,
+        cache_hit: Optional[bool],
+    ) -> None:
+        if args is not None and args.registered:
+            self.registry.record(args.digest, duration, failed=response.status != HTTPStatus.OK)
+        if path.startswith("/templates/"):
+            path = "/templates/{id}"
+        self.metrics.record(path, response.status, duration, cache_hit)
+
+
+def worker_args(args: ResolveArgs) -> ResolveArgs:
+    # Registered templates are not sent until the worker asks for them
+    return args._replace(template=None) if args.registered else args
+
+
+def raw_args(args: ResolveArgs) -> ResolveArgs:
+    # The copy of the raw template is smaller to send than the compiled template
+    return args._replace(template=args.template.template)
+
+
+def strict_mode(query: str, payload: Any) -> bool:
+    strict_query = parse_qs(query).get("strict")
+    if strict_query:
+        return strict_query[-1] in ("true", "1")
+    return bool(payload.get("strict"))
+
+
+def error_response(status: int, message: str) -> Response:
+    return Response(status, operation_outcome(message, message, ""))
+
+
+def operation_outcome(message: str, diagnostics: str, path: str) -> dict[str, Any]:
+    return {
+        "resourceType": "OperationOutcome",
+        "text": {"status": "generated", "div": message},
+        "issue": [
+            {
+                "severity": "fatal",
+                "code": "processing",
+                "expression": [path],
+                "diagnostics": diagnostics,
+            }
+        ],
+    }
+
+
+def wsgi_app(server: TemplateServer) -> Callable:
+    """
+    Returns WSGI application serving the requests by the server
+    """
+
+    def app(environ: dict[str, Any], start_response: Callable) -> list[bytes]:
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        body = environ["wsgi.input"].read(length) if length else b""
+        status, data, headers = server.handle(
+            environ["REQUEST_METHOD"],
+            environ.get("PATH_INFO") or "/",
+            environ.get("QUERY_STRING", ""),
+            body,
+        )
+        content = json.dumps(data).encode()
+        start_response(
+            f"{status} {HTTPStatus(status).phrase}",
+            [
+                ("Content-Type", "application/json"),
+                ("Content-Length", str(len(content))),
+                *headers,
+            ],
+        )
+        return [content]
+
+    return app
+
+
+def asgi_app(server: TemplateServer) -> Callable:
+    """
+    Returns ASGI application serving the requests by the server
+    """
+
+    async def app(scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    server.close()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        status, data, headers = await server.handle_async(
+            scope["method"], scope["path"], scope.get("query_string", b"").decode(), body
+        )
+        content = json.dumps(data).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(content)).encode()),
+                    *((name.lower().encode(), value.encode()) for name, value in headers),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": content})
+
+    return app
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIServer, make_server
+
+    parser = argparse.ArgumentParser(prog="fpml.server", description="FPML HTTP server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("-w", "--workers", type=int, default=0, help="number of processes")
+    args = parser.parse_args(argv)
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    server = TemplateServer(args.workers)
+    with make_server(
+        args.host, args.port, wsgi_app(server), server_class=ThreadingWSGIServer
+    ) as httpd:
+        try:
+            httpd.serve_forever()
+        finally:
+            server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import threading
+from typing import Any
+
+import pytest
+
+from fpml import (
+    FPMLLimitExceededError,
+    FPMLValidationError,
+    SubtreeCache,
+    compile_template,
+    resolve_batch,
+    resolve_template,
+)
+from fpml.core.analysis import find_shared_expressions
+from fpml.core.core_types import FPOptions, Resource
+
+template = {
+    "resourceType": "Patient",
+    "id": "{{ id }}",
+    "name": [{"text": "{{ %prefix + name }}"}],
+    "meta": {"source": "{{ %source }}"},
+}
+
+
+def test_resolve_batch_returns_results_in_order() -> None:
+    resources: list[Resource] = [{"id": str(index), "name": f"N{index}"} for index in range(50)]
+
+    results = resolve_batch(
+        resources, template, {"prefix": "Mr. ", "source": "batch"}, max_workers=4
+    )
+    assert results == [
+        {
+            "resourceType": "Patient",
+            "id": str(index),
+            "name": [{"text": f"Mr. N{index}"}],
+            "meta": {"source": "batch"},
+        }
+        for index in range(50)
+    ]
+
+
+def test_resolve_batch_raises_or_returns_errors() -> None:
+    resources: list[Resource] = [{"name": "a"}, {"name": 1}]
+    compiled = compile_template({"text": "{{ name + %suffix }}"})
+
+    with pytest.raises(FPMLValidationError):
+        resolve_batch(resources, compiled, {"suffix": "!"}, max_workers=2)
+
+    results = resolve_batch(
+        resources, compiled, {"suffix": "!"}, max_workers=2, return_exceptions=True
+    )
+    assert results[0] == {"text": "a!"}
+    assert isinstance(results[1], FPMLValidationError)
+
+
+def test_subtree_cache_is_shared_by_threads() -> None:
+    cache = SubtreeCache(maxsize=4)
+    barrier = threading.Barrier(8)
+    errors: list[BaseException] = []
+
+    def run(offset: int) -> None:
+        barrier.wait()
+        try:
+            for index in range(50):
+                context = {"prefix": str((offset + index) % 6), "source": "threads"}
+                result = resolve_batch(
+                    [{"id": "1", "name": "x"}], template, context, cache=cache, max_workers=1
+                )
+                assert result[0]["name"] == [{"text": f"{(offset + index) % 6}x"}]
+        except BaseException as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=run, args=(offset,)) for offset in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(cache) <= cache.maxsize
+
+
+def test_resolve_batch_reuses_shared_expressions() -> None:
+    calls: list[Any] = []
+
+    def impure(inputs: list[Any]) -> list[Any]:
+        calls.append(inputs)
+        return inputs
+
+    fp_options: FPOptions = {"userInvocationTable": {"impure": {"fn": impure, "arity": {0: []}}}}
+    compiled = compile_template(
+        {
+            "{% assign %}": [{"id": "{{ %prefix }}"}],
+            "shadowed": "{{ %id }}",
+            "entries": {
+                "{% for index, item in %items %}": {
+                    "id": "{{ id }}",
+                    "item": "{{ %item + %index }}",
+                    "name": "{{ name.upper() }}",
+                    "impure": "{{ name.impure() }}",
+                }
+            },
+            "{% if name.exists() %}": {"code": "{{ code.first() + 1 }}"},
+            "contained": {"{{ contained }}": {"id": "{{ id }}"}},
+            "total": "{{ %items.count() }}",
+        }
+    )
+    resources: list[Resource] = [
+        {"id": "1", "name": "a", "contained": [{"id": "c"}]},
+        {"id": "2", "code": ["x"]},
+        {"id": "3", "name": "b", "code": ["y"]},
+    ]
+    context = {"prefix": "p", "items": [10, 20]}
+
+    expected = [
+        resolve_template(resource, compiled, context, fp_options) for resource in resources[:2]
+    ]
+    with pytest.raises(FPMLValidationError):
+        resolve_template(resources[2], compiled, context, fp_options)
+    expected_calls = len(calls)
+    calls.clear()
+
+    results = resolve_batch(
+        resources, compiled, context, fp_options, max_workers=2, return_exceptions=True
+    )
+    assert results[:2] == expected
+    # The error of the expression is raised only by the resolution evaluating it
+    assert isinstance(results[2], FPMLValidationError)
+    assert "code.first() + 1" in str(results[2])
+    assert len(calls) == expected_calls
+
+
+def test_find_shared_expressions() -> None:
+    template = {
+        "{% assign %}": [{"a": "{{ %b }}"}],
+        "context": {"{{ item }}": "{{ id }}"},
+        "now": "{{ now() }}",
+        "impure": "{{ impure() }}",
+        "list": {"{% for x in %list %}": ["{{ id + %x }}", "{{ id + %a }}", "{{ name }}"]},
+    }
+
+    assert find_shared_expressions(template, frozenset(["impure"])) == frozenset(
+        ["%b", "item", "%list", "name"]
+    )
+
+
+def test_resolve_batch_evaluates_shared_expressions_within_resolutions() -> None:
+    threads: list[threading.Thread] = []
+
+    def pure(inputs: list[Any]) -> list[Any]:
+        threads.append(threading.current_thread())
+        return inputs
+
+    fp_options: FPOptions = {
+        "userInvocationTable": {"pure": {"fn": pure, "arity": {0: []}, "pure": True}}
+    }
+    compiled = compile_template(
+        {
+            "{% if false %}": {"dead": "{{ name.pure() }}"},
+            "entries": {"{% for item in %items %}": {"id": "{{ id.pure() }}"}},
+            "total": "{{ %items.count().pure() }}",
+        }
+    )
+    resources: list[Resource] = [{"id": str(index), "name": "a"} for index in range(4)]
+    context = {"items": [1, 2, 3]}
+
+    results = resolve_batch(resources, compiled, context, fp_options, max_workers=2)
+    assert results == [{"entries": [{"id": str(index)}] * 3, "total": 3} for index in range(4)]
+    # Expressions of dead branches are not evaluated, the others once per resource or batch
+    assert len(threads) == len(resources) + 1
+    assert threading.main_thread() not in threads
+
+    # Evaluations are spent from the budgets of the resolutions
+    results = resolve_batch(
+        resources,
+        compiled,
+        context,
+        fp_options,
+        limits={"max_evaluations": 3},
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, FPMLLimitExceededError) for result in results)
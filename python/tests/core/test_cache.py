@@ -0,0 +1,142 @@
+from fpml.core.analysis import analyze_expression
+from fpml.core.cache import SubtreeCache
+from fpml.core.core_types import UserInvocationTable
+from fpml.core.extract import resolve_template
+
+template = {
+    "resourceType": "Observation",
+    "subject": {"reference": "Patient/{{ %Patient.id }}", "display": "{{ %Patient.name }}"},
+    "value": "{{ %QuestionnaireResponse.item.answer.value }}",
+}
+
+
+def test_analyze_expression_reads_resource() -> None:
+    assert not analyze_expression("%Patient.name.where(use = 'official').given").reads_resource
+    assert not analyze_expression("iif(%a.exists(), 1, 2)").reads_resource
+    assert not analyze_expression("%a.union(%b)").reads_resource
+    assert analyze_expression("name.given").reads_resource
+    assert analyze_expression("%a.union(name)").reads_resource
+    assert analyze_expression("iif(active, 1, 2)").reads_resource
+    assert analyze_expression("count()").reads_resource
+
+
+def test_cache_reuses_context_only_subtrees() -> None:
+    cache = SubtreeCache()
+    patient = {"id": "pid", "name": "John"}
+
+    for value in [1, 2, 1]:
+        qr = {"item": [{"answer": [{"value": value}]}]}
+        context = {"Patient": patient, "QuestionnaireResponse": qr}
+        expected = resolve_template(qr, template, context, strict=True)
+
+        assert resolve_template(qr, template, context, strict=True, cache=cache) == expected
+
+    # The root is resolved for each new answer, the subject is reused for the second answer
+    # and the whole result is reused for the repeated answer
+    assert cache.misses == 3  # noqa: PLR2004
+    assert cache.hits == 2  # noqa: PLR2004
+
+
+def test_cache_is_keyed_by_variables_content() -> None:
+    cache = SubtreeCache()
+    subject_template = {"subject": {"name": "{{ %Patient.name }}"}}
+
+    result = resolve_template({}, subject_template, {"Patient": {"name": "John"}}, cache=cache)
+    assert result == {"subject": {"name": "John"}}
+    result = resolve_template({}, subject_template, {"Patient": {"name": "Jane"}}, cache=cache)
+    assert result == {"subject": {"name": "Jane"}}
+    result = resolve_template({}, subject_template, {"Patient": {"name": "John"}}, cache=cache)
+    assert result == {"subject": {"name": "John"}}
+    assert cache.hits == 1
+
+
+def test_cache_skips_subtrees_reading_resource() -> None:
+    cache = SubtreeCache()
+    resource_template = {"a": {"b": "{{ b }}"}, "c": {"{% for x in %items %}": "{{ %x }}"}}
+
+    assert resolve_template({"b": 1}, resource_template, {"items": [1]}, cache=cache) == {
+        "a": {"b": 1},
+        "c": [1],
+    }
+    assert resolve_template({"b": 2}, resource_template, {"items": [1]}, cache=cache) == {
+        "a": {"b": 2},
+        "c": [1],
+    }
+    assert cache.hits == 1
+
+
+def test_cache_covers_context_blocks() -> None:
+    cache = SubtreeCache()
+    context_template = {"names": {"{{ %Patient.name }}": {"given": "{{ given }}"}}}
+    context = {"Patient": {"name": [{"given": ["John"]}]}}
+
+    resolve_template({}, context_template, context, cache=cache)
+    result = resolve_template({}, context_template, context, cache=cache)
+
+    assert result == {"names": [{"given": "John"}]}
+    assert cache.hits == 1
+
+
+def test_cache_skips_outputs_with_template_syntax() -> None:
+    cache = SubtreeCache()
+    nested_template = {"a": {"b": "{{ %value }}"}}
+    context = {"value": "{{ name }}"}
+
+    assert resolve_template({"name": "x"}, nested_template, context, cache=cache) == {
+        "a": {"b": "x"}
+    }
+    assert resolve_template({"name": "y"}, nested_template, context, cache=cache) == {
+        "a": {"b": "y"}
+    }
+    assert cache.hits == 0
+
+
+def test_cache_returns_copies() -> None:
+    cache = SubtreeCache()
+    subject_template = {"subject": {"name": "{{ %name }}"}}
+
+    result = resolve_template({}, subject_template, {"name": "John"}, cache=cache)
+    result["subject"]["name"] = "changed"
+
+    assert resolve_template({}, subject_template, {"name": "John"}, cache=cache) == {
+        "subject": {"name": "John"}
+    }
+
+
+def test_cache_is_keyed_by_user_functions() -> None:
+    cache = SubtreeCache()
+    subject_template = {"subject": {"value": "{{ %value.fn() }}"}}
+    first: UserInvocationTable = {"fn": {"fn": lambda inputs: [1], "arity": {0: []}}}
+    second: UserInvocationTable = {"fn": {"fn": lambda inputs: [2], "arity": {0: []}}}
+
+    result = resolve_template(
+        {}, subject_template, {"value": 0}, {"userInvocationTable": first}, cache=cache
+    )
+    assert result == {"subject": {"value": 1}}
+    result = resolve_template(
+        {}, subject_template, {"value": 0}, {"userInvocationTable": second}, cache=cache
+    )
+    assert result == {"subject": {"value": 2}}
+
+
+def test_cache_follows_templates_edited_in_place() -> None:
+    cache = SubtreeCache()
+    edited = {"a": {"x": "{{ %P.name }}"}}
+    context = {"P": {"name": "n"}}
+
+    assert resolve_template({}, edited, context, cache=cache) == {"a": {"x": "n"}}
+    edited["a"]["x"] = "{{ %P.name }}-changed"
+    assert resolve_template({}, edited, context, cache=cache) == {"a": {"x": "n-changed"}}
+    edited["a"]["x"] = "{{ %P.name }}"
+    assert resolve_template({}, edited, context, cache=cache) == {"a": {"x": "n"}}
+    assert cache.hits == 1
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    cache = SubtreeCache(maxsize=2)
+    name_template = {"name": ["{{ %name }}"]}
+
+    for name in ["a", "b", "c"]:
+        resolve_template({}, name_template, {"name": name}, cache=cache)
+
+    assert len(cache) == 2  # noqa: PLR2004
@@ -0,0 +1,126 @@
+import io
+import json
+
+import pytest
+
+from fpml.cli import main
+
+template = {
+    "resourceType": "Observation",
+    "subject": {"reference": "Patient/{{ %Patient.id }}"},
+    "valueString": "{{ %QuestionnaireResponse.item.where(linkId = 'name').answer.valueString }}",
+}
+
+
+def make_resource(index: int) -> dict:
+    return {
+        "resourceType": "QuestionnaireResponse",
+        "id": str(index),
+        "item": [{"linkId": "name", "answer": [{"valueString": f"Name {index}"}]}],
+    }
+
+
+@pytest.fixture
+def files(tmp_path):
+    (tmp_path / "template.json").write_text(json.dumps(template))
+    (tmp_path / "context.yaml").write_text("Patient:\n  id: patient\n")
+    (tmp_path / "resources.ndjson").write_text(
+        "".join(f"{json.dumps(make_resource(index))}\n" for index in range(200))
+    )
+    return tmp_path
+
+
+def read_results(output: str) -> list:
+    return [json.loads(line) for line in output.splitlines()]
+
+
+def test_cli_resolves_stdin(files, monkeypatch, capsys) -> None:
+    monkeypatch.setattr("sys.stdin", io.StringIO(json.dumps(make_resource(1))))
+
+    exit_code = main([str(files / "template.json"), "-c", str(files / "context.yaml"), "--strict"])
+
+    assert exit_code == 0
+    assert read_results(capsys.readouterr().out) == [
+        {
+            "resourceType": "Observation",
+            "subject": {"reference": "Patient/patient"},
+            "valueString": "Name 1",
+        }
+    ]
+
+
+def test_cli_resolves_in_workers_in_order(files, capsys) -> None:
+    exit_code = main(
+        [
+            str(files / "template.json"),
+            str(files / "resources.ndjson"),
+            "--context",
+            str(files / "context.yaml"),
+            "--workers",
+            "2",
+            "--ordered",
+            "--model",
+            "r4",
+        ]
+    )
+
+    results = read_results(capsys.readouterr().out)
+    assert exit_code == 0
+    assert [result["valueString"] for result in results] == [f"Name {i}" for i in range(200)]
+
+
+def test_cli_resolves_in_threads_in_order(files, capsys) -> None:
+    exit_code = main(
+        [
+            str(files / "template.json"),
+            str(files / "resources.ndjson"),
+            "--context",
+            str(files / "context.yaml"),
+            "--workers",
+            "4",
+            "--threads",
+            "--ordered",
+        ]
+    )
+
+    results = read_results(capsys.readouterr().out)
+    assert exit_code == 0
+    assert [result["valueString"] for result in results] == [f"Name {i}" for i in range(200)]
+
+
+def test_cli_writes_output_dir(files) -> None:
+    (files / "patient-qr.json").write_text(json.dumps(make_resource(7)))
+
+    exit_code = main(
+        [
+            str(files / "template.json"),
+            str(files / "patient-qr.json"),
+            "-c",
+            str(files / "context.yaml"),
+            "--output-dir",
+            str(files / "output"),
+        ]
+    )
+
+    assert exit_code == 0
+    result = json.loads((files / "output" / "patient-qr.json").read_text())
+    assert result["valueString"] == "Name 7"
+
+
+def test_cli_reports_errors(files, monkeypatch, capsys) -> None:
+    monkeypatch.setattr("sys.stdin", io.StringIO('{"resourceType": "Patient"}\nnot json\n'))
+
+    exit_code = main([str(files / "template.json"), "--profile"])
+
+    captured = capsys.readouterr()
+    assert exit_code == 1
+    assert "1: Cannot evaluate" in captured.err
+    assert "2: Invalid resource" in captured.err
+    assert "resources: 2" in captured.err
+
+
+def test_cli_verifies_template_in_strict_mode(tmp_path, capsys) -> None:
+    (tmp_path / "template.json").write_text(json.dumps({"id": "{{ id }}"}))
+
+    assert main([str(tmp_path / "template.json"), "--strict"]) != 0
+    assert "accesses the resource in strict mode" in capsys.readouterr().err
@@ -0,0 +1,107 @@
+import copy
+import pickle
+from typing import Any
+
+import pytest
+from fhirpathpy.models import models
+
+from fpml import FPMLValidationError, IndexedCollection, resolve_template
+from fpml.core.core_types import FPOptions
+
+observations: list[dict[str, Any]] = [
+    {
+        "resourceType": "Observation",
+        "id": "weight",
+        "status": "final",
+        "category": [{"coding": [{"code": "vital-signs"}]}],
+        "code": {"coding": [{"code": "29463-7"}]},
+    },
+    {
+        "resourceType": "Observation",
+        "id": "height",
+        "status": "amended",
+        "category": [{"coding": [{"code": "vital-signs"}]}],
+        "code": {"coding": [{"code": "8302-2"}]},
+    },
+    {
+        "resourceType": "Observation",
+        "id": "glucose",
+        "status": "final",
+        "category": [{"coding": [{"code": "laboratory"}, {"code": "vital-signs"}]}],
+        "code": {"coding": [{"code": "2339-0"}]},
+    },
+    {
+        "resourceType": "Observation",
+        "id": "draft",
+        "code": {"coding": [{"code": 29463}]},
+    },
+]
+
+paths = ["category.coding.code", "code.coding.code", "status", "id"]
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "%Observation.where(category.coding.code = 'vital-signs' and code.coding.code = '29463-7')",
+        "%Observation.where(status = 'final' or status = %status)",
+        "%Observation.where(status in ('final' | 'amended')).id",
+        "%Observation.where(id in %ids and (status = 'final')).id",
+        "%Observation.where(id = %none).id",
+        "%Observation.where(status = 'final').select(%Observation.where(id = 'draft').id)",
+        "%Observation.where(status.exists()).id",
+        "%Observation.where(id = %ids).id",
+    ],
+)
+@pytest.mark.parametrize("fp_options", [None, {"model": models["r4"]}])
+def test_indexed_collection_filters_as_list(expression: str, fp_options: FPOptions) -> None:
+    template = {"result": f"{{[ {expression} ]}}"}
+    context = {"status": "amended", "ids": ["weight", "glucose"], "none": []}
+
+    indexed = IndexedCollection(observations, paths)
+    assert resolve_template(
+        {}, template, {**context, "Observation": indexed}, fp_options
+    ) == resolve_template({}, template, {**context, "Observation": observations}, fp_options)
+
+
+def test_indexed_collection_builds_columns_once() -> None:
+    indexed = IndexedCollection(observations, paths)
+    template = {
+        "vitals": "{[ %Observation.where(category.coding.code = 'vital-signs').id ]}",
+        "weight": "{[ %Observation.where(code.coding.code = '29463-7').id ]}",
+        "amended": "{[ %Observation.where(status = 'amended').id ]}",
+    }
+
+    assert resolve_template({}, template, {"Observation": indexed}) == {
+        "vitals": ["weight", "height"],
+        "weight": ["weight"],
+        "amended": ["height"],
+    }
+    assert sorted(path for path, _ in indexed.columns) == [
+        "category.coding.code",
+        "code.coding.code",
+        "status",
+    ]
+
+
+def test_indexed_collection_falls_back_to_errors_of_evaluation() -> None:
+    template = {"result": "{[ %Observation.where(category.coding.code in ('laboratory')) ]}"}
+
+    with pytest.raises(FPMLValidationError, match="Expected singleton"):
+        resolve_template({}, template, {"Observation": observations})
+    with pytest.raises(FPMLValidationError, match="Expected singleton"):
+        resolve_template({}, template, {"Observation": IndexedCollection(observations, paths)})
+
+
+def test_indexed_collection_copies() -> None:
+    indexed = IndexedCollection(observations, paths)
+
+    for copied in [copy.deepcopy(indexed), pickle.loads(pickle.dumps(indexed))]:
+        assert isinstance(copied, IndexedCollection)
+        assert copied == observations
+        assert copied.paths == indexed.paths
+
+
+def test_indexed_collection_rejects_non_member_paths() -> None:
+    with pytest.raises(ValueError, match="only member paths"):
+        IndexedCollection(observations, ["code.coding.first().code"])
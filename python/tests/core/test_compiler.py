@@ -0,0 +1,112 @@
+import pytest
+
+from fpml.core.cache import SubtreeCache
+from fpml.core.compiler import compile_template
+from fpml.core.core_exceptions import FPMLValidationError
+from fpml.core.extract import resolve_template
+from fpml.core.incremental import IncrementalResolver
+from fpml.core.stream import resolve_template_stream
+
+strict_template = {
+    "resourceType": "Patient",
+    "id": "{{ %QuestionnaireResponse.id }}",
+    "birthDate": "{{ today() }}",
+    "name": {
+        "{{ %QuestionnaireResponse.item.where(linkId = 'name') }}": {
+            "text": "{{ answer.valueString }}"
+        }
+    },
+    "{% if %QuestionnaireResponse.item.exists() %}": {"active": True},
+}
+resource = {
+    "resourceType": "QuestionnaireResponse",
+    "id": "qr",
+    "item": [{"linkId": "name", "answer": [{"valueString": "Name"}]}],
+}
+
+
+def test_compile_template_verifies_strict_mode() -> None:
+    compiled = compile_template(strict_template, strict=True)
+
+    assert compiled.strict_verified
+    assert compiled.strict_violations == []
+
+
+def test_compile_template_reports_violations_with_paths() -> None:
+    template = {
+        "name": [{"text": "{{ item.answer.valueString }}"}],
+        "items": {"{% for item in item %}": "{{ %item.linkId }}"},
+        "{% if status = 'completed' %}": {"active": True},
+    }
+
+    compiled = compile_template(template)
+    assert compiled.strict_violations == [
+        (["name", 0, "text"], "item.answer.valueString"),
+        (["items"], "item"),
+        ([], "status = 'completed'"),
+    ]
+
+    with pytest.raises(FPMLValidationError) as exc:
+        compile_template(template, strict=True)
+    assert exc.value.error_path == "name.0.text"
+
+
+def test_compile_template_checks_context_block_expression() -> None:
+    template = {"names": {"{{ item }}": {"text": "{{ answer.valueString }}"}}}
+
+    assert compile_template(template).strict_violations == [(["names"], "item")]
+
+
+def test_resolve_compiled_template_in_strict_mode() -> None:
+    compiled = compile_template(strict_template, strict=True)
+    context = {"QuestionnaireResponse": resource}
+
+    result = resolve_template(resource, compiled, context, strict=True)
+
+    assert result == resolve_template(resource, strict_template, context, strict=True)
+    assert result["name"] == [{"text": "Name"}]
+
+
+def test_resolve_compiled_template_with_violations_guards_resource() -> None:
+    compiled = compile_template({"id": "{{ id }}"})
+
+    assert resolve_template(resource, compiled) == {"id": "qr"}
+    with pytest.raises(FPMLValidationError):
+        resolve_template(resource, compiled, strict=True)
+
+
+def test_resolve_verified_template_guards_resource_in_evaluated_strings() -> None:
+    template = {"a": "{{ %v }}"}
+    context = {"v": "{{ secret }}"}
+    compiled = compile_template(template, strict=True)
+
+    for strict_template in [template, compiled]:
+        with pytest.raises(FPMLValidationError, match="Forbidden access"):
+            resolve_template({"secret": "S"}, strict_template, context, strict=True)
+    with pytest.raises(FPMLValidationError, match="Forbidden access"):
+        "".join(resolve_template_stream({"secret": "S"}, compiled, context, strict=True))
+    with pytest.raises(FPMLValidationError, match="Forbidden access"):
+        IncrementalResolver(compiled, strict=True).resolve({"secret": "S"}, context)
+
+
+def test_compiled_template_is_independent_from_original() -> None:
+    template = {"id": "{{ %id }}"}
+    compiled = compile_template(template)
+    template["id"] = "{{ id }}"
+
+    assert compiled.strict_verified
+    assert resolve_template({}, compiled, {"id": 1}, strict=True) == {"id": 1}
+
+
+def test_compiled_template_with_cache_and_incremental_resolver() -> None:
+    compiled = compile_template(strict_template, strict=True)
+    context = {"QuestionnaireResponse": resource}
+    expected = resolve_template(resource, strict_template, context, strict=True)
+    cache = SubtreeCache()
+
+    resolve_template(resource, compiled, context, strict=True, cache=cache)
+    assert resolve_template(resource, compiled, context, strict=True, cache=cache) == expected
+    assert cache.hits > 0
+
+    resolver = IncrementalResolver(compiled, strict=True)
+    assert resolver.resolve(resource, context) == expected
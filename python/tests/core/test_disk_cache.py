@@ -0,0 +1,81 @@
+import pytest
+
+from fpml.core import disk_cache
+from fpml.core.cache import SubtreeCache
+from fpml.core.core_exceptions import FPMLValidationError
+from fpml.core.disk_cache import TemplateDiskCache
+from fpml.core.extract import resolve_template
+
+template = {
+    "resourceType": "Patient",
+    "id": "{{ %QuestionnaireResponse.id }}",
+    "name": {"{{ %QuestionnaireResponse.item }}": {"text": "{{ answer.valueString }}"}},
+}
+resource = {
+    "resourceType": "QuestionnaireResponse",
+    "id": "qr",
+    "item": [{"linkId": "name", "answer": [{"valueString": "Name"}]}],
+}
+context = {"QuestionnaireResponse": resource}
+
+
+def test_disk_cache_loads_compiled_template(tmp_path) -> None:
+    expected = resolve_template(resource, template, context)
+    TemplateDiskCache(tmp_path).compile(template)
+
+    cache = TemplateDiskCache(tmp_path)
+    compiled = cache.compile(template, strict=True)
+
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert compiled.expressions.keys() == {
+        "%QuestionnaireResponse.id",
+        "%QuestionnaireResponse.item",
+        "answer.valueString",
+    }
+    assert resolve_template(resource, compiled, context, strict=True) == expected
+
+
+def test_loaded_template_analysis_is_bound_to_its_nodes(tmp_path) -> None:
+    TemplateDiskCache(tmp_path).compile(template)
+    compiled = TemplateDiskCache(tmp_path).compile(template)
+    subtree_cache = SubtreeCache()
+
+    resolve_template(resource, compiled, context, cache=subtree_cache)
+    resolve_template(resource, compiled, context, cache=subtree_cache)
+
+    assert all(id(node) == key for key, (node, _) in compiled.nodes.items())
+    assert subtree_cache.hits > 0
+
+
+def test_disk_cache_recompiles_stale_entries(tmp_path, monkeypatch) -> None:
+    TemplateDiskCache(tmp_path).compile(template)
+    monkeypatch.setattr(disk_cache, "cache_versions", lambda: (1, "0.0.0", "0.0.0"))
+
+    cache = TemplateDiskCache(tmp_path)
+    cache.compile(template)
+    cache.compile(template)
+
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disk_cache_recompiles_broken_entries(tmp_path) -> None:
+    TemplateDiskCache(tmp_path).compile(template)
+    (entry,) = tmp_path.iterdir()
+    entry.write_bytes(entry.read_bytes()[:20])
+
+    cache = TemplateDiskCache(tmp_path)
+
+    assert resolve_template(resource, cache.compile(template), context)["id"] == "qr"
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_disk_cache_verifies_strict_mode_of_loaded_template(tmp_path) -> None:
+    violating = {"id": "{{ id }}"}
+    TemplateDiskCache(tmp_path).compile(violating)
+
+    cache = TemplateDiskCache(tmp_path)
+    with pytest.raises(FPMLValidationError) as exc:
+        cache.compile(violating, strict=True)
+
+    assert cache.hits == 1
+    assert exc.value.error_path == "id"
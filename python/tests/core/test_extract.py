@@ -1,6 +1,12 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import cast
+
 import pytest
 
+from fpml.core.budget import ExecutionBudget
 from fpml.core.constants import undefined
+from fpml.core.core_exceptions import FPMLLimitExceededError
 from fpml.core.core_types import Resource, UserInvocationTable
 from fpml.core.extract import FPMLValidationError, resolve_template
 
@@ -100,6 +106,30 @@ def test_transformation_flattens_array_of_arrays() -> None:
     }
 
 
+def test_transformation_flattens_deeply_nested_arrays() -> None:
+    assert resolve_template(
+        {}, {"result": [[[1, [2, [], [undefined]]], [[[3]]]], [[[4, [5, [6]]]]], []]}
+    ) == {"result": [1, 2, 3, 4, 5, 6]}
+
+
+def test_transformation_flattens_nested_for_blocks() -> None:
+    template = {
+        "result": [
+            {
+                "{% for row in %rows %}": [
+                    "{{ %row.first() }}",
+                    {"{% for cell in %row.tail() %}": ["{{ %cell }}", ["{{ %cell * 10 }}"]]},
+                ]
+            },
+            "{[ %rows.last().tail() ]}",
+        ]
+    }
+
+    assert resolve_template({}, template, {"rows": [[1, 2, 3], [4, 5]]}) == {
+        "result": [1, 2, 20, 3, 30, 4, 5, 50, 5]
+    }
+
+
 def test_transformation_preserves_null_values_from_array() -> None:
     assert resolve_template({}, {"resourceType": "Resource", "result": [1, None, 2, None, 3]}) == {
         "resourceType": "Resource",
@@ -854,6 +884,33 @@ def test_merge_block_merges_multiple_blocks_containing_undefined() -> None:
     assert result == {"resourceType": "Resource", "result": {"a": 1, "b": 2}}
 
 
+def test_merge_block_keeps_order_of_keys_overridden_by_blocks() -> None:
+    result = resolve_template(
+        {},
+        {
+            "a": "{{ 1 }}",
+            "{% merge %}": [{"c": 3, "b": 2}, {"a": 10, "d": 4}, {"c": 30}],
+            "b": "{{ 20 }}",
+        },
+    )
+    assert result == {"a": 10, "b": 2, "c": 30, "d": 4}
+    assert list(result) == ["a", "b", "c", "d"]
+
+
+def test_if_block_implicit_merge_keeps_order_of_keys() -> None:
+    result = resolve_template(
+        {},
+        {
+            "b": 1,
+            "{% if true %}": {"c": 3, "b": 2},
+            "{% else %}": {"d": 4},
+            "a": "{{ 5 }}",
+        },
+    )
+    assert result == {"b": 2, "a": 5, "c": 3}
+    assert list(result) == ["b", "a", "c"]
+
+
 def test_merge_block_fails_on_merge_with_non_object() -> None:
     resource: Resource = {
         "key": "value",
@@ -868,3 +925,178 @@ def test_merge_block_fails_on_merge_with_non_object() -> None:
                 },
             },
         )
+
+
+def test_limits_allow_resolution_within_budget() -> None:
+    resource: Resource = {"list": [{"key": 1}, {"key": 2}]}
+    result = resolve_template(
+        resource,
+        {"result": [{"{% for item in list %}": "{{ %item.key }}"}]},
+        limits={
+            "max_evaluations": 3,
+            "max_output_nodes": 100,
+            "max_loop_iterations": 2,
+            "timeout": 60,
+        },
+    )
+    assert result == {"result": [1, 2]}
+
+
+def test_limits_fail_on_exceeding_max_evaluations() -> None:
+    resource: Resource = {"list": [{"key": 1}, {"key": 2}]}
+    with pytest.raises(FPMLLimitExceededError) as excinfo:
+        resolve_template(
+            resource,
+            {"result": [{"{% for item in list %}": "{{ %item.key }}"}]},
+            limits={"max_evaluations": 2},
+        )
+    assert excinfo.value.limit == "max_evaluations"
+    assert excinfo.value.error_path == "result.0"
+
+
+def test_limits_fail_on_exceeding_max_output_nodes() -> None:
+    with pytest.raises(FPMLLimitExceededError) as excinfo:
+        resolve_template({}, {"a": 1, "b": {"c": 2, "d": 3}}, limits={"max_output_nodes": 4})
+    assert excinfo.value.limit == "max_output_nodes"
+    assert excinfo.value.error_path == "b.c"
+
+
+def test_limits_fail_on_exceeding_max_loop_iterations_of_nested_loops() -> None:
+    resource: Resource = {"list": [1, 2, 3]}
+    with pytest.raises(FPMLLimitExceededError) as excinfo:
+        resolve_template(
+            resource,
+            {
+                "result": {
+                    "{% for x in list %}": {
+                        "{% for y in %context.list %}": "{{ %x * %y }}",
+                    }
+                }
+            },
+            limits={"max_loop_iterations": 8},
+        )
+    assert excinfo.value.limit == "max_loop_iterations"
+    assert excinfo.value.error_path == "result"
+
+
+def test_limits_fail_on_exceeding_max_loop_iterations_of_context_block() -> None:
+    resource: Resource = {"list": [{"key": 1}, {"key": 2}]}
+    with pytest.raises(FPMLLimitExceededError) as excinfo:
+        resolve_template(
+            resource, {"result": {"{{ list }}": "{{ key }}"}}, limits={"max_loop_iterations": 1}
+        )
+    assert excinfo.value.limit == "max_loop_iterations"
+
+
+def test_limits_fail_on_exceeding_timeout() -> None:
+    with pytest.raises(FPMLLimitExceededError) as excinfo:
+        resolve_template({}, {"result": "{{ 1 }}"}, limits={"timeout": -1})
+    assert excinfo.value.limit == "timeout"
+    assert excinfo.value.error_path == "result"
+
+
+def test_limits_error_is_validation_error() -> None:
+    with pytest.raises(FPMLValidationError):
+        resolve_template({}, {"result": "{{ 1 }}"}, limits={"max_evaluations": 0})
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self) -> None:
+        super().__init__(4)
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):  # type: ignore
+        self.submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+def test_parallel_for_block_returns_the_same_output() -> None:
+    template = {
+        "rows": [
+            {
+                "{% for index, row in %rows %}": {
+                    "index": "{{ %index }}",
+                    "cells": [{"{% for cell in %row %}": "{{ %cell * 10 }}"}],
+                    "{% if %index.mod(2) = 0 %}": {"even": True},
+                }
+            }
+        ]
+    }
+    context = {"rows": [[index, index + 1] for index in range(20)]}
+
+    with CountingExecutor() as executor:
+        result = resolve_template(
+            {}, template, context, parallel={"executor": executor, "min_iterations": 2}
+        )
+
+    assert result == resolve_template({}, template, context)
+    # Nested for blocks are resolved sequentially within the iterations
+    assert executor.submitted == len(context["rows"])
+
+
+def test_parallel_for_block_resolves_short_loops_sequentially() -> None:
+    with CountingExecutor() as executor:
+        result = resolve_template(
+            {},
+            {"list": [{"{% for item in %items %}": "{{ %item }}"}]},
+            {"items": [1, 2, 3]},
+            parallel={"executor": executor},
+        )
+
+    assert result == {"list": [1, 2, 3]}
+    assert executor.submitted == 0
+
+
+def test_parallel_for_block_raises_error_of_the_first_failed_iteration() -> None:
+    template = {"list": [{"{% for item in %items %}": {"value": "{{ %item + 1 }}"}}]}
+    context = {"items": [1, 2, "a", 3, "b", 4]}
+
+    with pytest.raises(FPMLValidationError) as sequential:
+        resolve_template({}, template, context)
+
+    with ThreadPoolExecutor(4) as executor, pytest.raises(FPMLValidationError) as parallel:
+        resolve_template(
+            {}, template, context, parallel={"executor": executor, "min_iterations": 1}
+        )
+
+    assert str(parallel.value) == str(sequential.value)
+    assert "['a']" in parallel.value.error_message
+
+
+def test_parallel_for_block_rejects_process_pools() -> None:
+    template = {"list": [{"{% for item in %items %}": "{{ %item }}"}]}
+
+    with ProcessPoolExecutor(1) as executor, pytest.raises(FPMLValidationError) as excinfo:
+        resolve_template(
+            {},
+            template,
+            {"items": [1, 2]},
+            parallel={"executor": cast(ThreadPoolExecutor, executor), "min_iterations": 1},
+        )
+    assert "ThreadPoolExecutor, got ProcessPoolExecutor" in excinfo.value.error_message
+
+
+def test_limits_count_spending_of_parallel_threads() -> None:
+    # Frequent switches of the threads interleave the increments of the counters
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    budget = ExecutionBudget({"max_evaluations": 40000, "max_loop_iterations": 80000})
+
+    def spend(_: int) -> None:
+        for _ in range(5000):
+            budget.spend_evaluation([])
+            budget.spend_loop_iterations([], 2)
+            budget.spend_output_node([])
+
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(spend, range(8)))
+    finally:
+        sys.setswitchinterval(interval)
+    assert (budget.evaluations, budget.loop_iterations, budget.output_nodes) == (
+        40000,
+        80000,
+        40000,
+    )
+    with pytest.raises(FPMLLimitExceededError):
+        budget.spend_evaluation([])
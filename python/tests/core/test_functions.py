@@ -0,0 +1,339 @@
+import copy
+from typing import cast
+
+import pytest
+from fhirpathpy import evaluate  # type: ignore
+from fhirpathpy.models import models  # type: ignore
+
+from fpml import (
+    ConceptMapTranslator,
+    FPMLValidationError,
+    IncrementalResolver,
+    SubtreeCache,
+    answers_function,
+    resolve_function,
+    resolve_template,
+    translate_function,
+)
+from fpml.core import functions
+from fpml.core.core_types import FPOptions, Resource
+from fpml.core.functions import AnswersIndex
+from fpml.core.utils import omit_key
+
+resource: Resource = {
+    "resourceType": "QuestionnaireResponse",
+    "item": [
+        {"linkId": "name", "answer": [{"valueString": "Name"}]},
+        {
+            "linkId": "group",
+            "item": [
+                {"linkId": "code", "answer": [{"valueCoding": {"code": "a"}}]},
+                {"linkId": "name", "answer": [{"valueString": "Nested"}]},
+            ],
+        },
+        {"linkId": "tags", "answer": [{"valueString": "x"}, {"valueString": "y"}]},
+        {"linkId": "empty"},
+    ],
+}
+
+aidbox_resource: Resource = {
+    "resourceType": "QuestionnaireResponse",
+    "item": [
+        {"linkId": "name", "answer": [{"value": {"string": "Name"}}]},
+        {
+            "linkId": "group",
+            "item": [{"linkId": "code", "answer": [{"value": {"Coding": {"code": "a"}}}]}],
+        },
+    ],
+}
+
+
+def test_answers_returns_answers_of_items_at_any_depth() -> None:
+    fp_options = cast(
+        FPOptions,
+        {"model": models["r4"], "userInvocationTable": {"answers": answers_function()}},
+    )
+    template = {
+        "name": "{[ answers('name') ]}",
+        "code": "{{ answers('code').code }}",
+        "tags": "{[ %QuestionnaireResponse.answers('tags') ]}",
+        "empty": "{{ answers('empty') }}",
+        "missing": "{{ answers('missing') }}",
+    }
+
+    result = resolve_template(resource, template, {"QuestionnaireResponse": resource}, fp_options)
+    assert result == {
+        "name": ["Name", "Nested"],
+        "code": "a",
+        "tags": ["x", "y"],
+    }
+
+
+def test_answers_supports_aidbox_format() -> None:
+    fp_options = cast(FPOptions, {"userInvocationTable": {"answers": answers_function(True)}})
+    template = {"name": "{{ answers('name') }}", "code": "{{ answers('code').code }}"}
+
+    assert resolve_template(aidbox_resource, template, {}, fp_options) == {
+        "name": "Name",
+        "code": "a",
+    }
+
+
+def test_answers_are_equal_to_repeat_item_expression() -> None:
+    model_answers = AnswersIndex()
+    aidbox_answers = AnswersIndex(aidbox=True)
+
+    for link_id in ["name", "group", "code", "tags", "empty", "missing"]:
+        expression = f"repeat(item).where(linkId='{link_id}').answer.value"
+        assert model_answers([resource], link_id) == evaluate(
+            resource, expression, None, models["r4"]
+        )
+        assert aidbox_answers([aidbox_resource], link_id) == evaluate(
+            aidbox_resource, f"{expression}.children()", None
+        )
+
+
+def test_answers_index_is_built_once_per_object() -> None:
+    answers = AnswersIndex(maxsize=1)
+
+    index = answers.index([resource])
+    assert answers.index([resource]) is index
+    assert answers([resource], "name") is not answers([resource], "name")
+
+    answers.index([aidbox_resource])
+    assert answers.index([resource]) is not index
+    assert len(answers.indexes) == 1
+
+
+def test_answers_are_indexed_again_after_changes() -> None:
+    fp_options = cast(FPOptions, {"userInvocationTable": {"answers": answers_function()}})
+    questionnaire_response: Resource = {"item": [{"linkId": "x", "answer": [{"valueString": "1"}]}]}
+    template = {"x": "{{ answers('x') }}", "first": "{{ answers('x').first() }}"}
+
+    assert resolve_template(questionnaire_response, template, {}, fp_options) == {
+        "x": "1",
+        "first": "1",
+    }
+    questionnaire_response["item"][0]["answer"][0]["valueString"] = "2"
+    assert resolve_template(questionnaire_response, template, {}, fp_options) == {
+        "x": "2",
+        "first": "2",
+    }
+
+
+def test_answers_with_incremental_resolver() -> None:
+    fp_options = cast(FPOptions, {"userInvocationTable": {"answers": answers_function()}})
+    questionnaire_response: Resource = {"item": [{"linkId": "x", "answer": [{"valueString": "1"}]}]}
+    template = {
+        "x": "{{ %QR.answers('x') }}",
+        "first": "{{ %QR.answers('x').first() }}",
+    }
+    resolver = IncrementalResolver(template, fp_options)
+
+    assert resolver.resolve(questionnaire_response, {"QR": questionnaire_response}) == {
+        "x": "1",
+        "first": "1",
+    }
+    result = resolver.apply_patch(
+        [{"op": "replace", "path": "/item/0/answer/0/valueString", "value": "2"}]
+    )
+    assert result == {"x": "2", "first": "2"}
+
+
+def test_answers_with_incremental_resolver_are_indexed_once_per_resolution(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    builds: list[tuple] = []
+    original = functions.index_answers
+
+    def index_answers(inputs: tuple, aidbox: bool) -> functions.AnswersByLinkId:
+        builds.append(inputs)
+        return original(inputs, aidbox)
+
+    monkeypatch.setattr(functions, "index_answers", index_answers)
+    fp_options = cast(FPOptions, {"userInvocationTable": {"answers": answers_function()}})
+    questionnaire_response: Resource = {
+        "item": [
+            {"linkId": "a", "answer": [{"valueString": "1"}]},
+            {"linkId": "b", "answer": [{"valueString": "2"}]},
+        ]
+    }
+    template = {
+        "a": "{{ %QR.answers('a') }}",
+        "b": "{{ %QR.answers('b') }}",
+        "c": "{{ %QR.answers('c') }}",
+    }
+    resolver = IncrementalResolver(template, fp_options)
+
+    assert resolver.resolve(questionnaire_response, {"QR": questionnaire_response}) == {
+        "a": "1",
+        "b": "2",
+    }
+    assert len(builds) == 1
+    result = resolver.apply_patch(
+        [
+            {
+                "op": "add",
+                "path": "/item/-",
+                "value": {"linkId": "c", "answer": [{"valueString": "3"}]},
+            }
+        ]
+    )
+    assert result == {"a": "1", "b": "2", "c": "3"}
+    assert len(builds) == 2  # noqa: PLR2004
+
+
+concept_map: Resource = {
+    "resourceType": "ConceptMap",
+    "url": "http://example.com/ConceptMap/gender",
+    "version": "1",
+    "group": [
+        {
+            "source": "http://example.com/gender",
+            "target": "http://hl7.org/fhir/administrative-gender",
+            "element": [
+                {"code": "m", "target": [{"code": "male", "equivalence": "equivalent"}]},
+                {
+                    "code": "u",
+                    "target": [
+                        {"code": "unknown", "display": "Unknown", "equivalence": "wider"},
+                        {"code": "other", "equivalence": "unmatched"},
+                    ],
+                },
+            ],
+        }
+    ],
+}
+
+
+def test_translate_translates_codings_by_registered_concept_map() -> None:
+    fp_options = cast(
+        FPOptions, {"userInvocationTable": {"translate": translate_function([concept_map])}}
+    )
+    context = {
+        "coding": {"system": "http://example.com/gender", "code": "u"},
+        "concept": {"coding": [{"system": "http://example.com/gender", "code": "m"}]},
+        "other": {"system": "http://example.com/other", "code": "m"},
+    }
+    template = {
+        "coding": "{[ %coding.translate('http://example.com/ConceptMap/gender') ]}",
+        "concept": "{{ %concept.translate('http://example.com/ConceptMap/gender|1').code }}",
+        "code": "{{ 'm'.translate('http://example.com/ConceptMap/gender').code }}",
+        "other": "{[ %other.translate('http://example.com/ConceptMap/gender') ]}",
+    }
+
+    assert resolve_template({}, template, context, fp_options) == {
+        "coding": [
+            {
+                "system": "http://hl7.org/fhir/administrative-gender",
+                "code": "unknown",
+                "display": "Unknown",
+            }
+        ],
+        "concept": "male",
+        "code": "male",
+    }
+
+
+def test_translate_accepts_concept_map_from_context() -> None:
+    fp_options = cast(FPOptions, {"userInvocationTable": {"translate": translate_function()}})
+    template = {"code": "{{ 'm'.translate(%ConceptMap).code }}"}
+
+    assert resolve_template({}, template, {"ConceptMap": concept_map}, fp_options) == {
+        "code": "male"
+    }
+
+
+def test_translate_fails_on_unknown_concept_map() -> None:
+    fp_options = cast(FPOptions, {"userInvocationTable": {"translate": translate_function()}})
+
+    with pytest.raises(FPMLValidationError, match="is not registered"):
+        resolve_template({}, {"code": "{{ 'm'.translate('http://unknown') }}"}, {}, fp_options)
+
+
+def test_translator_indexes_concept_map_once_per_version() -> None:
+    translator = ConceptMapTranslator([concept_map])
+    index = translator.index(concept_map)
+
+    assert translator.index({**concept_map}) is index
+    assert translator.index({**concept_map, "version": "2"}) is not index
+
+    unversioned = omit_key(concept_map, "version")
+    unversioned_index = translator.index(unversioned)
+    assert translator.index(unversioned) is unversioned_index
+    assert translator.index({**unversioned}) is not unversioned_index
+
+
+def test_translate_distinguishes_versioned_concept_maps_without_url() -> None:
+    fp_options = cast(FPOptions, {"userInvocationTable": {"translate": translate_function()}})
+    first = omit_key(concept_map, "url")
+    second = copy.deepcopy(first)
+    second["group"][0]["element"][0]["target"][0]["code"] = "other"
+    template = {"code": "{{ 'm'.translate(%ConceptMap).code }}"}
+
+    for mapped, code in [(first, "male"), (second, "other"), (first, "male")]:
+        assert resolve_template({}, template, {"ConceptMap": mapped}, fp_options) == {"code": code}
+
+
+def test_resolve_resolves_references_to_context_resources() -> None:
+    fp_options = cast(FPOptions, {"userInvocationTable": {"resolve": resolve_function()}})
+    condition = {"resourceType": "Condition", "id": "c1", "code": {"text": "Flu"}}
+    bundle = {
+        "resourceType": "Bundle",
+        "entry": [
+            {
+                "fullUrl": "urn:uuid:1",
+                "resource": {"resourceType": "Observation", "id": "o1", "status": "final"},
+            },
+            {
+                "fullUrl": "http://example.com/fhir/Observation/o2",
+                "resource": {"resourceType": "Observation", "status": "amended"},
+            },
+        ],
+    }
+    context = {
+        "Condition": condition,
+        "Patients": [{"resourceType": "Patient", "id": "p1", "gender": "male"}],
+        "Bundle": bundle,
+        "Encounter": {
+            "subject": {"reference": "Patient/p1"},
+            "reasonReference": [
+                {"reference": "Condition/c1/_history/2"},
+                {"reference": "Condition/missing"},
+            ],
+            "diagnosis": [
+                {"reference": "urn:uuid:1"},
+                {"reference": "http://example.com/fhir/Observation/o2"},
+                {"reference": "http://other.com/fhir/Observation/o1"},
+            ],
+        },
+    }
+    template = {
+        "gender": "{{ %Encounter.subject.resolve().gender }}",
+        "reasons": "{[ %Encounter.reasonReference.resolve().code.text ]}",
+        "statuses": "{[ %Encounter.diagnosis.resolve().status ]}",
+        "self": "{{ 'Encounter/e1'.resolve().id }}",
+    }
+
+    resource = {"resourceType": "Encounter", "id": "e1"}
+    assert resolve_template(resource, template, context, fp_options) == {
+        "gender": "male",
+        "reasons": ["Flu"],
+        "statuses": ["final", "amended", "final"],
+        "self": "e1",
+    }
+
+
+def test_resolve_is_not_cached_by_subtree_cache() -> None:
+    fp_options = cast(FPOptions, {"userInvocationTable": {"resolve": resolve_function()}})
+    cache = SubtreeCache()
+    template = {"gender": "{{ %subject.resolve().gender }}"}
+
+    for gender in ["male", "female"]:
+        context = {
+            "subject": {"reference": "Patient/p1"},
+            "Patient": {"resourceType": "Patient", "id": "p1", "gender": gender},
+        }
+        assert resolve_template({}, template, context, fp_options, cache=cache) == {
+            "gender": gender
+        }
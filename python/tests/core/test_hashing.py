@@ -0,0 +1,202 @@
+import copy
+import random
+from decimal import Decimal
+from typing import Any, cast
+
+import pytest
+from fhirpathpy import apply_parsed_path  # type: ignore
+from fhirpathpy.engine.invocations import combining, invocation_registry, subsetting
+from fhirpathpy.engine.nodes import FP_Quantity, ResourceNode
+from fhirpathpy.engine.util import get_data  # type: ignore
+from fhirpathpy.models import models
+from fhirpathpy.parser import parse  # type: ignore
+
+from fpml import resolve_template
+from fpml.core import hashing
+from fpml.core.core_types import FPOptions
+from fpml.core.extract import run_expression
+from fpml.core.hashing import HashedCollection, exclude_fn, intersect_fn, structural_hash
+
+
+def test_structural_hash_is_consistent_with_equality() -> None:
+    assert structural_hash({"a": 1, "b": [1, {"c": "x"}]}) == structural_hash(
+        {"b": [1.0, {"c": "x"}], "a": True}
+    )
+    assert structural_hash(Decimal("1.5")) == structural_hash(1.5)
+    assert structural_hash(ResourceNode.create_node({"id": "1"})) == structural_hash({"id": "1"})
+    assert structural_hash([1, 2]) != structural_hash([2, 1])
+    assert structural_hash({"a": "1"}) != structural_hash({"a": 1})
+
+
+def test_structural_hash_rejects_non_json_values() -> None:
+    with pytest.raises(TypeError):
+        structural_hash(FP_Quantity(1, "'kg'"))
+    with pytest.raises(TypeError):
+        structural_hash({"a": {1, 2}})
+
+
+def test_hashed_collection_contains() -> None:
+    collection = HashedCollection([{"a": [1, 2]}, "x", None])
+
+    assert collection.contains({"a": [1.0, 2]})
+    assert collection.contains(ResourceNode.create_node("x"))
+    assert collection.contains(None)
+    assert not collection.contains({"a": [2, 1]})
+    assert not collection.contains("y")
+
+
+def random_value(rng: random.Random, depth: int = 0) -> Any:
+    kind = rng.randrange(6 if depth < 2 else 4)  # noqa: PLR2004
+    if kind == 0:
+        return rng.choice(["a", "b", "1"])
+    if kind == 1:
+        return rng.choice([1, 1.0, 2, True, False, Decimal("2.0")])
+    if kind == 2:  # noqa: PLR2004
+        return None
+    if kind == 3:  # noqa: PLR2004
+        return ResourceNode.create_node({"id": rng.choice(["1", "2"])}, "Resource")
+    if kind == 4:  # noqa: PLR2004
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(3))]
+    keys = rng.sample(["a", "b", "c"], rng.randrange(3))
+    return {key: random_value(rng, depth + 1) for key in keys}
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_exclude_and_intersect_equal_fhirpathpy(seed: int) -> None:
+    rng = random.Random(seed)
+    coll1 = [random_value(rng) for _ in range(rng.randrange(30))]
+    coll2 = [random_value(rng) for _ in range(rng.randrange(30))]
+
+    expected_exclude = combining.exclude_fn({}, coll1, coll2)
+    expected_intersect = subsetting.intersect_fn({}, coll1, coll2)
+    assert [id(item) for item in exclude_fn({}, coll1, coll2)] == [
+        id(item) for item in expected_exclude
+    ]
+    assert [id(item) for item in intersect_fn({}, coll1, coll2)] == [
+        id(item) for item in expected_intersect
+    ]
+
+
+def test_exclude_and_intersect_fall_back_for_quantities() -> None:
+    coll1 = [FP_Quantity(1, "'kg'"), FP_Quantity(1000, "'g'"), "x"]
+    coll2 = [FP_Quantity(1, "'kg'")]
+
+    assert exclude_fn({}, coll1, coll2) == combining.exclude_fn({}, coll1, coll2)
+    assert intersect_fn({}, coll1, coll2) == subsetting.intersect_fn({}, coll1, coll2)
+
+
+def test_collection_functions_in_templates() -> None:
+    entries = [
+        {"resource": {"resourceType": "Observation", "id": str(index)}} for index in range(6)
+    ]
+    context = {"entries": entries, "provenance": [entries[4], entries[1], entries[4]]}
+    template = {
+        "excluded": "{[ %entries.exclude(%provenance).resource.id ]}",
+        "intersected": "{[ %entries.intersect(%provenance).resource.id ]}",
+        "reversed": "{[ %provenance.intersect(%entries).resource.id ]}",
+        "union": "{[ (%provenance | %entries).resource.id ]}",
+    }
+
+    assert resolve_template({}, template, context) == {
+        "excluded": ["0", "2", "3", "5"],
+        "intersected": ["1", "4"],
+        "reversed": ["4", "1"],
+        "union": ["4", "1", "0", "2", "3", "5"],
+    }
+
+
+def test_collection_functions_are_used_by_fpml_only(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: list[Any] = []
+
+    def exclude(*args: Any) -> list[Any]:
+        calls.append(args)
+        return []
+
+    monkeypatch.setattr(hashing, "exclude_fn", exclude)
+    hashing.hashed_collection_functions.cache_clear()
+    registry = cast(dict[str, dict[str, Any]], invocation_registry)
+    builtins = {name: registry[name]["fn"] for name in ["exclude", "intersect"]}
+
+    try:
+        assert resolve_template({}, {"a": "{{ (1 | 2).exclude(1).count() }}"}) == {"a": 0}
+    finally:
+        hashing.hashed_collection_functions.cache_clear()
+    assert len(calls) == 1
+    assert {name: registry[name]["fn"] for name in builtins} == builtins
+
+
+def test_collection_functions_keep_types_of_model_nodes() -> None:
+    patient = {
+        "resourceType": "Patient",
+        "deceasedBoolean": True,
+        "name": [{"given": ["Ann"]}, {"given": ["Bo"]}],
+    }
+    template = {
+        "deceased": "{{ deceased.exclude({}).ofType(boolean) }}",
+        "names": "{[ name.intersect(name.where(given = 'Bo')).given ]}",
+    }
+
+    fp_options = cast(FPOptions, {"model": models["r4"]})
+
+    assert resolve_template(patient, template, None, fp_options) == {
+        "deceased": True,
+        "names": ["Bo"],
+    }
+
+
+def raw_items(items: list[Any]) -> list[Any]:
+    return [(type(item).__name__, getattr(item, "path", None), get_data(item)) for item in items]
+
+
+@pytest.mark.parametrize("with_model", [True, False])
+@pytest.mark.parametrize("raw_data", [True, False])
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "name.given",
+        "birthDate",
+        "deceased.ofType(boolean)",
+        "name.where(use = 'official').exclude(name.where(given = 'Bo')).given",
+        "name.intersect(name.where(given = 'Bo'))",
+        "name.given.twice()",
+        "name.trace('names').given.first()",
+        "%value + 1.5",
+        "today() < @2100-01-01",
+        "(1 'kg' | 2 'kg').exclude(1 'kg')",
+    ],
+)
+def test_run_expression_equals_fhirpathpy(
+    expression: str, raw_data: bool, with_model: bool
+) -> None:
+    patient = {
+        "resourceType": "Patient",
+        "birthDate": "1990-01-01",
+        "_birthDate": {"extension": [{"url": "http://example.com", "valueString": "x"}]},
+        "deceasedBoolean": False,
+        "name": [{"use": "official", "given": ["Ann"]}, {"use": "official", "given": ["Bo"]}],
+    }
+    traces: dict[str, list[Any]] = {"fpml": [], "fhirpathpy": []}
+
+    def options(name: str) -> dict[str, Any]:
+        return {
+            "userInvocationTable": {"twice": {"fn": lambda inputs: inputs * 2, "arity": {0: []}}},
+            "traceFn": lambda value, label: traces[name].append((label, raw_items(value))),
+            "returnRawData": raw_data,
+        }
+
+    model = models["r4"] if with_model else None
+    parsed = parse(expression)
+    context = {"value": 1}
+
+    expected = apply_parsed_path(
+        copy.deepcopy(patient), parsed, context, model, options("fhirpathpy")
+    )
+    actual = run_expression(
+        copy.deepcopy(patient),
+        expression,
+        parse(expression),
+        context,
+        cast(FPOptions, {"model": model, **options("fpml")}),
+    )
+    assert raw_items(actual) == raw_items(expected)
+    assert traces["fpml"] == traces["fhirpathpy"]
@@ -0,0 +1,45 @@
+import importlib.metadata
+import subprocess
+import sys
+
+import fpml
+
+# Cumulative import time of the package in microseconds, 3x the measured 30 ms for shared CI
+# runners, regressions are caught by the list of lazy modules
+import_time_budget = 90_000
+
+# Heavy modules loaded only when they are needed
+lazy_modules = ["fhirpathpy", "antlr4", "importlib.metadata", "concurrent", "logging", "hashlib"]
+
+
+def import_times() -> dict[str, int]:
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import fpml"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_does_not_load_heavy_modules() -> None:
+    times = import_times()
+
+    assert [
+        name for name in times if name.split(".")[0] in lazy_modules or name in lazy_modules
+    ] == []
+
+
+def test_import_time_budget() -> None:
+    # The best of the runs is compared, as single runs are slowed down by other processes
+    assert min(import_times()["fpml"] for _ in range(3)) < import_time_budget
+
+
+def test_version() -> None:
+    assert fpml.__version__ == importlib.metadata.version("fpml")
@@ -0,0 +1,209 @@
+import copy
+from typing import Optional, cast
+
+import pytest
+from fhirpathpy.models import models  # type: ignore
+
+from fpml.core.core_exceptions import FPMLValidationError
+from fpml.core.core_types import FPOptions
+from fpml.core.extract import resolve_template
+from fpml.core.incremental import IncrementalResolver
+from fpml.core.json_patch import apply_patch, make_patch
+
+
+def test_incremental_resolve_reuses_unchanged_nodes() -> None:
+    template = {"a": "{{ a }}", "b": "{{ b }}", "items": {"{% for item in items %}": "{{ %item }}"}}
+    resource = {"a": 1, "b": 2, "items": [1, 2]}
+    resolver = IncrementalResolver(template)
+
+    assert resolver.resolve(resource) == {"a": 1, "b": 2, "items": [1, 2]}
+    assert resolver.evaluations == 5  # noqa: PLR2004
+
+    assert resolver.resolve({**resource, "a": 10}) == {"a": 10, "b": 2, "items": [1, 2]}
+    assert resolver.evaluations == 1
+
+    assert resolver.resolve({**resource, "a": 10}) == {"a": 10, "b": 2, "items": [1, 2]}
+    assert resolver.evaluations == 0
+
+
+def test_incremental_resolve_recomputes_nodes_reading_changed_shape() -> None:
+    template = {"count": "{{ items.count() }}", "first": "{{ items.first() }}"}
+    resolver = IncrementalResolver(template)
+
+    assert resolver.resolve({"items": [1, 2]}) == {"count": 2, "first": 1}
+    assert resolver.resolve({"items": [1, 2, 3]}) == {"count": 3, "first": 1}
+    assert resolver.resolve({"items": [0, 2, 3]}) == {"count": 3, "first": 0}
+    assert resolver.resolve({}) == {"count": 0}
+
+
+def test_incremental_resolve_tracks_context_variables() -> None:
+    template = {"a": "{{ %a }}", "b": "{{ %b.value }}", "c": "{{ c }}"}
+    resolver = IncrementalResolver(template)
+
+    assert resolver.resolve({"c": 3}, {"a": 1, "b": {"value": 2}}) == {"a": 1, "b": 2, "c": 3}
+    assert resolver.resolve({"c": 3}, {"a": 1, "b": {"value": 20}}) == {"a": 1, "b": 20, "c": 3}
+    assert resolver.evaluations == 1
+    assert resolver.resolve({"c": 3}, {"a": [], "b": {"value": 20}}) == {"b": 20, "c": 3}
+    assert resolver.evaluations == 1
+
+
+def test_incremental_resolve_re_evaluates_volatile_expressions() -> None:
+    template = {"now": "{{ now() }}", "a": "{{ a }}"}
+    resolver = IncrementalResolver(template)
+
+    resolver.resolve({"a": 1})
+    resolver.resolve({"a": 1})
+    assert resolver.evaluations == 1
+
+
+def test_incremental_apply_patch() -> None:
+    template = {
+        "{% assign %}": {"total": "{{ items.count() }}"},
+        "items": [
+            {"{% for index, item in items %}": {"index": "{{ %index }}", "value": "{{ %item }}"}}
+        ],
+        "total": "{{ %total }}",
+        "name": "{{ name }}",
+    }
+    resource = {"name": "test", "items": ["a", "b"]}
+    resolver = IncrementalResolver(template)
+    resolver.resolve(resource)
+
+    result = resolver.apply_patch([{"op": "add", "path": "/items/0", "value": "z"}])
+    assert result == {
+        "items": [
+            {"index": 0, "value": "z"},
+            {"index": 1, "value": "a"},
+            {"index": 2, "value": "b"},
+        ],
+        "total": 3,
+        "name": "test",
+    }
+
+    result = resolver.apply_patch([{"op": "replace", "path": "/name", "value": "new"}])
+    assert result["name"] == "new"
+    assert resolver.evaluations == 1
+
+
+def test_incremental_apply_patch_requires_resolved_resource() -> None:
+    resolver = IncrementalResolver({"a": "{{ a }}"})
+
+    with pytest.raises(FPMLValidationError):
+        resolver.apply_patch([{"op": "replace", "path": "/a", "value": 1}])
+
+
+def test_incremental_resolve_after_failure() -> None:
+    template = {"{% if a = 1 %}": {"error": "{{ %undefinedVar }}"}, "a": "{{ a }}"}
+    resolver = IncrementalResolver(template)
+
+    assert resolver.resolve({"a": 2}) == {"a": 2}
+    with pytest.raises(FPMLValidationError):
+        resolver.resolve({"a": 1})
+    assert resolver.resolve({"a": 2}) == {"a": 2}
+
+
+@pytest.mark.parametrize(
+    ("name", "model", "weight_path"),
+    [
+        ("fhir", models["r4"], "/item/0/item/0/answer/0/valueDecimal"),
+        ("aidbox", None, "/item/0/item/0/answer/0/value/decimal"),
+    ],
+)
+def test_incremental_resolve_complex_example(load_yaml_fixture, name, model, weight_path) -> None:
+    context = load_yaml_fixture(f"complex-example.{name}.context.yaml")
+    template = load_yaml_fixture(f"complex-example.{name}.template.yaml")
+    fp_options: Optional[FPOptions] = {"model": model} if model else None
+    resolver = IncrementalResolver(template, fp_options=fp_options)
+
+    resource = context["QuestionnaireResponse"]
+    assert resolver.resolve(resource, context) == load_yaml_fixture(
+        f"complex-example.{name}.result.yaml"
+    )
+    full_evaluations = resolver.evaluations
+
+    patches = [
+        [{"op": "replace", "path": weight_path, "value": 80}],
+        [{"op": "remove", "path": "/item/0/item/2/answer/0"}],
+        [{"op": "remove", "path": "/item/0/item/3"}],
+        [{"op": "add", "path": "/item/0/item/0", "value": {"linkId": "NEW"}}],
+        [{"op": "replace", "path": "/authored", "value": "2025-01-01"}],
+    ]
+    for patch in patches:
+        resource, _ = apply_patch(resource, patch)
+        expected = resolve_template(
+            resource, template, {**context, "QuestionnaireResponse": resource}, fp_options
+        )
+
+        assert resolver.apply_patch(patch) == expected
+        assert resolver.evaluations < full_evaluations
+
+        updated_resource = copy.deepcopy(resource)
+        assert (
+            resolver.resolve(
+                updated_resource, {**context, "QuestionnaireResponse": updated_resource}
+            )
+            == expected
+        )
+        assert resolver.evaluations == 0
+
+
+def test_incremental_resolve_delta() -> None:
+    template = {
+        "name": "{{ name }}",
+        "items": [{"{% for item in items %}": {"value": "{{ %item }}"}}],
+    }
+    resolver = IncrementalResolver(template)
+
+    result = resolver.resolve({"name": "a", "items": [1, 2, 3]})
+    assert resolver.delta == [{"op": "replace", "path": "", "value": result}]
+
+    resolver.apply_patch([{"op": "replace", "path": "/name", "value": "b"}])
+    assert resolver.delta == [{"op": "replace", "path": "/name", "value": "b"}]
+
+    resolver.apply_patch([{"op": "remove", "path": "/items/1"}])
+    assert resolver.delta == [{"op": "remove", "path": "/items/1"}]
+
+    resolver.resolve({"name": "b", "items": [0, 1, 3]})
+    assert resolver.delta == [{"op": "add", "path": "/items/0", "value": {"value": 0}}]
+
+    resolver.resolve({"name": "b", "items": [0, 1, 3]})
+    assert resolver.delta == []
+
+
+def test_incremental_resolve_delta_complex_example(load_yaml_fixture) -> None:
+    context = load_yaml_fixture("complex-example.fhir.context.yaml")
+    template = load_yaml_fixture("complex-example.fhir.template.yaml")
+    fp_options = cast(FPOptions, {"model": models["r4"]})
+    resolver = IncrementalResolver(template, fp_options=fp_options)
+
+    previous = resolver.resolve(context["QuestionnaireResponse"], context)
+    result = resolver.apply_patch(
+        [{"op": "replace", "path": "/item/0/item/3/answer/0/valueCoding/code", "value": "copd"}]
+    )
+
+    assert apply_patch(previous, resolver.delta)[0] == result
+    assert resolver.delta == [
+        {
+            "op": "replace",
+            "path": "/body/entry/4/request/url",
+            "value": "/Condition?category=medicalHistory&code=urn:raw|copd&patient=Patient/pid",
+        },
+        {"op": "replace", "path": "/body/entry/4/resource/code/coding/0/code", "value": "copd"},
+    ]
+
+
+def test_make_patch_skips_shared_subtrees() -> None:
+    class UncomparableList(list):
+        def __eq__(self, other):
+            raise AssertionError("Shared subtree must not be compared")
+
+    shared = UncomparableList([{"a": 1}])
+    source = {"shared": shared, "list": [1, 2, 3, 4], "value": 1}
+    target = {"shared": shared, "list": [1, 3, 4], "value": True}
+
+    patch = make_patch(source, target)
+
+    assert patch == [
+        {"op": "remove", "path": "/list/1"},
+        {"op": "replace", "path": "/value", "value": True},
+    ]
@@ -0,0 +1,139 @@
+from typing import Any, cast
+
+from fhirpathpy.models import models
+
+from fpml import resolve_template
+from fpml.core.core_types import FPOptions
+from fpml.core.memoize import MemoizedFunction, memoized_functions
+
+
+def make_options(fn: Any, **definition: Any) -> FPOptions:
+    return cast(
+        FPOptions,
+        {"userInvocationTable": {"fn": {"fn": fn, "arity": {0: [], 1: ["String"]}, **definition}}},
+    )
+
+
+def test_pure_function_is_called_once_for_the_same_arguments() -> None:
+    calls: list[tuple] = []
+
+    def display(inputs: list, code: str) -> list:
+        calls.append((inputs, code))
+        return [f"{code}-display"]
+
+    fp_options = make_options(display, pure=True)
+    template = {
+        "a": "{{ fn('x') }}",
+        "b": "{{ fn('x') }}",
+        "c": "{{ fn('y') }}",
+    }
+
+    expected = {"a": "x-display", "b": "x-display", "c": "y-display"}
+    assert resolve_template({}, template, {}, fp_options) == expected
+    assert resolve_template({}, template, {}, fp_options) == expected
+    assert len(calls) == 2  # noqa: PLR2004
+    assert memoized_functions[display].hits == 4  # noqa: PLR2004
+
+
+def test_pure_function_is_memoized_by_input_resources() -> None:
+    calls: list[list] = []
+
+    def names(inputs: list) -> list:
+        calls.append(inputs)
+        return [item["name"] for item in inputs]
+
+    fp_options = make_options(names, pure=True)
+    template = {"names": "{[ %items.fn() ]}"}
+
+    first = {"items": [{"name": "a", "tags": ["x"]}]}
+    same = {"items": [{"tags": ["x"], "name": "a"}]}
+    other = {"items": [{"name": "b"}]}
+
+    assert resolve_template({}, template, first, fp_options) == {"names": ["a"]}
+    assert resolve_template({}, template, same, fp_options) == {"names": ["a"]}
+    assert resolve_template({}, template, other, fp_options) == {"names": ["b"]}
+    assert len(calls) == 2  # noqa: PLR2004
+
+
+def test_function_is_not_memoized_by_default() -> None:
+    calls: list[str] = []
+
+    def display(inputs: list, code: str) -> list:
+        calls.append(code)
+        return [code]
+
+    resolve_template({}, {"a": "{{ fn('x') }}", "b": "{{ fn('x') }}"}, {}, make_options(display))
+    assert calls == ["x", "x"]
+    assert display not in memoized_functions
+
+
+def test_memoized_function_evicts_least_recently_used_results() -> None:
+    calls: list[str] = []
+
+    def echo(inputs: list, value: str) -> list:
+        calls.append(value)
+        return [value]
+
+    memoized = MemoizedFunction(echo, maxsize=2)
+    for value in ["a", "b", "a", "c", "b"]:
+        memoized([], value)
+
+    assert calls == ["a", "b", "c", "b"]
+    assert len(memoized.results) == 2  # noqa: PLR2004
+
+
+def test_memoized_function_returns_copies_of_results() -> None:
+    memoized = MemoizedFunction(lambda inputs: [{"code": "a"}])
+
+    memoized([])[0]["code"] = "changed"
+    assert memoized([]) == [{"code": "a"}]
+
+
+def test_pure_function_is_memoized_by_contents_of_model_nodes() -> None:
+    def birth_date(inputs: list, dates: list) -> list:
+        # Arguments are passed as nodes of the model
+        return [dates[0].data]
+
+    fp_options = cast(
+        FPOptions,
+        {
+            "model": models["r4"],
+            "userInvocationTable": {
+                "fn": {"fn": birth_date, "arity": {1: ["Any"]}, "pure": True},
+            },
+        },
+    )
+    template = {"birthDate": "{{ 1.fn(birthDate) }}"}
+
+    for index in range(200):
+        patient = {"resourceType": "Patient", "birthDate": f"{1900 + index}-01-01"}
+        assert resolve_template(patient, template, {}, fp_options) == {
+            "birthDate": f"{1900 + index}-01-01"
+        }
+
+
+def test_pure_function_is_memoized_by_values_of_fhirpath_types() -> None:
+    calls: list[Any] = []
+
+    def show(inputs: list, values: list) -> list:
+        calls.append(values)
+        return [str(values[0])]
+
+    fp_options = cast(
+        FPOptions,
+        {"userInvocationTable": {"fn": {"fn": show, "arity": {1: ["Any"]}, "pure": True}}},
+    )
+    template = {
+        "a": "{{ 1.fn(@2020-01-01) }}",
+        "b": "{{ 1.fn(@2021-01-01) }}",
+        "c": "{{ 1.fn(1 'kg') }}",
+        "d": "{{ 1.fn(@2020-01-01) }}",
+    }
+
+    assert resolve_template({}, template, {}, fp_options) == {
+        "a": "2020-01-01",
+        "b": "2021-01-01",
+        "c": "1 'kg'",
+        "d": "2020-01-01",
+    }
+    assert len(calls) == 3  # noqa: PLR2004
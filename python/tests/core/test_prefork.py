@@ -0,0 +1,43 @@
+import gc
+
+from fpml.core.compiler import CompiledTemplate
+from fpml.core.extract import resolve_template
+from fpml.core.prefork import warm_up
+
+resource = {
+    "resourceType": "QuestionnaireResponse",
+    "id": "qr",
+    "item": [{"linkId": "name", "answer": [{"valueString": "Name"}]}],
+}
+
+
+def test_warm_up_compiles_templates() -> None:
+    templates = {
+        "id": {"id": "{{ id }}"},
+        "name": {"name": "{{ item.where(linkId = 'name').answer.valueString }}"},
+    }
+
+    compiled = warm_up(templates, freeze=False)
+
+    assert set(compiled) == {"id", "name"}
+    assert all(isinstance(template, CompiledTemplate) for template in compiled.values())
+    assert resolve_template(resource, compiled["name"]) == {"name": "Name"}
+
+
+def test_warm_up_freezes_objects() -> None:
+    try:
+        warm_up({"id": {"id": "{{ id }}"}})
+        assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+
+
+def test_compiled_template_evaluates_parsed_expressions(load_yaml_fixture) -> None:
+    context = load_yaml_fixture("complex-example.aidbox.context.yaml")
+    template = load_yaml_fixture("complex-example.aidbox.template.yaml")
+    qr = context["QuestionnaireResponse"]
+
+    compiled = warm_up({"template": template}, freeze=False)["template"]
+
+    assert compiled.expressions
+    assert resolve_template(qr, compiled, context) == resolve_template(qr, template, context)
@@ -0,0 +1,60 @@
+import pytest
+
+from fpml.core.core_exceptions import FPMLValidationError
+from fpml.core.disk_cache import template_hash
+from fpml.core.registry import TemplateRegistry
+
+resource = {"resourceType": "Patient", "id": "foo", "name": [{"text": "Name"}]}
+
+
+def test_registry_resolves_by_content_hash() -> None:
+    registry = TemplateRegistry()
+    template = {"id": "{{ id }}"}
+
+    template_id = registry.register(template)
+
+    assert template_id == template_hash(template)
+    assert registry.register({"id": "{{ id }}"}) == template_id
+    assert len(registry) == 1
+    assert registry.resolve(template_id, resource) == {"id": "foo"}
+
+
+def test_registry_collects_stats() -> None:
+    registry = TemplateRegistry()
+    template_id = registry.register({"id": "{{ %Patient.id }}"})
+
+    registry.resolve(template_id, resource, {"Patient": resource})
+    with pytest.raises(FPMLValidationError):
+        registry.resolve(template_id, resource)
+
+    stats = registry.stats(template_id)
+    assert (stats.resolutions, stats.errors) == (2, 1)
+    assert stats.mean_time > 0
+
+
+def test_registry_evicts_least_recently_used() -> None:
+    registry = TemplateRegistry(maxsize=2)
+    first = registry.register({"a": 1})
+    second = registry.register({"b": 2})
+
+    registry.get(first)
+    third = registry.register({"c": 3})
+
+    assert first in registry
+    assert third in registry
+    assert second not in registry
+    with pytest.raises(KeyError):
+        registry.resolve(second, resource)
+
+
+def test_registry_verifies_strict_mode() -> None:
+    registry = TemplateRegistry()
+    template = {"id": "{{ id }}"}
+
+    with pytest.raises(FPMLValidationError):
+        registry.register(template, strict=True)
+    assert len(registry) == 0
+
+    registry.register(template)
+    with pytest.raises(FPMLValidationError):
+        registry.register(template, strict=True)
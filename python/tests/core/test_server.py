@@ -0,0 +1,211 @@
+import asyncio
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from typing import Any
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+from fpml.server import TemplateServer, asgi_app, wsgi_app
+
+patient_context = {"resourceType": "Patient", "id": "foo"}
+patient_template = {"id": "{{ Patient.id }}", "name": "{{ name }}"}
+extract_template = {
+    "id": "{{ QuestionnaireResponse.id }}",
+    "value": "{{ answers('q1') }}",
+    "extraContextVar": "{{ %extraContextVar.toInteger() }}",
+}
+
+
+def extract_context(answer: dict) -> dict:
+    return {
+        "QuestionnaireResponse": {
+            "resourceType": "QuestionnaireResponse",
+            "id": "foo",
+            "item": [{"linkId": "q1", "answer": [answer]}],
+        },
+        "extraContextVar": "1",
+    }
+
+
+# Requests and responses of the e2e tests of the TypeScript server
+e2e_cases = [
+    ("/r4/parse-template", patient_context, patient_template, {"id": "foo"}),
+    ("/parse-template", patient_context, patient_template, {"id": "foo"}),
+    ("/aidbox/parse-template", patient_context, patient_template, {"id": "foo"}),
+    (
+        "/parse-template",
+        extract_context({"valueDecimal": 10}),
+        extract_template,
+        {"id": "foo", "value": 10, "extraContextVar": 1},
+    ),
+    (
+        "/aidbox/parse-template",
+        extract_context({"value": {"decimal": 10}}),
+        extract_template,
+        {"id": "foo", "value": 10, "extraContextVar": 1},
+    ),
+    ("/parse-template", {}, {"foo": {"bar": {"baz": 1}}}, {"foo": {"bar": {"baz": 1}}}),
+    (
+        "/parse-template",
+        {"resourceType": "Patient", "id": {"foo": {"bar": {"baz": 1}}}},
+        {"id": "{{ Patient.id }}"},
+        {"id": {"foo": {"bar": {"baz": 1}}}},
+    ),
+]
+
+
+def call_wsgi(server: TemplateServer, method: str, path: str, body: Any = None) -> tuple:
+    path, _, query = path.partition("?")
+    content = json.dumps(body).encode() if body is not None else b""
+    environ: dict[str, Any] = {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "CONTENT_LENGTH": str(len(content)),
+        "wsgi.input": io.BytesIO(content),
+    }
+    setup_testing_defaults(environ)
+    statuses = []
+    response = wsgi_app(server)(environ, lambda status, headers: statuses.append(status))
+    return int(statuses[0].split()[0]), json.loads(b"".join(response))
+
+
+def call_asgi(server: TemplateServer, method: str, path: str, body: Any = None) -> tuple:
+    path, _, query = path.partition("?")
+    scope = {"type": "http", "method": method, "path": path, "query_string": query.encode()}
+    messages = [{"type": "http.request", "body": json.dumps(body).encode()}]
+    sent: list[dict] = []
+
+    async def receive() -> dict:
+        return messages.pop(0)
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    asyncio.run(asgi_app(server)(scope, receive, send))
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+@pytest.mark.parametrize("call", [call_wsgi, call_asgi])
+@pytest.mark.parametrize(("path", "context", "template", "expected"), e2e_cases)
+def test_server_e2e(call, path, context, template, expected) -> None:
+    server = TemplateServer()
+
+    assert call(server, "POST", path, {"context": context, "template": template}) == (
+        200,
+        expected,
+    )
+
+
+def test_server_health_and_errors() -> None:
+    server = TemplateServer()
+
+    assert call_wsgi(server, "GET", "/health") == (200, {"status": "ok"})
+    assert call_wsgi(server, "GET", "/parse-template")[0] == HTTPStatus.METHOD_NOT_ALLOWED
+    assert call_wsgi(server, "POST", "/unknown", {})[0] == HTTPStatus.NOT_FOUND
+
+    status, outcome = call_wsgi(
+        server,
+        "POST",
+        "/parse-template?strict=true",
+        {"context": {}, "template": {"id": "{{ id }}"}},
+    )
+    assert status == HTTPStatus.BAD_REQUEST
+    assert outcome["resourceType"] == "OperationOutcome"
+    assert outcome["issue"][0]["expression"] == ["id"]
+
+
+def test_server_caches_compiled_templates_and_reports_metrics() -> None:
+    server = TemplateServer()
+    body = {"context": patient_context, "template": patient_template}
+
+    for _ in range(3):
+        call_wsgi(server, "POST", "/parse-template", body)
+
+    status, metrics = call_wsgi(server, "GET", "/metrics")
+    assert status == HTTPStatus.OK
+    assert metrics["requests"] == {"/parse-template": 3}
+    assert metrics["templateCache"] == {"hits": 2, "misses": 1}
+    assert metrics["latency"]["p50"] > 0
+
+
+@pytest.mark.parametrize("call", [call_wsgi, call_asgi])
+def test_server_resolves_in_process_pool(call) -> None:
+    path, context, template, expected = e2e_cases[3]
+    server = TemplateServer(executor=ProcessPoolExecutor(1))
+    try:
+        for _ in range(2):
+            assert call(server, "POST", path, {"context": context, "template": template}) == (
+                200,
+                expected,
+            )
+        assert server.metrics.report()["templateCache"] == {"hits": 1, "misses": 1}
+    finally:
+        server.close()
+
+
+@pytest.mark.parametrize("call", [call_wsgi, call_asgi])
+def test_server_resolves_registered_template(call) -> None:
+    path, context, template, expected = e2e_cases[3]
+    server = TemplateServer()
+
+    status, registered = call(server, "POST", "/templates", {"template": template})
+    assert status == HTTPStatus.CREATED
+    assert call(server, "POST", "/templates", {"template": template}) == (HTTPStatus.OK, registered)
+
+    for _ in range(2):
+        assert call(server, "POST", path, {"templateId": registered["id"], "context": context}) == (
+            HTTPStatus.OK,
+            expected,
+        )
+
+    status, stats = call(server, "GET", f"/templates/{registered['id']}")
+    assert status == HTTPStatus.OK
+    assert (stats["resolutions"], stats["errors"]) == (2, 0)
+
+
+def test_server_reports_unknown_template() -> None:
+    server = TemplateServer()
+
+    status, outcome = call_wsgi(server, "POST", "/parse-template", {"templateId": "unknown"})
+    assert status == HTTPStatus.NOT_FOUND
+    assert outcome["issue"][0]["diagnostics"] == "Template 'unknown' is not registered"
+    assert call_wsgi(server, "GET", "/templates/unknown")[0] == HTTPStatus.NOT_FOUND
+
+
+def test_server_returns_template_etag() -> None:
+    server = TemplateServer()
+    content = json.dumps({"template": patient_template}).encode()
+    environ: dict[str, Any] = {
+        "REQUEST_METHOD": "POST",
+        "PATH_INFO": "/templates",
+        "CONTENT_LENGTH": str(len(content)),
+        "wsgi.input": io.BytesIO(content),
+    }
+    setup_testing_defaults(environ)
+    headers: list = []
+
+    response = wsgi_app(server)(
+        environ, lambda status, response_headers: headers.extend(response_headers)
+    )
+
+    template_id = json.loads(b"".join(response))["id"]
+    assert ("ETag", f'"{template_id}"') in headers
+    assert ("Location", f"/templates/{template_id}") in headers
+
+
+def test_server_sends_registered_template_to_workers_once() -> None:
+    path, context, template, expected = e2e_cases[4]
+    server = TemplateServer(executor=ProcessPoolExecutor(1))
+    try:
+        template_id = call_wsgi(server, "POST", "/templates", {"template": template})[1]["id"]
+        for _ in range(3):
+            assert call_wsgi(
+                server, "POST", path, {"templateId": template_id, "context": context}
+            ) == (HTTPStatus.OK, expected)
+        assert server.metrics.report()["templateCache"] == {"hits": 2, "misses": 1}
+    finally:
+        server.close()
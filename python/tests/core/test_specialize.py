@@ -0,0 +1,237 @@
+import json
+import re
+from pathlib import Path
+from typing import Any, Optional
+
+import pytest
+import yaml
+from fhirpathpy.models import models
+
+from fpml import (
+    FPMLLimitExceededError,
+    FPMLValidationError,
+    compile_template,
+    resolve_template,
+    specialize,
+)
+from fpml.core.core_types import Context, FPOptions, Resource
+
+fixtures = Path(__file__).parent / "fixtures"
+
+organization = {
+    "resourceType": "Organization",
+    "id": "org-1",
+    "name": "Acme",
+    "codes": [{"code": "a", "display": "A"}, {"code": "b", "display": "B"}],
+}
+static_context: Context = {"Organization": organization, "system": "http://x", "flag": True}
+
+resources: list[Resource] = [
+    {"id": "p1", "name": [{"given": ["Ann"]}, {"given": ["Bo"]}]},
+    {"id": "p2"},
+]
+
+
+def assert_specializes(
+    resource: Resource,
+    template: Any,
+    static_context: Context,
+    context: Optional[Context] = None,
+    fp_options: Optional[FPOptions] = None,
+) -> Any:
+    residual = specialize(template, static_context, fp_options)
+    full_context = {**static_context, **(context or {})}
+
+    expected = resolve_template(resource, template, full_context, fp_options)
+    actual = resolve_template(resource, residual, full_context, fp_options)
+    # The order of the keys is preserved as well
+    assert json.dumps(actual) == json.dumps(expected)
+
+    return residual
+
+
+@pytest.mark.parametrize("resource", resources)
+@pytest.mark.parametrize(
+    "template",
+    [
+        {
+            "source": "{{ %Organization.name }}",
+            "tags": "{[ %Organization.codes.code ]}",
+            "empty": "{{ %Organization.missing }}",
+            "null": "{{+ %Organization.missing +}}",
+            "text": "{{ %Organization.name }}: {{ id }} ({{ %system }})",
+            "missing": "{{ id }}: {{ %Organization.missing }}",
+        },
+        {
+            "{% assign %}": [{"ref": "Organization/{{ %Organization.id }}"}, {"pid": "{{ id }}"}],
+            "ref": "{{ %ref }}",
+            "pid": "{{ %pid + %ref }}",
+        },
+        {
+            "a": {"{% if %flag %}": {"flagged": True}, "id": "{{ id }}"},
+            "b": {"{% if %flag.not() %}": {"unflagged": True}, "id": "{{ id }}"},
+        },
+        {
+            "a": {"{% if %flag %}": "{{ %system }}", "{% else %}": "{{ id }}"},
+            "b": {"{% if %flag.not() %}": "{{ id }}"},
+            "c": {"{% if %flag %}": {"id": "changed"}, "id": "{{ id }}"},
+            "d": {"{% if %flag %}": {"x": "{{ %system }}"}, "{% else %}": {}, "id": "{{ id }}"},
+        },
+        {
+            "entry": [
+                {"{% for c in %Organization.codes %}": {"code": "{{ %c.code }}", "id": "{{ id }}"}},
+                {"{% for i, c in %Organization.codes %}": "{{ %i }}"},
+                {"{% for c in %Organization.codes %}": {"{% if %c.code = 'a' %}": "{{ %c }}"}},
+                {"{% for c in %Organization.codes %}": {"ref": "{{ id + %c.code }}"}},
+                {"{% for c in %Organization.missing %}": "{{ %c }}"},
+            ]
+        },
+        {
+            "names": {"{{ name }}": {"given": "{{ given }}", "org": "{{ %Organization.name }}"}},
+            "empty": {"{{ %Organization.missing }}": "{{ id }}"},
+        },
+        {"{% merge %}": [{"a": "{{ %system }}"}, {"b": "{{ id }}"}], "c": "{{ %flag }}"},
+        ["{{ %Organization.missing }}", ["{[ %Organization.codes.display ]}", "{{ id }}"]],
+    ],
+)
+def test_specialize_resolves_as_original(resource: Resource, template: Any) -> None:
+    assert_specializes(resource, template, static_context)
+
+
+@pytest.mark.parametrize("dynamic", [True, False])
+@pytest.mark.parametrize(
+    "template",
+    [
+        {"b": {"{% if %d %}": None, "a": []}},
+        {"b": {"{% if %d %}": "x", "a": "{{ %s }}"}},
+        {"b": {"{% if %d %}": {"x": 1}, "a": "{{ %s }}"}},
+        {"b": {"{% if %d %}": {"a": 1}, "{% else %}": None, "a": "{{ %s }}"}},
+        {"b": {"{% if %d.not() %}": "x", "{% else %}": {"c": "{{ %s }}"}, "a": "{{ %s }}"}},
+        {"b": {"{% assign %}": {"e": "{{ %s }}"}, "{% if %d %}": "x", "a": "{{ %e }}"}},
+        {"b": {"{% if %d %}": {"{% if %d %}": "x", "a": "{{ %s }}"}}},
+    ],
+)
+def test_specialize_keeps_merging_of_if_blocks(template: Any, dynamic: bool) -> None:
+    static: Context = {"s": []} if dynamic else {"s": [], "d": True}
+    context: Context = {"d": True} if dynamic else {}
+    residual = specialize(template, static)
+    full_context = {**static, **context}
+
+    try:
+        expected = resolve_template({}, template, full_context)
+    except FPMLValidationError as exc:
+        with pytest.raises(FPMLValidationError, match=re.escape(exc.error_message)):
+            resolve_template({}, residual, full_context)
+    else:
+        assert json.dumps(resolve_template({}, residual, full_context)) == json.dumps(expected)
+
+
+def test_specialize_folds_static_expressions() -> None:
+    template = {
+        "{% assign %}": [{"ref": "Organization/{{ %Organization.id }}"}, {"pid": "{{ id }}"}],
+        "managingOrganization": {"reference": "{{ %ref }}"},
+        "identifier": "{{ %pid }}",
+        "{% if %flag %}": {"active": True},
+        "codes": {"{% for c in %Organization.codes %}": {"code": "{{ %c.code }}"}},
+        "text": "{{ %Organization.name }}: {{ id }}",
+    }
+
+    assert specialize(template, static_context) == {
+        "{% assign %}": [{"pid": "{{ id }}"}],
+        "managingOrganization": {"reference": "Organization/org-1"},
+        "identifier": "{{ %pid }}",
+        "codes": [{"code": "a"}, {"code": "b"}],
+        "text": "Acme: {{ id }}",
+        "active": True,
+    }
+
+
+def test_specialize_reduces_evaluations() -> None:
+    template = {
+        "codes": {
+            "{% for c in %Organization.codes %}": {
+                "code": "{{ %c.code }}",
+                "display": "{{ %c.display }}",
+                "system": "{{ %system }}",
+            }
+        },
+        "id": "{{ id }}",
+    }
+    residual = specialize(template, static_context)
+
+    with pytest.raises(FPMLLimitExceededError):
+        resolve_template(resources[0], template, static_context, limits={"max_evaluations": 1})
+    assert resolve_template(
+        resources[0], residual, static_context, limits={"max_evaluations": 1}
+    ) == resolve_template(resources[0], template, static_context)
+
+
+def test_specialize_keeps_dynamic_expressions() -> None:
+    calls: list[Any] = []
+
+    def impure(inputs: list[Any]) -> list[Any]:
+        calls.append(inputs)
+        return inputs
+
+    fp_options: FPOptions = {
+        "userInvocationTable": {
+            "impure": {"fn": impure, "arity": {0: []}},
+            "pure": {"fn": lambda inputs: inputs, "arity": {0: []}, "pure": True},
+        }
+    }
+    template = {
+        "impure": "{{ %system.impure() }}",
+        "pure": "{{ %system.pure() }}",
+        "now": "{{ now() }}",
+        "context": "{{ %context.id }}",
+        "undefined": "{{ %dynamic }}",
+        "resource": "{{ id }}",
+    }
+
+    assert specialize(template, static_context, fp_options) == {**template, "pure": "http://x"}
+    assert calls == []
+
+
+def test_specialize_respects_shadowing() -> None:
+    template = {
+        "{% assign %}": [{"system": "{{ id }}"}],
+        "system": "{{ %system }}",
+        "items": {"{% for flag in %Organization.codes %}": "{{ %flag.code + id }}"},
+        "flag": "{{ %flag }}",
+    }
+
+    residual = assert_specializes(resources[0], template, static_context)
+    assert residual["system"] == "{{ %system }}"
+    assert residual["flag"] is True
+
+
+def test_specialize_keeps_failing_expressions() -> None:
+    template = {"code": "{{ %Organization.codes.code + 1 }}", "id": "{{ id }}"}
+
+    residual = specialize(template, static_context)
+    assert residual == template
+    with pytest.raises(FPMLValidationError, match="Cannot evaluate"):
+        resolve_template(resources[0], residual, static_context)
+
+
+def test_specialize_does_not_fold_template_syntax() -> None:
+    context = {"markup": "{{ id }}", "nested": {"{% if true %}": "a"}}
+    template = {"markup": "{{ %markup }}", "nested": "{{ %nested }}", "text": "x {{ %markup }}"}
+
+    assert assert_specializes(resources[0], template, context) == template
+
+
+@pytest.mark.parametrize(
+    ("flavour", "fp_options"), [("fhir", {"model": models["r4"]}), ("aidbox", None)]
+)
+def test_specialize_complex_example(flavour: str, fp_options: Optional[FPOptions]) -> None:
+    with open(fixtures / f"complex-example.{flavour}.context.yaml") as file:
+        context = yaml.safe_load(file)
+    with open(fixtures / f"complex-example.{flavour}.template.yaml") as file:
+        template = yaml.safe_load(file)
+    resource = context.pop("QuestionnaireResponse")
+
+    assert_specializes(resource, template, context, {"QuestionnaireResponse": resource}, fp_options)
+    assert_specializes(
+        resource, compile_template(template), context, {"QuestionnaireResponse": resource}
+    )
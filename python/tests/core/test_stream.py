@@ -0,0 +1,177 @@
+import json
+from pathlib import Path
+from typing import Any, Optional
+
+import pytest
+import yaml
+from fhirpathpy.models import models
+
+from fpml import (
+    FPMLLimitExceededError,
+    FPMLValidationError,
+    compile_template,
+    resolve_template,
+    resolve_template_stream,
+)
+from fpml.core.constants import undefined
+from fpml.core.core_types import Context, FPOptions, Resource
+
+fixtures = Path(__file__).parent / "fixtures"
+
+
+def assert_streams_as_resolved(
+    resource: Resource,
+    template: Any,
+    context: Optional[Context] = None,
+    fp_options: Optional[FPOptions] = None,
+) -> None:
+    expected = json.dumps(resolve_template(resource, template, context, fp_options))
+    assert "".join(resolve_template_stream(resource, template, context, fp_options)) == expected
+    assert (
+        "".join(resolve_template_stream(resource, template, context, fp_options, chunk_size=1))
+        == expected
+    )
+
+
+@pytest.mark.parametrize(
+    ("template", "context"),
+    [
+        ({"result": [[[1, [2, [], [undefined]]], [[[3]]]], [[[4, [5, [6]]]]], []]}, None),
+        (
+            {
+                "a": {},
+                "b": [],
+                "c": [{}],
+                "d": None,
+                "e": "{{ %missing }}",
+                "f": "{{+ %missing +}}",
+                "g": "{[ %missing ]}",
+                "h": "{[ %xs ]}",
+                "i": ["{[ %xs ]}", "{[ %missing ]}"],
+            },
+            {"xs": [1, 2], "missing": []},
+        ),
+        (
+            {
+                "result": [
+                    {
+                        "{% for row in %rows %}": [
+                            "{{ %row.first() }}",
+                            {
+                                "{% for cell in %row.tail() %}": [
+                                    "{{ %cell }}",
+                                    ["{{ %cell * 10 }}"],
+                                ]
+                            },
+                        ]
+                    },
+                    "{[ %rows.last().tail() ]}",
+                ]
+            },
+            {"rows": [[1, 2, 3], [4, 5]]},
+        ),
+        (
+            {
+                "entry": [
+                    {
+                        "{% for i in %n %}": {
+                            "resource": {"id": "{{ %i }}", "note": "{{ %missing }}"},
+                            "{% if %i mod 2 = 0 %}": {"even": True},
+                        }
+                    }
+                ]
+            },
+            {"n": list(range(10)), "missing": []},
+        ),
+        (
+            {
+                "{% merge %}": [{"a": "{{ 1 }}"}, {"b": 2}],
+                "c": 3,
+                "{% assign %}": [{"v": 5}],
+                "d": "{{ %v }}",
+            },
+            None,
+        ),
+        ({"x": {"{% for i in %n %}": {"{% for j in %n %}": "{{ %j }}"}}}, {"n": [1, 2]}),
+        ({"x": {"{% for i in %n %}": "{{ %i }}"}}, {"n": []}),
+        (None, None),
+        (undefined, None),
+        ("text", None),
+        ([], None),
+    ],
+)
+def test_resolve_template_stream_equals_json_dumps(
+    template: Any, context: Optional[Context]
+) -> None:
+    assert_streams_as_resolved({}, template, context)
+
+
+@pytest.mark.parametrize(
+    ("flavour", "fp_options"), [("fhir", {"model": models["r4"]}), ("aidbox", None)]
+)
+def test_resolve_template_stream_complex_example(
+    flavour: str, fp_options: Optional[FPOptions]
+) -> None:
+    with open(fixtures / f"complex-example.{flavour}.context.yaml") as file:
+        context = yaml.safe_load(file)
+    with open(fixtures / f"complex-example.{flavour}.template.yaml") as file:
+        template = yaml.safe_load(file)
+
+    assert_streams_as_resolved(context["QuestionnaireResponse"], template, context, fp_options)
+    assert_streams_as_resolved(
+        context["QuestionnaireResponse"], compile_template(template), context, fp_options
+    )
+
+
+def test_resolve_template_stream_resolves_iterations_lazily() -> None:
+    seen: list[int] = []
+
+    def track(inputs: list, value: int) -> int:
+        seen.append(value)
+        return value
+
+    fp_options: FPOptions = {
+        "userInvocationTable": {"track": {"fn": track, "arity": {1: ["Integer"]}}}
+    }
+    template = {"entry": [{"{% for i in %n %}": {"id": "{{ track(%i) }}"}}]}
+    chunks = resolve_template_stream({}, template, {"n": [1, 2, 3]}, fp_options, chunk_size=1)
+
+    assert next(chunks) == '{"entry": [{"id": 1'
+    assert next(chunks) == "}"
+    assert seen == [1]
+    assert next(chunks) == ', {"id": 2'
+    assert seen == [1, 2]
+    assert "".join(chunks) == '}, {"id": 3}]}'
+
+
+def test_resolve_template_stream_raises_after_partial_output() -> None:
+    template = {"entry": [{"{% for i in %n %}": {"name": "{{ %i + 'th' }}"}}]}
+    chunks = resolve_template_stream({}, template, {"n": ["1", "2", 3]}, chunk_size=1)
+
+    output: list[str] = []
+    with pytest.raises(FPMLValidationError):
+        output.extend(chunks)
+
+    assert "".join(output) == '{"entry": [{"name": "1th"}, {"name": "2th"}'
+
+
+def test_resolve_template_stream_chunk_size() -> None:
+    template = {"entry": [{"{% for i in %n %}": {"id": "{{ %i }}"}}]}
+    context = {"n": list(range(100))}
+
+    chunks = list(resolve_template_stream({}, template, context, chunk_size=100))
+
+    assert "".join(chunks) == json.dumps(resolve_template({}, template, context))
+    assert len(chunks) > 1
+    assert all(len(chunk) >= 100 for chunk in chunks[:-1])  # noqa: PLR2004
+
+
+def test_resolve_template_stream_limits() -> None:
+    template = {"entry": [{"{% for i in %n %}": {"id": "{{ %i }}"}}]}
+
+    with pytest.raises(FPMLLimitExceededError):
+        list(
+            resolve_template_stream(
+                {}, template, {"n": list(range(100))}, limits={"max_loop_iterations": 10}
+            )
+        )